@@ -0,0 +1,1013 @@
+"""Офлайн-бенчмарки и нагрузочный тест бота.
+
+Фейковые Bot API и MetaForge (event-timers) работают в отдельном процессе, чтобы не делить цикл событий
+с ботом; задержка и доля ошибок настраиваются. Сеть наружу не нужна, настоящий токен тоже.
+
+Примеры:
+    python bench.py users --users 200 --rounds 3      # синтетические пользователи: p50/p99, пропускная способность, RSS
+    python bench.py micro --scales 1 2 5 10           # расчёт расписания и форматирование на растущих payload
+    python bench.py transport --updates 3000          # polling против webhook
+    python bench.py alloc                             # выделения памяти на обновление (tracemalloc): готовые клавиатуры и сборка на вызов
+    python bench.py overhead                          # цена инструментирования (метрики) на обновление
+    python bench.py scaling --workers 1 2 4           # bot.py в режиме супервизора: рост пропускной способности с числом воркеров
+    python bench.py upstream --refreshes 100          # байты и CPU разбора на обновление кэша MetaForge в устойчивом режиме
+    python bench.py broadcast --recipients 100000     # рассылка: скорость движка и соблюдение лимита рядом с пользователями
+    python bench.py inline --queries 2000             # inline-запросы: время обработчика на новом снимке и из запомненных
+    python bench.py all                               # всё вышеперечисленное с небольшими параметрами
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import hashlib
+import argparse
+import itertools
+import statistics
+import tempfile
+import tracemalloc
+from collections import Counter
+
+import aiohttp
+from aiohttp import web
+
+FAKE_TOKEN = "123456:BENCH"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+EVENT_TIMERS_PATH = "/api/arc-raiders/event-timers"
+# Получатели рассылки в бенчмарке — чаты с id от этого числа, чтобы не пересекаться с синтетическими пользователями
+BROADCAST_CHAT_BASE = 10 ** 9
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# Шаги сценария одного пользователя: (тип обновления, текст или callback_data)
+USER_FLOW = (
+    ("message", "/start"),
+    ("callback", "events"),
+    ("callback", "refresh_events"),
+    ("callback", "start_menu"),
+    ("callback", "feedback_start"),
+    ("message", "Синтетический отзыв для бенчмарка"),
+)
+
+# --- Генерация расписания ---
+def make_payload(scale, windows_per_event=6, seed=0):
+    """Ответ event-timers: 20 * scale объектов (событие, карта) по windows_per_event окон в каждом.
+
+    scale=1 — примерно сегодняшний размер ответа MetaForge. Среди окон есть переходящие через полночь и '24:00'.
+    """
+    from bot import EVENT_KEYS, MAP_KEYS
+    rng = random.Random(seed)
+    pairs = [(name, location) for name in EVENT_KEYS for location in MAP_KEYS]
+    data = []
+    for number in range(20 * scale):
+        if number < len(pairs):
+            name, location = pairs[number]
+        else:
+            # Сверх реальных пар — синтетические события, чтобы число ключей росло вместе с payload
+            name, location = f"Synthetic Event {number}", MAP_KEYS[number % len(MAP_KEYS)]
+        step = 24 * 60 // windows_per_event
+        times = []
+        for window in range(windows_per_event):
+            start = window * step + rng.randrange(0, step // 2)
+            end = start + rng.choice((30, 60, 90))
+            if window == windows_per_event - 1 and number % 3 == 0:
+                start, end = 23 * 60, 24 * 60 + 60  # Через полночь: 23:00 - 01:00
+            elif window == windows_per_event - 1 and number % 3 == 1:
+                end = 24 * 60  # До конца суток: '24:00'
+            end_text = "24:00" if end == 24 * 60 else f"{end // 60 % 24:02d}:{end % 60:02d}"
+            times.append({"start": f"{start // 60:02d}:{start % 60:02d}", "end": end_text})
+        data.append({"name": name, "map": location, "times": times})
+    return {"data": data}
+
+# --- Фейковые серверы (дочерний процесс) ---
+def fake_result(method, params, message_ids):
+    """Поле result успешного ответа Bot API на вызов method."""
+    if method == "getMe":
+        return BOT_USER
+    if method in ("sendMessage", "editMessageText", "editMessageReplyMarkup"):
+        chat_id = int(params.get("chat_id", 0))
+        message_id = int(params["message_id"]) if params.get("message_id") is not None else next(message_ids)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": params.get("text") or "",
+        }
+    return True
+
+class FakeServers:
+    """Bot API и MetaForge на одном aiohttp-сервере, плюс служебные /_bench/* для управления из драйвера."""
+
+    def __init__(self, api_latency, api_error_rate, api_flood_rate, upstream_latency, upstream_error_rate, scale, seed,
+                 blocked_rate=0.0):
+        self.api_latency = api_latency
+        self.api_error_rate = api_error_rate
+        self.api_flood_rate = api_flood_rate
+        # Доля получателей рассылки, заблокировавших бота (ответ 403)
+        self.blocked_rate = blocked_rate
+        self.upstream_latency = upstream_latency
+        self.upstream_error_rate = upstream_error_rate
+        self.rng = random.Random(seed)
+        self.payload_body = b""
+        self.payload_etag = None
+        self.payload_last_modified = None
+        # Отвечать ли 304 на условный запрос; без этого бот может опираться только на хэш тела
+        self.upstream_validators = True
+        self.set_scale(scale, seed)
+        self.calls = Counter()
+        self.updates = []
+        self._updates_ready = asyncio.Event()
+        self._message_ids = itertools.count(1_000_000)
+        self._waiters = []
+        # Номер прогона: getUpdates от уже остановленного бота не должен забрать обновления следующего
+        self.generation = 0
+
+    def set_scale(self, scale, seed=0):
+        self.payload_body = json.dumps(make_payload(scale, seed=seed)).encode()
+        self.payload_etag = '"%s"' % hashlib.sha1(self.payload_body).hexdigest()
+        self.payload_last_modified = time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime())
+
+    def app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_bot_api)
+        app.router.add_get(EVENT_TIMERS_PATH, self.handle_event_timers)
+        app.router.add_post("/_bench/updates", self.handle_push_updates)
+        app.router.add_get("/_bench/stats", self.handle_stats)
+        app.router.add_get("/_bench/wait", self.handle_wait)
+        app.router.add_post("/_bench/reset", self.handle_reset)
+        return app
+
+    async def _delay(self, latency):
+        if latency > 0:
+            # Экспоненциальное распределение вокруг заданного среднего — хвосты как у настоящей сети
+            await asyncio.sleep(self.rng.expovariate(1 / latency))
+
+    async def handle_event_timers(self, request):
+        self.calls["event-timers"] += 1
+        await self._delay(self.upstream_latency)
+        if self.rng.random() < self.upstream_error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        if not self.upstream_validators:
+            return web.Response(body=self.payload_body, content_type="application/json")
+        headers = {"ETag": self.payload_etag, "Last-Modified": self.payload_last_modified}
+        if request.headers.get("If-None-Match") == self.payload_etag:
+            self.calls["event-timers-304"] += 1
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=self.payload_body, content_type="application/json", headers=headers)
+
+    async def handle_bot_api(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        await self._delay(self.api_latency)
+        chat_id = int(params.get("chat_id") or 0)
+        if method == "sendMessage" and chat_id >= BROADCAST_CHAT_BASE and (chat_id * 2654435761) % 1000 < self.blocked_rate * 1000:
+            self.calls["blocked"] += 1
+            return web.json_response({"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"},
+                                     status=403)
+        roll = self.rng.random()
+        if roll < self.api_flood_rate:
+            return web.json_response({
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            }, status=429)
+        if roll < self.api_flood_rate + self.api_error_rate:
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        self.calls[method] += 1
+        self._notify_waiters()
+        return web.json_response({"ok": True, "result": fake_result(method, params, self._message_ids)})
+
+    async def _get_updates(self, params):
+        generation = self.generation
+        timeout = min(float(params.get("timeout", 0) or 0), 1.0)
+        if not self.updates and timeout > 0:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        await self._delay(self.api_latency)
+        if generation != self.generation:
+            return []
+        limit = int(params.get("limit", 100) or 100)
+        batch, self.updates = self.updates[:limit], self.updates[limit:]
+        return batch
+
+    async def handle_push_updates(self, request):
+        self.updates.extend(await request.json())
+        self._updates_ready.set()
+        return web.json_response({"queued": len(self.updates)})
+
+    async def handle_stats(self, request):
+        return web.json_response(dict(self.calls))
+
+    async def handle_wait(self, request):
+        """Ждёт, пока Bot API получит count успешных вызовов method (или истечёт timeout)."""
+        method = request.query["method"]
+        count = int(request.query["count"])
+        timeout = float(request.query.get("timeout", 120))
+        future = asyncio.get_running_loop().create_future()
+        waiter = (method, count, future)
+        self._waiters.append(waiter)
+        self._notify_waiters()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        return web.json_response({"calls": self.calls[method]})
+
+    def _notify_waiters(self):
+        for waiter in list(self._waiters):
+            method, count, future = waiter
+            if self.calls[method] >= count and not future.done():
+                future.set_result(None)
+                self._waiters.remove(waiter)
+
+    async def handle_reset(self, request):
+        self.generation += 1
+        self.calls.clear()
+        self.updates.clear()
+        body = await request.json() if request.can_read_body else {}
+        if "scale" in body:
+            self.set_scale(body["scale"], body.get("seed", 0))
+        if "upstream_validators" in body:
+            self.upstream_validators = body["upstream_validators"]
+        return web.json_response({"ok": True})
+
+async def serve_fake_servers(args):
+    servers = FakeServers(
+        args.api_latency, args.api_error_rate, args.api_flood_rate,
+        args.upstream_latency, args.upstream_error_rate, args.scale, args.seed, args.blocked_rate,
+    )
+    runner = web.AppRunner(servers.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    port = runner.addresses[0][1]
+    print(f"PORT {port}", flush=True)
+    # Работаем, пока драйвер не закроет stdin
+    await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)
+    await runner.cleanup()
+
+class FakeServersProcess:
+    """Запускает FakeServers в дочернем процессе и даёт драйверу адрес и служебные вызовы."""
+
+    def __init__(self, args):
+        self.args = args
+        self.process = None
+        self.base_url = None
+        self.session = None
+
+    async def __aenter__(self):
+        a = self.args
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), "fake-servers", "--port", "0",
+            "--api-latency", str(a.api_latency), "--api-error-rate", str(a.api_error_rate),
+            "--api-flood-rate", str(a.api_flood_rate), "--upstream-latency", str(a.upstream_latency),
+            "--upstream-error-rate", str(a.upstream_error_rate), "--scale", str(a.scale), "--seed", str(a.seed),
+            "--blocked-rate", str(a.blocked_rate),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            env=bench_environment(a),
+        )
+        line = (await self.process.stdout.readline()).decode().strip()
+        if not line.startswith("PORT "):
+            raise RuntimeError(f"Фейковые серверы не запустились: {line!r}")
+        self.base_url = f"http://127.0.0.1:{line.split()[1]}"
+        self.session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+        self.process.stdin.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 5)
+        except asyncio.TimeoutError:
+            self.process.kill()
+
+    async def push_updates(self, updates):
+        async with self.session.post(f"{self.base_url}/_bench/updates", json=updates) as response:
+            return await response.json()
+
+    async def stats(self):
+        async with self.session.get(f"{self.base_url}/_bench/stats") as response:
+            return await response.json()
+
+    async def wait_calls(self, method, count, timeout=120):
+        params = {"method": method, "count": str(count), "timeout": str(timeout)}
+        async with self.session.get(f"{self.base_url}/_bench/wait", params=params) as response:
+            return (await response.json())["calls"]
+
+    async def reset(self, **body):
+        async with self.session.post(f"{self.base_url}/_bench/reset", json=body) as response:
+            return await response.json()
+
+# --- Подготовка бота ---
+# Явно заданная база состояний; иначе каждый процесс бенчмарка работает со своей временной
+USER_FSM_DB_PATH = os.environ.get("FSM_DB_PATH")
+_state_dir = None
+
+def bench_environment(args):
+    """Окружение процесса бота: фейковый токен, временная база, метрики и лимиты Telegram отключены."""
+    global _state_dir
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", FAKE_TOKEN)
+    if USER_FSM_DB_PATH:
+        env["FSM_DB_PATH"] = USER_FSM_DB_PATH
+    else:
+        if _state_dir is None:
+            _state_dir = tempfile.TemporaryDirectory(prefix="bot-bench-")
+        env["FSM_DB_PATH"] = os.path.join(_state_dir.name, f"state-{os.getpid()}-{next(_databases)}.sqlite3")
+    # Сохранённый снимок MetaForge из рабочей копии не должен подменять ответы фейкового сервера
+    env["UPSTREAM_SNAPSHOT_PATH"] = ""
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env.setdefault("METRICS_PORT", "0")
+    if not getattr(args, "real_limits", False):
+        # Иначе пропускная способность упрётся в OUTBOUND_GLOBAL_RATE (30/с), а не в код бота
+        env.setdefault("OUTBOUND_GLOBAL_RATE", "1000000")
+        env.setdefault("OUTBOUND_CHAT_RATE", "1000000")
+        env.setdefault("OUTBOUND_CHAT_BURST", "1000000")
+    return env
+
+def import_bot(args, base_url=None):
+    """Импортирует bot.py с окружением бенчмарка и направляет его на фейковые серверы."""
+    os.environ.update(bench_environment(args))
+    import bot as app
+    from aiogram.client.telegram import TelegramAPIServer
+    if base_url is not None:
+        app.EVENT_TIMERS_API_URL = base_url + EVENT_TIMERS_PATH
+        app.bot.session.api = TelegramAPIServer.from_base(base_url)
+    return app
+
+_databases = itertools.count()
+_update_ids = itertools.count(1)
+
+def user_object(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+def make_update(kind, user_id, payload, message_id=1):
+    """Синтетическое обновление Telegram: сообщение пользователя, нажатие кнопки под сообщением бота или inline-запрос."""
+    chat = {"id": user_id, "type": "private"}
+    if kind == "inline":
+        return {"update_id": next(_update_ids), "inline_query": {
+            "id": str(next(_update_ids)), "from": user_object(user_id), "query": payload, "offset": "",
+        }}
+    if kind == "message":
+        message = {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": user_object(user_id), "text": payload}
+        if payload.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(payload.split()[0])}]
+        return {"update_id": next(_update_ids), "message": message}
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)),
+        "from": user_object(user_id),
+        "chat_instance": str(user_id),
+        "data": payload,
+        "message": {"message_id": message_id, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "…"},
+    }}
+
+# --- Статистика ---
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def rss_megabytes():
+    """Текущий и пиковый RSS процесса в МБ (Linux /proc, иначе пик из getrusage)."""
+    try:
+        with open("/proc/self/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+        return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+        return None, peak
+
+def print_table(title, header, rows):
+    print(f"\n== {title} ==")
+    widths = [max(len(str(item)) for item in column) for column in zip(header, *rows)]
+    for row in (header, *rows):
+        print("  ".join(str(item).rjust(width) for item, width in zip(row, widths)))
+
+def ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+def us(seconds):
+    return f"{seconds * 1e6:.1f}"
+
+def measure(function, min_time=0.3):
+    """Среднее время одного вызова: повторяет, пока суммарно не наберётся min_time секунд."""
+    function()
+    calls, started = 0, time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls
+
+async def ameasure(function, min_time=0.3):
+    await function()
+    calls, started = 0, time.perf_counter()
+    while True:
+        await function()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls
+
+# --- Синтетические пользователи ---
+async def feed(app, update):
+    from aiogram.types import Update
+    await app.dp.feed_update(app.bot, Update.model_validate(update, context={"bot": app.bot}))
+
+async def run_user_flows(app, users, rounds, concurrency, user_offset=0):
+    """Прогоняет users пользователей по USER_FLOW rounds раз; возвращает задержки по шагам, ошибки и время."""
+    latencies = {f"{kind}:{payload}"[:24]: [] for kind, payload in USER_FLOW}
+    errors = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_user(user_id):
+        async with semaphore:
+            for _ in range(rounds):
+                for kind, payload in USER_FLOW:
+                    step = f"{kind}:{payload}"[:24]
+                    started = time.perf_counter()
+                    try:
+                        await feed(app, make_update(kind, user_id, payload, message_id=user_id % 1_000_000 + 1))
+                    except Exception as e:
+                        errors[type(e).__name__] += 1
+                    latencies[step].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(user_offset + number + 1) for number in range(users)))
+    return latencies, errors, time.perf_counter() - started
+
+async def bench_users(args):
+    async with FakeServersProcess(args) as servers:
+        app = import_bot(args, servers.base_url)
+        await app.dp.emit_startup(bot=app.bot)
+        try:
+            await app.get_events_snapshot()
+            rss_before, _ = rss_megabytes()
+            latencies, errors, elapsed = await run_user_flows(app, args.users, args.rounds, args.concurrency)
+            rss_after, rss_peak = rss_megabytes()
+            calls = await servers.stats()
+        finally:
+            await app.dp.emit_shutdown(bot=app.bot)
+            await app.bot.session.close()
+
+    total = sum(len(values) for values in latencies.values())
+    everything = [value for values in latencies.values() for value in values]
+    rows = [(step, len(values), ms(percentile(values, 0.5)), ms(percentile(values, 0.99)), ms(max(values)))
+            for step, values in latencies.items()]
+    rows.append(("ALL", total, ms(percentile(everything, 0.5)), ms(percentile(everything, 0.99)), ms(max(everything))))
+    print_table(
+        f"Пользователи: {args.users} x {args.rounds} раунда, параллельно {args.concurrency}, "
+        f"задержка Bot API {args.api_latency * 1000:.0f}мс",
+        ("шаг", "n", "p50 мс", "p99 мс", "max мс"), rows,
+    )
+    print(f"Пропускная способность: {total / elapsed:.0f} обновлений/с за {elapsed:.2f}с")
+    print(f"RSS: до {rss_before or 0:.1f} МБ, после {rss_after or 0:.1f} МБ, пик {rss_peak:.1f} МБ")
+    print(f"Вызовы Bot API: {dict(calls)}")
+    if errors:
+        print(f"Ошибки обработчиков: {dict(errors)}")
+    return {
+        "updates": total, "elapsed": elapsed, "throughput": total / elapsed,
+        "p50": percentile(everything, 0.5), "p99": percentile(everything, 0.99),
+        "steps": {step: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99)} for step, values in latencies.items()},
+        "rss_mb": rss_after, "rss_peak_mb": rss_peak, "errors": dict(errors), "api_calls": calls,
+    }
+
+# --- Микробенчмарки расписания и форматирования ---
+async def bench_micro(args):
+    app = import_bot(args)
+    rows = []
+    results = {}
+    for scale in args.scales:
+        payload = make_payload(scale, seed=args.seed)
+        windows = sum(len(item["times"]) for item in payload["data"])
+        compile_time = measure(lambda: app.ScheduleIndex.from_payload(payload), args.min_time)
+        lookup_time = measure(lambda: app.calculate_events(payload), args.min_time)
+        # Кэш MetaForge уже свежий: измеряем ровно то, что делает обработчик после получения payload
+        app.events_cache.value = payload
+        app.events_cache.fetched_at = time.monotonic() + 10 ** 6
+        calculated_time = await ameasure(app.get_arc_raiders_events_from_api_calculated, args.min_time)
+        active, upcoming = app.calculate_events(payload)
+        format_time = measure(
+            lambda: (app.format_event_message(active, "active"), app.format_event_message(upcoming, "upcoming")),
+            args.min_time,
+        )
+        snapshot_time = measure(lambda: app.EventsSnapshot(0, None, active, upcoming), args.min_time)
+        rows.append((f"{scale}x", len(payload["data"]), windows, us(compile_time), us(lookup_time),
+                     us(calculated_time), us(format_time), us(snapshot_time)))
+        results[scale] = {
+            "keys": len(payload["data"]), "windows": windows, "compile": compile_time, "lookup": lookup_time,
+            "calculated": calculated_time, "format": format_time, "snapshot": snapshot_time,
+        }
+    print_table(
+        "Расписание и форматирование (мкс на вызов)",
+        ("размер", "ключей", "окон", "компиляция", "calculate_events", "..._calculated", "format_event_message", "снимок"),
+        rows,
+    )
+    print("Компиляция выполняется один раз на новый payload; на запрос приходятся calculate_events и чтение снимка.")
+    return results
+
+# --- Polling против webhook ---
+async def run_transport_mode(args):
+    """Один режим в отдельном процессе (после остановки диспетчера хранилище закрыто, поэтому процесс на режим)."""
+    async with FakeServersProcess(args) as servers:
+        app = import_bot(args, servers.base_url)
+        updates = [make_update("message", 10_000 + number % args.users, "/start") for number in range(args.updates)]
+        if args.mode == "polling":
+            await servers.push_updates(updates)
+            started = time.perf_counter()
+            polling = asyncio.create_task(app.dp.start_polling(app.bot, handle_signals=False, close_bot_session=False))
+            await servers.wait_calls("sendMessage", args.updates)
+            elapsed = time.perf_counter() - started
+            await app.dp.stop_polling()
+            await polling
+        else:
+            runner = web.AppRunner(app.create_webhook_app(), access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", 0).start()
+            webhook_url = f"http://127.0.0.1:{runner.addresses[0][1]}{app.WEBHOOK_PATH}"
+            headers = {"X-Telegram-Bot-Api-Secret-Token": app.WEBHOOK_SECRET}
+            semaphore = asyncio.Semaphore(args.concurrency)
+            async with aiohttp.ClientSession() as client:
+                async def post(update):
+                    async with semaphore:
+                        async with client.post(webhook_url, json=update, headers=headers) as response:
+                            await response.read()
+
+                started = time.perf_counter()
+                await asyncio.gather(*(post(update) for update in updates))
+                await servers.wait_calls("sendMessage", args.updates)
+                elapsed = time.perf_counter() - started
+            await runner.cleanup()
+        await app.bot.session.close()
+    print(json.dumps({"mode": args.mode, "updates": args.updates, "elapsed": elapsed}), flush=True)
+
+async def bench_transport(args):
+    results = {}
+    for mode in ("polling", "webhook"):
+        command = [
+            sys.executable, os.path.abspath(__file__), "transport-run", "--mode", mode,
+            "--updates", str(args.updates), "--users", str(args.users), "--concurrency", str(args.concurrency),
+            "--api-latency", str(args.api_latency), "--scale", str(args.scale),
+        ]
+        if args.real_limits:
+            command.append("--real-limits")
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+        output, _ = await process.communicate()
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        results[mode] = result["updates"] / result["elapsed"]
+    print_table(
+        f"Polling против webhook: {args.updates} команд /start, задержка Bot API {args.api_latency * 1000:.0f}мс",
+        ("режим", "обновлений/с"), [(mode, f"{rate:.0f}") for mode, rate in results.items()],
+    )
+    return results
+
+# --- Выделения памяти по обработчикам ---
+def keyboard_rows(markup):
+    """Аргументы кнопок готовой клавиатуры: по ним дерево собирается заново, как раньше в каждом обработчике."""
+    return [[button.model_dump(exclude_none=True) for button in row] for row in markup.inline_keyboard]
+
+def per_call_keyboards(app):
+    """Вариант "до": обработчики получают клавиатуры, собранные заново на каждый вызов, а не готовые объекты.
+
+    Возвращает (шаг сценария -> функция, вызываемая перед обновлением внутри замера, восстановление).
+    Главное меню пересобирается в глобальной переменной модуля, список событий — через build_events_keyboard.
+    Пересобранные клавиатуры не узнаются по id (STATIC_MARKUP_KEYS), поэтому отпечаток считается по сериализации.
+    """
+    from aiogram import types
+    main_menu, events_page_keyboard = app.MAIN_MENU_KEYBOARD, app.events_page_keyboard
+    main_menu_rows = keyboard_rows(main_menu)
+
+    def rebuild_main_menu():
+        app.MAIN_MENU_KEYBOARD = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(**button) for button in row] for row in main_menu_rows
+        ])
+
+    def rebuilt_events_keyboard(page, total, lang="ru", live=False):
+        if total <= 1:
+            return app.build_events_keyboard(lang, live=live)
+        return events_page_keyboard(page, total, lang, live)
+
+    def restore():
+        app.MAIN_MENU_KEYBOARD, app.events_page_keyboard = main_menu, events_page_keyboard
+
+    app.events_page_keyboard = rebuilt_events_keyboard
+    return {("message", "/start"): rebuild_main_menu, ("callback", "start_menu"): rebuild_main_menu}, restore
+
+async def measure_allocations(app, iterations, user_base, before_feed=None):
+    """Шаг сценария -> (пики, оставшиеся байты) по каждому обновлению."""
+    before_feed = before_feed or {}
+    results = {}
+    for kind, payload in USER_FLOW:
+        user_ids = range(user_base, user_base + iterations)
+        if kind == "message" and not payload.startswith("/"):
+            # Текст обратной связи обрабатывается только в состоянии ожидания сообщения
+            for user_id in user_ids:
+                await feed(app, make_update("callback", user_id, "feedback_start", message_id=user_id))
+        prepare = before_feed.get((kind, payload))
+        peaks, retained = [], []
+        for user_id in user_ids:
+            update = make_update(kind, user_id, payload, message_id=user_id)
+            current_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            if prepare is not None:
+                prepare()
+            await feed(app, update)
+            current_after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current_before)
+            retained.append(current_after - current_before)
+        results[f"{kind}:{payload}"[:24]] = (peaks, retained)
+    return results
+
+async def bench_alloc(args):
+    async with FakeServersProcess(args) as servers:
+        app = import_bot(args, servers.base_url)
+        await app.dp.emit_startup(bot=app.bot)
+        try:
+            await app.get_events_snapshot()
+            # Прогрев: первые вызовы создают сессии, кэши и ленивые объекты
+            await run_user_flows(app, 20, 2, 20, user_offset=50_000)
+            tracemalloc.start()
+            prebuilt = await measure_allocations(app, args.iterations, 60_000)
+            before_feed, restore = per_call_keyboards(app)
+            try:
+                rebuilt = await measure_allocations(app, args.iterations, 70_000, before_feed)
+            finally:
+                restore()
+            tracemalloc.stop()
+        finally:
+            await app.dp.emit_shutdown(bot=app.bot)
+            await app.bot.session.close()
+    rows = []
+    results = {}
+    for step, (peaks, retained) in prebuilt.items():
+        rebuilt_peaks, rebuilt_retained = rebuilt[step]
+        results[step] = {
+            "peak_bytes": statistics.median(peaks), "retained_bytes": statistics.mean(retained),
+            "rebuilt_peak_bytes": statistics.median(rebuilt_peaks), "rebuilt_retained_bytes": statistics.mean(rebuilt_retained),
+        }
+        rows.append((
+            step, f"{results[step]['peak_bytes'] / 1024:.1f}", f"{results[step]['rebuilt_peak_bytes'] / 1024:.1f}",
+            f"{results[step]['retained_bytes'] / 1024:.2f}", f"{results[step]['rebuilt_retained_bytes'] / 1024:.2f}",
+        ))
+    print_table(
+        f"Память на обновление (tracemalloc, {args.iterations} обновлений на шаг): готовые клавиатуры и сборка на каждый вызов",
+        ("шаг", "пик КБ готовые", "пик КБ сборка", "осталось КБ готовые", "осталось КБ сборка"), rows,
+    )
+    return results
+
+# --- Цена инструментирования ---
+def install_in_process_bot_api(app):
+    """Отвечает на вызовы Bot API без сети (ответ разбирается так же, как настоящий) — остаётся только работа бота."""
+    from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+    class InProcessBotAPI(BaseRequestMiddleware):
+        def __init__(self):
+            self.message_ids = itertools.count(1_000_000)
+
+        async def __call__(self, make_request, bot, method):
+            params = {name: getattr(method, name, None) for name in ("chat_id", "message_id", "text")}
+            content = json.dumps({"ok": True, "result": fake_result(method.__api_method__, params, self.message_ids)})
+            return bot.session.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    # Регистрируется после исходящей очереди, то есть вызывается ею вместо HTTP-запроса
+    app.bot.session.middleware(InProcessBotAPI())
+
+_saved_instrumentation = {}
+
+def set_instrumentation(app, enabled):
+    """Включает или выключает метрики: middleware обработчиков и запись в гистограммы/счётчики."""
+    saved = _saved_instrumentation
+    if not saved:
+        saved.update(observe=app.Histogram.observe, inc=app.Counter.inc, enter=app._Timer.__enter__, exit=app._Timer.__exit__)
+    observers = (app.dp.message.middleware, app.dp.callback_query.middleware, app.dp.inline_query.middleware)
+    if enabled:
+        app.Histogram.observe, app.Counter.inc = saved["observe"], saved["inc"]
+        app._Timer.__enter__, app._Timer.__exit__ = saved["enter"], saved["exit"]
+        for manager in observers:
+            if app.handler_metrics not in manager:
+                manager.register(app.handler_metrics)
+    else:
+        app.Histogram.observe = lambda self, value, label_value=None: None
+        app.Counter.inc = lambda self, label_value=None, amount=1: None
+        app._Timer.__enter__ = lambda self: self
+        app._Timer.__exit__ = lambda self, *exc_info: False
+        for manager in observers:
+            if app.handler_metrics in manager:
+                manager.unregister(app.handler_metrics)
+
+async def bench_overhead(args):
+    # Без сети: иначе разница в микросекунды тонет в шуме HTTP
+    app = import_bot(args)
+    install_in_process_bot_api(app)
+    app.events_cache.value = make_payload(args.scale, seed=args.seed)
+    app.events_cache.fetched_at = time.monotonic() + 10 ** 6
+    await app.dp.emit_startup(bot=app.bot)
+    samples = {True: [], False: []}
+    try:
+        await app.get_events_snapshot()
+        await run_user_flows(app, args.users, 1, 1, user_offset=70_000)
+        # Пользователи идут по одному, режимы чередуются, берётся лучший повтор: так меньше шума от GC и фоновых задач
+        for repeat in range(args.repeats):
+            for enabled in (True, False):
+                set_instrumentation(app, enabled)
+                offset = 100_000 + (repeat * 2 + enabled) * args.users
+                latencies, _, elapsed = await run_user_flows(app, args.users, 1, 1, user_offset=offset)
+                samples[enabled].append(elapsed / sum(len(values) for values in latencies.values()))
+        set_instrumentation(app, True)
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot)
+        await app.bot.session.close()
+
+    def timed_block():
+        with app.HANDLER_SECONDS.time("bench"):
+            pass
+
+    timer = measure(timed_block, args.min_time)
+    with_metrics = min(samples[True])
+    without_metrics = min(samples[False])
+    print_table(
+        "Цена инструментирования (лучший из повторов, мкс на обновление)",
+        ("метрики", "мкс/обновление"),
+        [("включены", us(with_metrics)), ("выключены", us(without_metrics)),
+         ("разница", f"{us(with_metrics - without_metrics)} ({(with_metrics / without_metrics - 1) * 100:+.1f}%)")],
+    )
+    print(f"Один замер гистограммы (time() + observe): {us(timer)} мкс")
+    return {"with": with_metrics, "without": without_metrics, "timer": timer}
+
+# --- Масштабирование по процессам ---
+async def bench_scaling(args):
+    """bot.py целиком (polling через фейковый Bot API) с разным числом воркеров; 1 — обычный режим без супервизора."""
+    results = {}
+    async with FakeServersProcess(args) as servers:
+        for workers in args.workers:
+            await servers.reset()
+            env = bench_environment(args)
+            env.update(
+                BOT_WORKERS=str(workers), BOT_MODE="polling", TELEGRAM_API_URL=servers.base_url,
+                EVENT_TIMERS_API_URL=servers.base_url + EVENT_TIMERS_PATH,
+            )
+            process = await asyncio.create_subprocess_exec(sys.executable, BOT_PATH, env=env)
+            try:
+                # Прогрев: по 50 чатов на воркер, чтобы все процессы успели подняться до замера
+                warmup = [make_update("message", 20_000 + number, "/start") for number in range(workers * 50)]
+                await servers.push_updates(warmup)
+                await servers.wait_calls("sendMessage", len(warmup))
+                updates = [make_update("message", 30_000 + number % args.users, "/start") for number in range(args.updates)]
+                started = time.perf_counter()
+                await servers.push_updates(updates)
+                handled = await servers.wait_calls("sendMessage", len(warmup) + args.updates)
+                elapsed = time.perf_counter() - started
+                if handled < len(warmup) + args.updates:
+                    print(f"Внимание: при {workers} воркерах обработано {handled - len(warmup)} из {args.updates}")
+            finally:
+                process.send_signal(signal.SIGTERM)
+                await process.wait()
+            results[workers] = (handled - len(warmup)) / elapsed
+    base = results[args.workers[0]]
+    print_table(
+        f"Масштабирование: {args.updates} команд /start от {args.users} чатов, ядер CPU: {os.cpu_count()}",
+        ("воркеров", "обновлений/с", "ускорение"),
+        [(workers, f"{rate:.0f}", f"x{rate / base:.2f}") for workers, rate in results.items()],
+    )
+    return results
+
+# --- Рассылка ---
+async def wait_broadcast(app, broadcast_id, timeout):
+    """Ждёт окончания рассылки; возвращает затраченное время."""
+    started = time.perf_counter()
+    while app.broadcaster.active() is not None and time.perf_counter() - started < timeout:
+        await asyncio.sleep(0.05)
+    return time.perf_counter() - started
+
+async def bench_broadcast(args):
+    """Рассылка: (1) скорость движка без лимитов на args.recipients получателей;
+    (2) с глобальным лимитом Telegram — фактическая скорость и задержки пользователей до и во время рассылки."""
+    args.upstream_latency = 0
+    async with FakeServersProcess(args) as servers:
+        app = import_bot(args, servers.base_url)
+        app.BROADCAST_PROGRESS_INTERVAL = 10 ** 6
+        await app.dp.emit_startup(bot=app.bot)
+        try:
+            await app.get_events_snapshot()
+            started = time.perf_counter()
+            for chat_id in range(BROADCAST_CHAT_BASE, BROADCAST_CHAT_BASE + args.recipients):
+                app.user_registry.add(chat_id)
+            register_time = (time.perf_counter() - started) / args.recipients
+
+            await servers.reset()
+            broadcast_id = app.broadcaster.create("Бенчмарк рассылки", None)
+            elapsed = await wait_broadcast(app, broadcast_id, 3600)
+            broadcast = app.broadcaster.last()
+            calls = await servers.stats()
+            engine_rate = broadcast.processed / elapsed
+
+            # Лимит как в проде: в секунду не больше OUTBOUND_GLOBAL_RATE сообщений на весь бот
+            limit = float(os.environ.get("BENCH_GLOBAL_RATE", "30"))
+            app.outbound_queue.global_bucket = app.TokenBucket(limit, limit)
+            app.broadcaster.rate = max(1.0, limit - 3)  # Как BROADCAST_RATE по умолчанию
+            baseline, _, _ = await run_user_flows(app, args.interactive_users, 1, args.interactive_users)
+            broadcast_id = app.broadcaster.create("Бенчмарк рассылки под лимитом", None)
+            await asyncio.sleep(2)  # Рассылка набирает скорость
+            sent_before, window_start = app.broadcaster.sent, time.perf_counter()
+            during, _, _ = await run_user_flows(app, args.interactive_users, 1, args.interactive_users,
+                                                user_offset=args.interactive_users)
+            await asyncio.sleep(max(0.0, args.duration - (time.perf_counter() - window_start)))
+            limited_rate = (app.broadcaster.sent - sent_before) / (time.perf_counter() - window_start)
+            app.broadcaster.cancel(broadcast_id)
+            await wait_broadcast(app, broadcast_id, 30)
+        finally:
+            await app.dp.emit_shutdown(bot=app.bot)
+            await app.bot.session.close()
+
+    def interactive(latencies):
+        values = [value for step in latencies.values() for value in step]
+        return percentile(values, 0.5), percentile(values, 0.99)
+
+    base_p50, base_p99 = interactive(baseline)
+    during_p50, during_p99 = interactive(during)
+    print_table(
+        f"Рассылка на {args.recipients} получателей без лимитов (доля заблокировавших {args.blocked_rate:.0%})",
+        ("доставлено", "заблокировали", "ошибок", "время, с", "сообщ./с", "регистрация, мкс"),
+        [(broadcast.sent, broadcast.blocked, broadcast.failed, f"{elapsed:.1f}", f"{engine_rate:.0f}", us(register_time))],
+    )
+    print(f"Вызовы Bot API: {dict(calls)}")
+    print_table(
+        f"С глобальным лимитом {limit:.0f} сообщ./с: рассылка и {args.interactive_users} пользователей",
+        ("", "рассылка, сообщ./с", "пользователи p50 мс", "p99 мс"),
+        [("без рассылки", "-", ms(base_p50), ms(base_p99)),
+         ("во время рассылки", f"{limited_rate:.1f}", ms(during_p50), ms(during_p99))],
+    )
+    print(f"Оценка для 100000 получателей при {limit:.0f} сообщ./с: ~{100000 / limit / 60:.0f} мин "
+          f"(движок без лимита: ~{100000 / engine_rate:.0f} с)")
+    return {
+        "recipients": args.recipients, "sent": broadcast.sent, "blocked": broadcast.blocked, "failed": broadcast.failed,
+        "elapsed": elapsed, "engine_rate": engine_rate, "limited_rate": limited_rate,
+        "interactive": {"baseline": [base_p50, base_p99], "during_broadcast": [during_p50, during_p99]},
+    }
+
+# --- Условные запросы к MetaForge ---
+async def bench_upstream(args):
+    """Обновления кэша MetaForge подряд при неизменном расписании: с ETag (304) и без него (хэш тела 200-ответа)."""
+    args.upstream_latency = 0
+    rows = []
+    results = {}
+    async with FakeServersProcess(args) as servers:
+        app = import_bot(args, servers.base_url)
+
+        async def refresh():
+            # Так же, как по истечении TTL: загрузка через кэш
+            app.events_cache.invalidate()
+            return await app.events_cache.get()
+
+        for mode, validators in (("ETag / 304", True), ("только хэш тела", False)):
+            await servers.reset(scale=args.scale, upstream_validators=validators)
+            app.events_cache.value = None
+            app.upstream_validators.update(etag=None, last_modified=None, body_hash=None)
+            await refresh()
+            bytes_before = app.UPSTREAM_BYTES.value()
+            parse_before = app.UPSTREAM_PARSE_SECONDS.total()
+            payload = app.events_cache.value
+            started = time.process_time()
+            for _ in range(args.refreshes):
+                assert await refresh() is payload
+            cpu = (time.process_time() - started) / args.refreshes
+            transferred = (app.UPSTREAM_BYTES.value() - bytes_before) / args.refreshes
+            parsed = (app.UPSTREAM_PARSE_SECONDS.total() - parse_before) / args.refreshes
+            # Смена расписания всё ещё замечается
+            await servers.reset(scale=args.scale, seed=args.seed + 1, upstream_validators=validators)
+            changed = await refresh() is not payload
+            rows.append((mode, f"{transferred:.0f}", us(parsed), us(cpu), "да" if changed else "НЕТ"))
+            results[mode] = {"bytes": transferred, "parse": parsed, "cpu": cpu, "change_detected": changed}
+        await app.close_http_session()
+    print_table(
+        f"Обновление кэша MetaForge без изменений, {args.refreshes} раз (на одно обновление)",
+        ("режим", "байт тела", "разбор JSON, мкс", "CPU всего, мкс", "смена замечена"),
+        rows,
+    )
+    return results
+
+# --- Inline-запросы ---
+INLINE_QUERIES = ("", "м", "матри", "матриарх дамба", "dam", "stella", "harv", "буря", "космо", "blue gate")
+
+async def bench_inline(args):
+    """Время обработчика inline-запроса без сети: первый запрос на новом снимке и повторные из запомненных."""
+    app = import_bot(args)
+    install_in_process_bot_api(app)
+    app.events_cache.value = make_payload(args.scale, seed=args.seed)
+    app.events_cache.fetched_at = time.monotonic() + 10 ** 6
+    await app.dp.emit_startup(bot=app.bot)
+    latencies = {"новый снимок": [], "запомнено": []}
+    try:
+        await app.get_events_snapshot()
+        rng = random.Random(args.seed)
+        for number in range(args.queries):
+            if number % len(INLINE_QUERIES) == 0:
+                # Как раз в EVENTS_REFRESH_INTERVAL: новый снимок, запомненные результаты сбрасываются
+                await app.build_events_snapshot()
+                for query in INLINE_QUERIES:
+                    started = time.perf_counter()
+                    await feed(app, make_update("inline", number + 1, query))
+                    latencies["новый снимок"].append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await feed(app, make_update("inline", number + 1, rng.choice(INLINE_QUERIES)))
+            latencies["запомнено"].append(time.perf_counter() - started)
+    finally:
+        await app.dp.emit_shutdown(bot=app.bot)
+        await app.bot.session.close()
+    rows = []
+    results = {}
+    for name, values in latencies.items():
+        rows.append((name, len(values), ms(percentile(values, 0.5)), ms(percentile(values, 0.99))))
+        results[name] = {"count": len(values), "p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+    print_table(
+        "Inline-запросы: обработчик и ответ Bot API в процессе (мс)",
+        ("результаты", "запросов", "p50", "p99"),
+        rows,
+    )
+    return results
+
+async def bench_all(args):
+    results = {"micro": await bench_micro(args)}
+    for name in ("users", "alloc", "overhead", "inline"):
+        # Каждый сценарий — в своём процессе, чтобы состояние бота (кэши, хранилище) не переходило между ними
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), name, *sys.argv[2:],
+        )
+        await process.wait()
+    results["transport"] = await bench_transport(args)
+    results["scaling"] = await bench_scaling(args)
+    results["upstream"] = await bench_upstream(args)
+    results["broadcast"] = await bench_broadcast(args)
+    return results
+
+# --- Командная строка ---
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарки бота с фейковыми Bot API и MetaForge.")
+    parser.add_argument("scenario", choices=(
+        "users", "micro", "transport", "alloc", "overhead", "scaling", "upstream", "broadcast", "inline", "all", "fake-servers", "transport-run",
+    ))
+    parser.add_argument("--users", type=int, default=200, help="количество синтетических пользователей")
+    parser.add_argument("--rounds", type=int, default=3, help="сколько раз каждый пользователь проходит сценарий")
+    parser.add_argument("--concurrency", type=int, default=100, help="сколько пользователей работают одновременно")
+    parser.add_argument("--updates", type=int, default=3000, help="число обновлений в сравнении polling/webhook")
+    parser.add_argument("--iterations", type=int, default=200, help="обновлений на шаг в замере памяти")
+    parser.add_argument("--repeats", type=int, default=5, help="повторов в замере цены инструментирования")
+    parser.add_argument("--recipients", type=int, default=20000, help="получателей рассылки в сценарии broadcast")
+    parser.add_argument("--interactive-users", type=int, default=4, help="пользователей, работающих во время рассылки")
+    parser.add_argument("--duration", type=float, default=10, help="сколько секунд мерить рассылку под лимитом")
+    parser.add_argument("--blocked-rate", type=float, default=0.02, help="доля получателей рассылки, заблокировавших бота")
+    parser.add_argument("--queries", type=int, default=2000, help="inline-запросов в сценарии inline")
+    parser.add_argument("--refreshes", type=int, default=100, help="обновлений кэша MetaForge в сценарии upstream")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="числа воркеров для scaling")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 2, 5, 10], help="размеры payload для micro (1 = сегодня)")
+    parser.add_argument("--scale", type=int, default=1, help="размер payload фейкового MetaForge")
+    parser.add_argument("--min-time", type=float, default=0.3, help="минимальное время одного микробенчмарка, с")
+    parser.add_argument("--api-latency", type=float, default=0.02, help="средняя задержка фейкового Bot API, с")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="доля ответов 500 от Bot API")
+    parser.add_argument("--api-flood-rate", type=float, default=0.0, help="доля ответов 429 (retry_after=1) от Bot API")
+    parser.add_argument("--upstream-latency", type=float, default=0.05, help="средняя задержка фейкового MetaForge, с")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="доля ответов 503 от MetaForge")
+    parser.add_argument("--real-limits", action="store_true", help="оставить лимиты исходящей очереди как в проде")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--json", metavar="PATH", help="сохранить результаты в JSON")
+    return parser.parse_args(argv)
+
+SCENARIOS = {
+    "users": bench_users,
+    "micro": bench_micro,
+    "transport": bench_transport,
+    "alloc": bench_alloc,
+    "overhead": bench_overhead,
+    "scaling": bench_scaling,
+    "upstream": bench_upstream,
+    "broadcast": bench_broadcast,
+    "inline": bench_inline,
+    "all": bench_all,
+    "fake-servers": serve_fake_servers,
+    "transport-run": run_transport_mode,
+}
+
+def main():
+    args = parse_args()
+    results = asyncio.run(SCENARIOS[args.scenario](args))
+    if args.json and results is not None:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(results, output, ensure_ascii=False, indent=2, default=str)
+
+if __name__ == "__main__":
+    main()
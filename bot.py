@@ -1,13 +1,42 @@
 import os
 import asyncio
 import logging
+import random
+import time
+import heapq
+import itertools
+import contextvars
+import secrets
+import signal
+import json
+import html
+import hashlib
+import sqlite3
+import struct
+import mmap
+import sys
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta, timezone
-import requests
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+import aiohttp
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext  # <-- ВАЖНО: FSMContext импортирован
 from aiogram.fsm.state import State, StatesGroup  # <-- ВАЖНО: StatesGroup импортирован
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiogram.methods import (
+    AnswerCallbackQuery, AnswerInlineQuery, CopyMessage, DeleteMessage, EditMessageReplyMarkup,
+    EditMessageText, ForwardMessage, SendMessage, SendPhoto,
+)
 
 # --- Добавляем класс состояний для обратной связи ---
 class Feedback(StatesGroup):
@@ -22,17 +51,726 @@ if not BOT_TOKEN:
 YOUR_TELEGRAM_ID = "348743068"
 
 # Убран лишний пробел в конце URL
-EVENT_TIMERS_API_URL = 'https://metaforge.app/api/arc-raiders/event-timers' # <-- Исправлено: убран пробел
+EVENT_TIMERS_API_URL = os.getenv("EVENT_TIMERS_API_URL", 'https://metaforge.app/api/arc-raiders/event-timers') # <-- Исправлено: убран пробел
+
+# Адрес Bot API, если используется свой сервер (например, локальный telegram-bot-api); по умолчанию — api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+
+# --- Настройки HTTP-клиента для MetaForge ---
+# Таймауты в секундах; можно переопределить через переменные окружения
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "7"))
+# Сколько запросов к MetaForge может выполняться одновременно
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "4"))
+# Количество повторов после первой неудачной попытки и базовая задержка между ними
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+
+# --- Настройки кэша ответа MetaForge ---
+# Сколько секунд ответ считается свежим и сколько ещё его можно отдавать, обновляя в фоне
+EVENTS_CACHE_TTL = float(os.getenv("EVENTS_CACHE_TTL", "60"))
+EVENTS_CACHE_STALE_TTL = float(os.getenv("EVENTS_CACHE_STALE_TTL", "600"))
+# Как часто (в секундах) фоновая задача пересобирает готовый снимок событий
+EVENTS_REFRESH_INTERVAL = float(os.getenv("EVENTS_REFRESH_INTERVAL", "5"))
+
+# --- Устойчивость к недоступности MetaForge ---
+# Файл с последним удачным ответом MetaForge; читается при старте. Пустая строка — не сохранять
+UPSTREAM_SNAPSHOT_PATH = os.getenv("UPSTREAM_SNAPSHOT_PATH", "metaforge_snapshot.json")
+# После скольких неудачных загрузок подряд перестать обращаться к MetaForge и на сколько секунд.
+# Каждая неудачная пробная попытка удваивает паузу, но не больше максимума
+UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "3"))
+UPSTREAM_RESET_TIMEOUT = float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+UPSTREAM_MAX_RESET_TIMEOUT = float(os.getenv("UPSTREAM_MAX_RESET_TIMEOUT", "600"))
+
+# --- Настройки уведомлений по подпискам ---
+# За сколько минут до начала события присылать уведомление
+NOTIFY_LEAD_MINUTES = int(os.getenv("NOTIFY_LEAD_MINUTES", "10"))
+# Сколько уведомлений одновременно ставить в исходящую очередь
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "100"))
+
+# --- Живые сообщения со списком событий ---
+# Как часто (в секундах) обновлять сообщения с включённым автообновлением и сколько секунд оно действует
+LIVE_TICK_INTERVAL = float(os.getenv("LIVE_TICK_INTERVAL", "60"))
+LIVE_MESSAGE_TTL = float(os.getenv("LIVE_MESSAGE_TTL", "1800"))
+# Не больше стольких правок в секунду: остаток лимита Telegram — ответам пользователям
+LIVE_EDIT_RATE = float(os.getenv("LIVE_EDIT_RATE", "20"))
+# Сколько живых сообщений держать одновременно (по одному на чат)
+LIVE_MAX_MESSAGES = int(os.getenv("LIVE_MAX_MESSAGES", "10000"))
+
+# --- Настройки исходящей очереди Bot API ---
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в личный чат, 20 в минуту в группу
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE = float(os.getenv("OUTBOUND_GROUP_RATE", str(20 / 60)))
+# Сколько сообщений подряд можно отправить в один чат без ожидания
+OUTBOUND_CHAT_BURST = int(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+# Сколько раз повторять запрос после ответа 429 (retry_after)
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# --- Пропуск правок без изменений ---
+# Сколько последних сообщений бота помнить (отпечаток текста и клавиатуры)
+MESSAGE_FINGERPRINT_CACHE_SIZE = int(os.getenv("MESSAGE_FINGERPRINT_CACHE_SIZE", "50000"))
+
+# --- Разбиение длинного списка событий на страницы ---
+# Лимит Telegram — 4096 символов; берём с запасом, так как считаем длину вместе с HTML-тегами
+EVENTS_PAGE_CHAR_LIMIT = int(os.getenv("EVENTS_PAGE_CHAR_LIMIT", "3500"))
+
+# --- Режим получения обновлений ---
+# Публичный адрес приложения, например https://my-bot.herokuapp.com (нужен только в режиме webhook)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").rstrip("/")
+# "polling" — long polling, "webhook" — встроенный aiohttp-сервер на PORT.
+# По умолчанию webhook, если задан WEBHOOK_BASE_URL: web-дино Heroku (Procfile) должен слушать свой порт
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_BASE_URL else "polling").lower()
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Секрет для заголовка X-Telegram-Bot-Api-Secret-Token; если не задан, генерируется при запуске
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEB_SERVER_HOST = os.getenv("WEB_SERVER_HOST", "0.0.0.0")
+# Heroku передаёт порт в переменной PORT
+WEB_SERVER_PORT = int(os.getenv("PORT", "8080"))
+
+# --- Несколько процессов ---
+# Больше 1 — режим супервизора: главный процесс получает обновления (polling или webhook) и раздаёт их
+# BOT_WORKERS процессам-воркерам по chat_id, а ответ MetaForge загружает один раз и делит с воркерами
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+# Номер воркера выставляет супервизор при запуске; в обычном режиме переменная не задана
+BOT_WORKER_INDEX = int(os.getenv("BOT_WORKER_INDEX")) if os.getenv("BOT_WORKER_INDEX") else None
+IS_WORKER = BOT_WORKER_INDEX is not None
+# Общий буфер (mmap-файл) с ответом MetaForge; по умолчанию — файл в /dev/shm или во временном каталоге
+SHARED_SNAPSHOT_PATH = os.getenv("SHARED_SNAPSHOT_PATH", "")
+SHARED_SNAPSHOT_SIZE = int(os.getenv("SHARED_SNAPSHOT_SIZE", str(8 * 1024 * 1024)))
+# Сколько обновлений супервизор держит для упавшего воркера до его перезапуска; сверх этого старые теряются
+WORKER_BACKLOG_LIMIT = int(os.getenv("WORKER_BACKLOG_LIMIT", "10000"))
+
+# --- Настройки хранилища состояний (FSM) ---
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "bot_state.sqlite3")
+# Через сколько секунд брошенное состояние (например, незаконченная обратная связь) истекает
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(24 * 60 * 60)))
+# Сколько записей держать в памяти и как часто/какими пачками сбрасывать изменения в базу
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "500"))
+
+# --- Очередь обратной связи ---
+# Сообщения обратной связи сохраняются в таблицу feedback в том же SQLite-файле и приходят администратору
+# сводками раз в FEEDBACK_DIGEST_INTERVAL секунд
+FEEDBACK_DIGEST_INTERVAL = float(os.getenv("FEEDBACK_DIGEST_INTERVAL", "300"))
+# Не больше FEEDBACK_USER_LIMIT сообщений от одного пользователя за FEEDBACK_USER_WINDOW секунд
+FEEDBACK_USER_LIMIT = int(os.getenv("FEEDBACK_USER_LIMIT", "5"))
+FEEDBACK_USER_WINDOW = float(os.getenv("FEEDBACK_USER_WINDOW", "3600"))
+# Повтор того же текста от того же пользователя в течение этого времени считается дубликатом
+FEEDBACK_DUPLICATE_WINDOW = float(os.getenv("FEEDBACK_DUPLICATE_WINDOW", str(24 * 60 * 60)))
+# Сколько сообщений брать в одну сводку и максимальная длина одного сообщения сводки (лимит Telegram — 4096)
+FEEDBACK_DIGEST_BATCH = int(os.getenv("FEEDBACK_DIGEST_BATCH", "200"))
+FEEDBACK_DIGEST_CHAR_LIMIT = int(os.getenv("FEEDBACK_DIGEST_CHAR_LIMIT", "4000"))
+
+# --- Рассылки ---
+# Скорость рассылки, сообщений в секунду. Чуть ниже глобального лимита: свободные токены копятся,
+# и ответы пользователям во время рассылки уходят без очереди
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", str(max(1.0, OUTBOUND_GLOBAL_RATE - 3))))
+# Сколько отправок рассылки может выполняться одновременно (покрывает задержку сети)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "64"))
+# Сколько получателей читать из базы за раз; прогресс сохраняется после каждой полностью отправленной порции
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+# Как часто (в секундах) обновлять сообщение с прогрессом у администратора и проверять новые рассылки
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "30"))
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "5"))
+
+# --- Inline-режим ---
+# Сколько секунд Telegram отдаёт сохранённый ответ на тот же запрос, не спрашивая бота.
+# Время в результатах округлено до минуты, поэтому дольше минуты держать ответ не стоит
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+# Результатов в одном ответе (Telegram принимает не больше 50); остальные отдаются по offset
+INLINE_PAGE_SIZE = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+
+# --- Метрики ---
+# Адрес локального HTTP-эндпоинта /metrics (формат Prometheus); порт 0 отключает сервер метрик
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+# Как часто (в секундах) измерять задержку цикла событий
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
 
 # --- Настройка логирования ---
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
+# --- Реестр метрик ---
+# Минимальная реализация формата Prometheus без внешних зависимостей. Наблюдение в гистограмме —
+# bisect по границам корзин и два сложения; текст собирается только при запросе /metrics.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_labels(label, value, le=None):
+    pairs = []
+    if label is not None:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{label}="{escaped}"')
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Histogram:
+    """Гистограмма длительностей в секундах, с необязательной одной меткой."""
+
+    def __init__(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # значение метки -> [счётчики корзин (последняя — +Inf), сумма, количество]
+
+    def observe(self, value, label_value=None):
+        series = self._series.get(label_value)
+        if series is None:
+            series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def total(self, label_value=None):
+        """Сумма наблюдений (как _sum в /metrics)."""
+        series = self._series.get(label_value)
+        return series[1] if series is not None else 0.0
+
+    def time(self, label_value=None):
+        """Контекстный менеджер, замеряющий длительность блока."""
+        return _Timer(self, label_value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_value, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label, label_value, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label, label_value, '+Inf')} {count}")
+            labels = _format_labels(self.label, label_value)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "label_value", "started")
+
+    def __init__(self, histogram, label_value):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.label_value)
+        return False
+
+class Counter:
+    """Монотонный счётчик, с необязательной одной меткой."""
+
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+
+    def inc(self, label_value=None, amount=1):
+        self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def value(self, label_value=None):
+        return self._values.get(label_value, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label_value, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label, label_value)} {value}")
+        return lines
+
+class Gauge:
+    """Значение, читаемое функцией collect в момент запроса /metrics (число или словарь метка -> число).
+
+    kind="counter" — для счётчиков, которые уже ведутся атрибутами объектов (кэш, очередь и т.п.).
+    """
+
+    def __init__(self, name, help_text, collect, label=None, kind="gauge"):
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.label = label
+        self.kind = kind
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        value = self.collect()
+        if isinstance(value, dict):
+            for label_value, item in value.items():
+                lines.append(f"{self.name}{_format_labels(self.label, label_value)} {item}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label=None, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label, buckets))
+
+    def counter(self, name, help_text, label=None):
+        return self.register(Counter(name, help_text, label))
+
+    def gauge(self, name, help_text, collect, label=None, kind="gauge"):
+        return self.register(Gauge(name, help_text, collect, label, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                # Ошибка одной метрики не должна ломать весь ответ /metrics
+                logger.warning("Не удалось собрать метрику %s: %r", metric.name, e)
+        lines.append("")
+        return "\n".join(lines)
+
+metrics = MetricsRegistry()
+UPSTREAM_FETCH_SECONDS = metrics.histogram("bot_upstream_fetch_seconds", "Duration of one MetaForge request attempt")
+UPSTREAM_ERRORS = metrics.counter("bot_upstream_errors_total", "Failed MetaForge request attempts by kind", "kind")
+UPSTREAM_RESPONSES = metrics.counter(
+    "bot_upstream_responses_total", "MetaForge responses by outcome: not_modified (304), unchanged (same body), changed", "outcome"
+)
+UPSTREAM_BYTES = metrics.counter("bot_upstream_bytes_total", "MetaForge response body bytes received")
+UPSTREAM_PARSE_SECONDS = metrics.histogram("bot_upstream_parse_seconds", "CPU time decoding changed MetaForge payloads")
+SCHEDULE_CHANGES = metrics.counter("bot_schedule_window_changes_total", "Schedule windows added, removed or moved", "change")
+SCHEDULE_SECONDS = metrics.histogram("bot_schedule_seconds", "Schedule index compilation and lookup time", "stage")
+RENDER_SECONDS = metrics.histogram("bot_render_seconds", "Events snapshot and per-user view rendering time", "stage")
+BOT_API_SECONDS = metrics.histogram("bot_api_request_seconds", "Bot API call latency by method", "method")
+BOT_API_QUEUE_SECONDS = metrics.histogram("bot_api_queue_wait_seconds", "Time a Bot API call waited in the outbound queue")
+BOT_API_ERRORS = metrics.counter("bot_api_errors_total", "Failed Bot API calls by method", "method")
+HANDLER_SECONDS = metrics.histogram("bot_handler_seconds", "Update handler latency", "handler")
+HANDLER_ERRORS = metrics.counter("bot_handler_errors_total", "Update handlers that raised", "handler")
+EVENT_LOOP_LAG = metrics.histogram("bot_event_loop_lag_seconds", "Event loop scheduling delay")
+
+
+# --- Хранилище состояний FSM ---
+# SQLite-файл в режиме WAL: состояния переживают перезапуск и доступны нескольким процессам.
+# Перед базой — ограниченный LRU-кэш в памяти, записи накапливаются и сбрасываются пачками.
+# Пустые записи (нет состояния и данных) удаляются, брошенные состояния истекают по TTL.
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище на SQLite с LRU-кэшем, пакетной записью и TTL."""
+
+    def __init__(self, path, ttl, cache_size, flush_interval, flush_batch):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = OrderedDict()  # key -> (state, data, updated_at) или None (записи нет)
+        self._dirty = {}  # key -> (state, data, updated_at) или None (удалить)
+        self._flushing = {}  # Пачка, которая сейчас записывается в базу
+        self._flush_lock = asyncio.Lock()
+        self._flush_pending = False  # Уже запланирован внеочередной сброс по размеру пачки
+        # Запись идёт в отдельном потоке пачками; чтение по первичному ключу занимает микросекунды,
+        # поэтому выполняется сразу через отдельное соединение (WAL не блокирует читателей)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._connection = None
+        self._flush_task = None
+        self._closed = False
+        self._executor.submit(self._open).result()
+        self._reader = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+
+    # --- Методы, выполняемые в потоке записи ---
+    def _open(self):
+        self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS fsm_updated_at ON fsm (updated_at)")
+
+    def _read(self, key):
+        row = self._reader.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    def _write(self, batch):
+        upserts = [(key, record[0], json.dumps(record[1]), record[2]) for key, record in batch.items() if record is not None]
+        deletes = [(key,) for key, record in batch.items() if record is None]
+        with self._connection:
+            self._connection.execute("BEGIN")
+            if upserts:
+                self._connection.executemany(
+                    "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                    "updated_at = excluded.updated_at",
+                    upserts,
+                )
+            if deletes:
+                self._connection.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    def _purge(self, before):
+        with self._connection:
+            return self._connection.execute("DELETE FROM fsm WHERE updated_at < ?", (before,)).rowcount
+
+    # --- Кэш и пакетная запись ---
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _load(self, key):
+        """Запись по ключу: из LRU, из ещё не сброшенных изменений или из базы."""
+        if key in self._cache:
+            # Отсутствие записи тоже кэшируется: обычное обновление от пользователя без состояния не ходит в базу
+            record = self._cache[key]
+            self._cache.move_to_end(key)
+        elif key in self._dirty:
+            record = self._dirty[key]
+        elif key in self._flushing:
+            record = self._flushing[key]
+        else:
+            record = self._read(key)
+            self._remember(key, record)
+        if record is not None and time.time() - record[2] > self.ttl:
+            # Брошенное состояние истекло
+            self._store(key, None, {})
+            return None
+        return record
+
+    def _store(self, key, state, data):
+        if state is None and not data:
+            self._remember(key, None)
+            self._dirty[key] = None
+        else:
+            record = (state, data, time.time())
+            self._remember(key, record)
+            self._dirty[key] = record
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_loop())
+        elif len(self._dirty) >= self.flush_batch and not self._flush_pending:
+            self._flush_pending = True
+            asyncio.ensure_future(self.flush())
+
+    async def _throttle(self):
+        """Если запись в базу не успевает за изменениями, ждём сброса: иначе несохранённое растёт без предела."""
+        if len(self._dirty) >= 4 * self.flush_batch:
+            await self.flush()
+
+    async def flush(self):
+        """Сбрасывает накопленные изменения в базу одной транзакцией."""
+        async with self._flush_lock:
+            self._flush_pending = False
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            self._flushing = batch
+            try:
+                await self._run(self._write, batch)
+            except Exception as e:
+                logger.error(f"Ошибка записи состояний FSM в SQLite: {e}")
+                # Возвращаем несохранённое, не затирая более свежие изменения
+                for key, record in batch.items():
+                    self._dirty.setdefault(key, record)
+            finally:
+                self._flushing = {}
+
+    async def _flush_loop(self):
+        last_purge = time.monotonic()
+        while not self._closed:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if time.monotonic() - last_purge > min(self.ttl, 3600):
+                last_purge = time.monotonic()
+                removed = await self._run(self._purge, time.time() - self.ttl)
+                if removed:
+                    logger.info(f"Удалено истёкших состояний FSM: {removed}")
+
+    # --- Интерфейс BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        record = self._load(storage_key)
+        data = record[1] if record is not None else {}
+        self._store(storage_key, state.state if isinstance(state, State) else state, data)
+        await self._throttle()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self._load(self.key_builder.build(key))
+        return record[0] if record is not None else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        record = self._load(storage_key)
+        state = record[0] if record is not None else None
+        self._store(storage_key, state, dict(data))
+        await self._throttle()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = self._load(self.key_builder.build(key))
+        return dict(record[1]) if record is not None else {}
+
+    async def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        await self.flush()
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=True)
+        self._reader.close()
+
 # --- Инициализация бота ---
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage() # Используем MemoryStorage, как и раньше
+bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None)
+storage = SQLiteStorage(FSM_DB_PATH, FSM_STATE_TTL, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, FSM_FLUSH_BATCH)
 dp = Dispatcher(storage=storage)
 
+# --- Исходящая очередь запросов к Bot API ---
+# Все отправки и редактирования проходят через одну очередь перед bot.session:
+# глобальный лимит и лимит на чат, повтор после retry_after (429) и приоритеты.
+PRIORITY_CALLBACK = 0     # Ответы на нажатия кнопок и inline-запросы
+PRIORITY_INTERACTIVE = 1  # Ответы в обработчиках пользователя
+PRIORITY_BULK = 2         # Уведомления и рассылки
+
+# Приоритет запросов текущей задачи; фоновые рассылки выставляют PRIORITY_BULK
+outbound_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_INTERACTIVE)
+
+# Методы, на которые распространяются лимиты; остальные (getUpdates, getMe и т.п.) идут напрямую
+RATE_LIMITED_METHODS = (
+    SendMessage, EditMessageText, EditMessageReplyMarkup, DeleteMessage,
+    CopyMessage, ForwardMessage, SendPhoto, AnswerCallbackQuery, AnswerInlineQuery,
+)
+# Ответы на callback/inline-запросы не считаются сообщениями и не тратят лимиты
+UNLIMITED_METHODS = (AnswerCallbackQuery, AnswerInlineQuery)
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now):
+        """Сколько секунд ждать до следующего токена (0 — можно отправлять)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+    def set_rate(self, rate):
+        """Меняет темп (и запас — столько же токенов, сколько в секунду); накопленное до этого момента сохраняется."""
+        if rate == self.rate:
+            return
+        self.delay(time.monotonic())
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = min(self.tokens, rate)
+
+    def block(self, seconds):
+        """Запрещает отправку на seconds секунд (после ответа 429 от Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now):
+        return now >= self.blocked_until and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class OutboundJob:
+    __slots__ = ("make_request", "bot", "method", "chat_id", "priority", "future", "attempts", "queued_at")
+
+    def __init__(self, make_request, bot, method, chat_id, priority, future):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.queued_at = time.perf_counter()
+
+class OutboundQueue(BaseRequestMiddleware):
+    """Приоритетная очередь исходящих запросов с лимитами Telegram и обработкой flood control."""
+
+    def __init__(self, global_rate, chat_rate, group_rate, chat_burst, max_retries):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self._queue = None
+        self._seq = itertools.count()
+        self._task = None
+        # Выполняющиеся запросы: цикл событий держит задачи только по слабым ссылкам
+        self._inflight = set()
+        # Ответы на callback/inline-запросы в очереди: они идут первыми и не ждут глобального токена
+        self._unlimited_pending = 0
+        self._unlimited_ready = None
+        self.sent = 0
+        self.retry_after = 0
+        self.failed = 0
+
+    @property
+    def depth(self):
+        """Количество запросов, ожидающих отправки."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.PriorityQueue()
+            self._unlimited_pending = 0
+            self._unlimited_ready = asyncio.Event()
+            self._task = asyncio.create_task(self._dispatch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Отправляемые запросы отменяем до закрытия сессии, чтобы они не работали с уже закрытым соединением
+        inflight = list(self._inflight)
+        for task in inflight:
+            task.cancel()
+        await asyncio.gather(*inflight, return_exceptions=True)
+        # Оставшиеся в очереди запросы отменяем, чтобы ожидающие их корутины не зависли
+        while self._queue is not None and not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            job.future.cancel()
+
+    async def __call__(self, make_request, bot, method):
+        if not isinstance(method, RATE_LIMITED_METHODS):
+            return await make_request(bot, method)
+        self.start()
+        if isinstance(method, UNLIMITED_METHODS):
+            priority = PRIORITY_CALLBACK
+        else:
+            priority = outbound_priority.get()
+        future = asyncio.get_running_loop().create_future()
+        self._put(OutboundJob(make_request, bot, method, getattr(method, 'chat_id', None), priority, future))
+        return await future
+
+    def _put(self, job):
+        if not job.future.done():
+            self._queue.put_nowait((job.priority, next(self._seq), job))
+            if isinstance(job.method, UNLIMITED_METHODS):
+                self._unlimited_pending += 1
+                self._unlimited_ready.set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                now = time.monotonic()
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.idle(now)}
+            # Отрицательный chat_id (или @username) — группа или канал, у них лимит строже
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Сначала ждём глобальный токен и только потом берём самый приоритетный запрос:
+            # иначе уже взятое сообщение рассылки занимало бы токен, пока ответ пользователю ждёт в очереди.
+            # Ответы на callback/inline-запросы токен не тратят и стоят в начале очереди (PRIORITY_CALLBACK),
+            # поэтому, если они есть, берутся сразу
+            if not self._unlimited_pending:
+                delay = self.global_bucket.delay(time.monotonic())
+                if delay > 0:
+                    self._unlimited_ready.clear()
+                    try:
+                        await asyncio.wait_for(self._unlimited_ready.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            _, _, job = await self._queue.get()
+            if isinstance(job.method, UNLIMITED_METHODS):
+                self._unlimited_pending -= 1
+            if job.future.done():
+                continue  # Ожидающий запрос отменён
+            if not isinstance(job.method, UNLIMITED_METHODS):
+                now = time.monotonic()
+                if job.chat_id is not None:
+                    bucket = self._chat_bucket(job.chat_id)
+                    delay = bucket.delay(now)
+                    if delay > 0:
+                        # Чат ещё не готов: откладываем запрос, не блокируя остальные чаты
+                        loop.call_later(delay, self._put, job)
+                        continue
+                    bucket.consume()
+                # Пока ждали запрос, токен мог только накопиться
+                self.global_bucket.delay(now)
+                self.global_bucket.consume()
+            task = asyncio.create_task(self._execute(job))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, job):
+        method_name = job.method.__api_method__
+        started = time.perf_counter()
+        if job.attempts == 0:
+            BOT_API_QUEUE_SECONDS.observe(started - job.queued_at)
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            BOT_API_SECONDS.observe(time.perf_counter() - started, method_name)
+            BOT_API_ERRORS.inc(method_name)
+            self.retry_after += 1
+            logger.warning("Flood control от Telegram (chat_id=%s): повтор через %sс", job.chat_id, e.retry_after)
+            unlimited = isinstance(job.method, UNLIMITED_METHODS)
+            if job.chat_id is not None:
+                self._chat_bucket(job.chat_id).block(e.retry_after)
+            elif not unlimited:
+                self.global_bucket.block(e.retry_after)
+            if job.attempts < self.max_retries:
+                job.attempts += 1
+                if unlimited:
+                    # Такие запросы не ждут токенов, поэтому паузу выдерживаем отдельно
+                    asyncio.get_running_loop().call_later(e.retry_after, self._put, job)
+                else:
+                    self._put(job)
+            elif not job.future.done():
+                self.failed += 1
+                job.future.set_exception(e)
+        except Exception as e:
+            BOT_API_SECONDS.observe(time.perf_counter() - started, method_name)
+            BOT_API_ERRORS.inc(method_name)
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        except asyncio.CancelledError:
+            # Очередь останавливается: ожидающая корутина получает отмену, а не зависает
+            job.future.cancel()
+            raise
+        else:
+            BOT_API_SECONDS.observe(time.perf_counter() - started, method_name)
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+# Общий лимит Telegram действует на бота целиком, поэтому воркеры делят его поровну;
+# на время рассылки доли пересчитывает outbound_share_loop
+outbound_queue = OutboundQueue(
+    OUTBOUND_GLOBAL_RATE / BOT_WORKERS if IS_WORKER else OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_MAX_RETRIES
+)
+bot.session.middleware(outbound_queue)
+
 
 # --- Словари перевода ---
 EVENT_TRANSLATIONS = {
@@ -56,6 +794,81 @@ MAP_TRANSLATIONS = {
     "Stella Montis": "Стелла Монти",
 }
 
+# Порядковые номера событий и карт: на них строятся битовые маски настроек пользователей и callback_data
+EVENT_KEYS = list(EVENT_TRANSLATIONS)
+MAP_KEYS = list(MAP_TRANSLATIONS)
+EVENT_INDEX = {name: idx for idx, name in enumerate(EVENT_KEYS)}
+MAP_INDEX = {location: idx for idx, location in enumerate(MAP_KEYS)}
+
+# --- Языки отображения событий ---
+# Порядок важен: индекс языка хранится в настройках пользователя. Новый язык добавляется в конец.
+LANGUAGES = ("ru", "en")
+# Названия событий и карт по языкам; если перевода нет, используется оригинальное название из API
+EVENT_NAMES = {"ru": EVENT_TRANSLATIONS, "en": {}}
+MAP_NAMES = {"ru": MAP_TRANSLATIONS, "en": {}}
+UI_TEXTS = {
+    "ru": {
+        "active_header": "<strong>🟢 Активные события:</strong>\n",
+        "upcoming_header": "<strong>🔴 Предстоящие события:</strong>\n",
+        "no_active": "Нет активных событий.\n",
+        "active_line": "- <em>{name}</em> на карте <strong>{location}</strong> (осталось: {time_left})\n",
+        "upcoming_line": "- <strong>{name}</strong> на карте <strong>{location}</strong> (начнётся через: {time_left})\n",
+        "units": ("ч", "м", "с"),
+        "refresh": "🔄 Обновить",
+        "subscriptions": "🔔 Подписки",
+        "settings": "⚙️ Настройки",
+        "back": "🔙 Назад",
+        "live_on": "⏱ Автообновление",
+        "live_off": "⏹ Остановить автообновление",
+        "live_started": "Список будет обновляться сам {minutes} мин.",
+        "live_full": "Слишком много сообщений с автообновлением, попробуйте позже.",
+        "live_footer": "\n⏱ <em>Обновляется автоматически</em>\n",
+        "data_as_of": "\n⚠️ <em>MetaForge недоступен, данные на {time} UTC</em>\n",
+        "settings_title": "Настройки списка событий:",
+        "language": "🌐 Язык: Русский",
+        "favourite_maps": "🗺 Избранные карты",
+        "hidden_events": "🙈 Скрытые события",
+        "maps_title": "Отметьте избранные карты. Если ничего не отмечено, показываются все карты.",
+        "events_title": "Отметьте события, которые не нужно показывать.",
+        "inline_all": "📋 Все найденные события: {count}",
+        "inline_all_description": "Отправить список одним сообщением",
+        "inline_active": "🟢 {name} — {location}",
+        "inline_active_description": "Осталось: {time_left}",
+        "inline_upcoming": "🔴 {name} — {location}",
+        "inline_upcoming_description": "Начнётся через: {time_left}",
+    },
+    "en": {
+        "active_header": "<strong>🟢 Active events:</strong>\n",
+        "upcoming_header": "<strong>🔴 Upcoming events:</strong>\n",
+        "no_active": "No active events.\n",
+        "active_line": "- <em>{name}</em> on <strong>{location}</strong> (ends in: {time_left})\n",
+        "upcoming_line": "- <strong>{name}</strong> on <strong>{location}</strong> (starts in: {time_left})\n",
+        "units": ("h", "m", "s"),
+        "refresh": "🔄 Refresh",
+        "subscriptions": "🔔 Subscriptions",
+        "settings": "⚙️ Settings",
+        "back": "🔙 Back",
+        "live_on": "⏱ Live updates",
+        "live_off": "⏹ Stop live updates",
+        "live_started": "The list will update itself for {minutes} min.",
+        "live_full": "Too many live messages right now, please try again later.",
+        "live_footer": "\n⏱ <em>Updates automatically</em>\n",
+        "data_as_of": "\n⚠️ <em>MetaForge is unavailable, data as of {time} UTC</em>\n",
+        "settings_title": "Event list settings:",
+        "language": "🌐 Language: English",
+        "favourite_maps": "🗺 Favourite maps",
+        "hidden_events": "🙈 Hidden events",
+        "maps_title": "Mark your favourite maps. If none are marked, all maps are shown.",
+        "events_title": "Mark the events you don't want to see.",
+        "inline_all": "📋 All matching events: {count}",
+        "inline_all_description": "Send the list as one message",
+        "inline_active": "🟢 {name} — {location}",
+        "inline_active_description": "Ends in: {time_left}",
+        "inline_upcoming": "🔴 {name} — {location}",
+        "inline_upcoming_description": "Starts in: {time_left}",
+    },
+}
+
 # --- Ссылки для кнопок ---
 # Убраны лишние пробелы в конце URL
 LINKS = {
@@ -88,379 +901,1398 @@ https://id.embark.games/id/arc-raiders/survey
 
 """
 
-# --- Функции для получения и обработки данных из API ---
+# --- Готовые клавиатуры и статические сообщения ---
+# Собираются один раз при импорте и переиспользуются всеми обработчиками:
+# объекты aiogram неизменяемы (frozen), поэтому их безопасно разделять между запросами.
+MAIN_MENU_KEYBOARD = types.InlineKeyboardMarkup(inline_keyboard=[
+    # 1. События ARC Raiders
+    [types.InlineKeyboardButton(text="События ARC Raiders", callback_data="events")],
+    # 2. Обновление игры
+    [types.InlineKeyboardButton(text="Обновление игры", callback_data="game_update_text")],
+    # 3. Twitch
+    [types.InlineKeyboardButton(text="Twitch", url=LINKS["streams"])], # Использует URL из словаря LINKS
+    # 4. Телеграмм канал
+    [types.InlineKeyboardButton(text="Телеграмм канал", url=LINKS["telegram"])], # Использует URL из словаря LINKS
+    # 5. Обратная связь (форма внутри бота, сообщение уходит администратору)
+    [types.InlineKeyboardButton(text="Обратная связь", callback_data="feedback_start")],
+    # 6. Поддержка бота
+    [types.InlineKeyboardButton(text="Поддержка бота", url=LINKS["support"])], # Использует URL из словаря LINKS
+])
+
+# Клавиатура под текстом обновления игры: "Назад" и "События"
+GAME_UPDATE_KEYBOARD = types.InlineKeyboardMarkup(inline_keyboard=[
+    [types.InlineKeyboardButton(text="🔙 Назад", callback_data="start_menu")],
+    [types.InlineKeyboardButton(text="События ARC Raiders", callback_data="events")]
+])
+
+def build_events_keyboard(lang, navigation=None, refresh_data="refresh_events", page=0, live=False):
+    """Клавиатура под списком событий: навигация по страницам (если есть), "Обновить", автообновление, "Подписки", "Настройки", "Назад"."""
+    texts = UI_TEXTS[lang]
+    rows = [navigation] if navigation else []
+    live_button = (
+        types.InlineKeyboardButton(text=texts["live_off"], callback_data=f"live:off:{page}") if live
+        else types.InlineKeyboardButton(text=texts["live_on"], callback_data=f"live:on:{page}")
+    )
+    rows.extend([
+        [types.InlineKeyboardButton(text=texts["refresh"], callback_data=refresh_data)],
+        [live_button],
+        [types.InlineKeyboardButton(text=texts["subscriptions"], callback_data="subscriptions")],
+        [types.InlineKeyboardButton(text=texts["settings"], callback_data="settings")],
+        [types.InlineKeyboardButton(text=texts["back"], callback_data="start_menu")]
+    ])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
 
-def get_arc_raiders_events_from_api_calculated():
-    """Получает события из API MetaForge и вычисляет активные/предстоящие на основе расписания."""
-    try:
-        response = requests.get(EVENT_TIMERS_API_URL)
-        response.raise_for_status()
-        data = response.json()
+# Клавиатура под одностраничным списком событий для каждого языка
+EVENTS_KEYBOARDS = {lang: build_events_keyboard(lang) for lang in LANGUAGES}
+EVENTS_KEYBOARD = EVENTS_KEYBOARDS["ru"]
+# То же для сообщения с включённым автообновлением
+LIVE_EVENTS_KEYBOARDS = {lang: build_events_keyboard(lang, live=True) for lang in LANGUAGES}
 
-        raw_events = data.get('data', [])
-        active_events = []
-        upcoming_events = []
+# Кнопки "Назад" для меню подписок
+BACK_TO_EVENTS_BUTTON = types.InlineKeyboardButton(text="🔙 Назад", callback_data="events")
+BACK_TO_SUBSCRIPTIONS_BUTTON = types.InlineKeyboardButton(text="🔙 Назад", callback_data="subscriptions")
 
-        current_time_utc = datetime.now(timezone.utc) # <-- offset-aware
-        current_date_utc = current_time_utc.date()
-        current_time_only = current_time_utc.time()  # <-- offset-naive time object
+# Полные аргументы для отправки/редактирования сообщения об обновлении игры
+GAME_UPDATE_MESSAGE = {"text": GAME_UPDATE_TEXT, "reply_markup": GAME_UPDATE_KEYBOARD, "parse_mode": "HTML"}
 
-        # Словарь для отслеживания ближайшего предстоящего окна для каждого (название, карта)
-        next_upcoming_for_location = {}
+# Готовые клавиатуры различаются по имени, без сериализации (см. MessageFingerprints)
+STATIC_MARKUP_KEYS = {
+    id(MAIN_MENU_KEYBOARD): "main_menu",
+    id(GAME_UPDATE_KEYBOARD): "game_update",
+}
+for _lang, _keyboard in EVENTS_KEYBOARDS.items():
+    STATIC_MARKUP_KEYS[id(_keyboard)] = f"events:{_lang}"
+for _lang, _keyboard in LIVE_EVENTS_KEYBOARDS.items():
+    STATIC_MARKUP_KEYS[id(_keyboard)] = f"events_live:{_lang}"
+
+MAIN_MENU_TEXT = "Привет, {first_name}! Выбери действие:"
+FEEDBACK_PROMPT_TEXT = "Пожалуйста, введите ваше сообщение для обратной связи:"
+
+# --- Асинхронный HTTP-клиент ---
+# Одна сессия с пулом keep-alive соединений на всё время работы бота.
+# Создаётся при старте диспетчера и закрывается при остановке.
+http_session = None
+http_semaphore = asyncio.Semaphore(HTTP_MAX_CONCURRENCY)
+
+def get_http_session():
+    """Возвращает общую aiohttp-сессию, создавая её при первом обращении."""
+    global http_session
+    if http_session is None or http_session.closed:
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=HTTP_CONNECT_TIMEOUT,
+            sock_connect=HTTP_CONNECT_TIMEOUT,
+            sock_read=HTTP_READ_TIMEOUT,
+        )
+        connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONCURRENCY, keepalive_timeout=60, ttl_dns_cache=300)
+        http_session = aiohttp.ClientSession(timeout=timeout, connector=connector)
+    return http_session
+
+async def close_http_session():
+    """Закрывает общую aiohttp-сессию."""
+    global http_session
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+    http_session = None
+
+def _is_retryable(error):
+    """Повторяем сетевые ошибки, таймауты, 429 и 5xx; прочие 4xx повторять бессмысленно."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+def _upstream_error_kind(error):
+    """Метка ошибки для метрик: http_<код>, timeout или network."""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"http_{error.status}"
+    if isinstance(error, asyncio.TimeoutError):
+        return "timeout"
+    return "network"
+
+# Валидаторы последнего принятого ответа MetaForge: ETag и Last-Modified для условного запроса
+# и хэш тела — на случай, если сервер их не присылает или отвечает 200 с тем же содержимым
+upstream_validators = {"etag": None, "last_modified": None, "body_hash": None}
+
+def body_hash(body):
+    """Дешёвый хэш сырого тела ответа (blake2b, 128 бит)."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+async def fetch_event_timers():
+    """Загружает расписание из API MetaForge с таймаутами и повторами (экспоненциальная задержка с джиттером).
+
+    Если ответ уже есть, запрос условный (If-None-Match / If-Modified-Since). Возвращает None на 304,
+    иначе (сырое тело, ETag, Last-Modified) — разбор JSON остаётся вызывающему.
+    """
+    session = get_http_session()
+    headers = {}
+    if events_cache.value is not None:
+        if upstream_validators["etag"]:
+            headers["If-None-Match"] = upstream_validators["etag"]
+        if upstream_validators["last_modified"]:
+            headers["If-Modified-Since"] = upstream_validators["last_modified"]
+    attempt = 0
+    while True:
+        try:
+            async with http_semaphore:
+                with UPSTREAM_FETCH_SECONDS.time():
+                    async with session.get(EVENT_TIMERS_API_URL, headers=headers) as response:
+                        if response.status == 304:
+                            return None
+                        response.raise_for_status()
+                        body = await response.read()
+                        UPSTREAM_BYTES.inc(amount=len(body))
+                        return body, response.headers.get("ETag"), response.headers.get("Last-Modified")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            UPSTREAM_ERRORS.inc(_upstream_error_kind(e))
+            if attempt >= HTTP_MAX_RETRIES or not _is_retryable(e):
+                raise
+            # "Full jitter": случайная задержка от 0 до base * 2^attempt
+            delay = random.uniform(0, HTTP_BACKOFF_BASE * (2 ** attempt))
+            attempt += 1
+            logger.warning("Ошибка запроса к MetaForge (%r), попытка %d/%d через %.2fс", e, attempt, HTTP_MAX_RETRIES, delay)
+            await asyncio.sleep(delay)
+
+# --- Автоматический выключатель и запасной снимок MetaForge ---
+# Расписание — суточный цикл, поэтому давно полученный ответ всё ещё даёт верные таймеры.
+# Пока MetaForge недоступен, пользователям отдаётся последний удачный ответ с пометкой "данные на ...",
+# а запросы к MetaForge после серии ошибок прекращаются и возобновляются одной пробной попыткой.
+class CircuitOpenError(Exception):
+    """Запрос к MetaForge не выполнялся: выключатель разомкнут после серии ошибок."""
+
+class CircuitBreaker:
+    """Выключатель: closed — запросы идут; open — не идут reset_timeout секунд; half_open — одна пробная попытка."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold, reset_timeout, max_reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0  # Ошибок подряд
+        self.opened_at = None
+        self.current_timeout = reset_timeout
+        self.trips = 0
+
+    def allow(self):
+        """Можно ли сейчас обращаться к источнику. Переводит open в half_open по истечении паузы."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.current_timeout:
+            self.state = self.HALF_OPEN
+            logger.info("MetaForge: пробный запрос после паузы %.0fс", self.current_timeout)
+            return True
+        # open до истечения паузы или half_open, когда пробная попытка уже выполняется
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("MetaForge снова доступен, выключатель замкнут.")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.current_timeout = self.reset_timeout
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN:
+            self.current_timeout = min(self.current_timeout * 2, self.max_reset_timeout)
+            self._open()
+        elif self.state == self.CLOSED and self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        logger.warning("MetaForge недоступен (%d ошибок подряд), запросы приостановлены на %.0fс",
+                       self.failures, self.current_timeout)
+
+upstream_breaker = CircuitBreaker(UPSTREAM_FAILURE_THRESHOLD, UPSTREAM_RESET_TIMEOUT, UPSTREAM_MAX_RESET_TIMEOUT)
+
+def _write_last_known_good(path, data, fetched_at, validators):
+    """Атомарная запись: временный файл, fsync и переименование поверх старого."""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as snapshot_file:
+        json.dump({"fetched_at": fetched_at.isoformat(), "validators": validators, "payload": data},
+                  snapshot_file, ensure_ascii=False)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+
+async def save_last_known_good(data):
+    """Сохраняет удачный ответ MetaForge на диск в фоновом потоке."""
+    if not UPSTREAM_SNAPSHOT_PATH:
+        return
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            None, _write_last_known_good, UPSTREAM_SNAPSHOT_PATH, data, datetime.now(timezone.utc),
+            dict(upstream_validators),
+        )
+    except OSError as e:
+        logger.warning("Не удалось сохранить снимок MetaForge в %s: %s", UPSTREAM_SNAPSHOT_PATH, e)
 
-        for event_obj in raw_events:
+def load_last_known_good():
+    """Подхватывает сохранённый ответ MetaForge при старте, чтобы первый запрос не ждал сети."""
+    if not UPSTREAM_SNAPSHOT_PATH or events_cache.value is not None:
+        return
+    try:
+        with open(UPSTREAM_SNAPSHOT_PATH, encoding="utf-8") as snapshot_file:
+            saved = json.load(snapshot_file)
+        fetched_at = datetime.fromisoformat(saved["fetched_at"])
+        payload = saved["payload"]
+        validators = saved.get("validators") or {}
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning("Сохранённый снимок MetaForge %s не прочитан: %s", UPSTREAM_SNAPSHOT_PATH, e)
+        return
+    events_cache.prime(payload, fetched_at)
+    # С валидаторами первый же запрос после рестарта может получить 304 вместо полного ответа
+    upstream_validators.update((key, validators.get(key)) for key in upstream_validators)
+    logger.info("Загружен сохранённый снимок MetaForge от %s", fetched_at.strftime("%d.%m.%Y %H:%M UTC"))
+
+def parse_event_timers(body):
+    """Разбирает тело ответа MetaForge и проверяет формат."""
+    started = time.process_time()
+    try:
+        data = json.loads(body)
+    finally:
+        UPSTREAM_PARSE_SECONDS.observe(time.process_time() - started)
+    if not isinstance(data, dict) or not isinstance(data.get('data'), list):
+        # Не затираем хороший снимок ответом неожиданного формата
+        raise ValueError("Неожиданный формат ответа MetaForge")
+    return data
+
+async def load_event_timers():
+    """Загрузчик для кэша: запрос через выключатель; новый ответ сохраняется на диск.
+
+    Если содержимое не изменилось (304 или тот же хэш тела), возвращается прежний объект payload,
+    поэтому индекс расписания и снимок событий не пересобираются.
+    """
+    if not upstream_breaker.allow():
+        raise CircuitOpenError("MetaForge временно недоступен, запрос пропущен")
+    previous = events_cache.value
+    try:
+        response = await fetch_event_timers()
+        if response is None:
+            if previous is None:
+                raise ValueError("MetaForge ответил 304 на безусловный запрос")
+            outcome, data = "not_modified", previous
+        else:
+            body, etag, last_modified = response
+            digest = body_hash(body)
+            if previous is not None and digest == upstream_validators["body_hash"]:
+                outcome, data = "unchanged", previous
+            else:
+                outcome, data = "changed", parse_event_timers(body)
+    except Exception:
+        upstream_breaker.record_failure()
+        raise
+    upstream_breaker.record_success()
+    UPSTREAM_RESPONSES.inc(outcome)
+    if response is not None:
+        upstream_validators.update(etag=etag, last_modified=last_modified, body_hash=digest)
+    if data is not previous:
+        log_schedule_diff(previous, data)
+        await save_last_known_good(data)
+    return data
+
+def upstream_data_as_of():
+    """Момент получения данных, если пользователям отдаётся запасной снимок (MetaForge недоступен), иначе None."""
+    if IS_WORKER:
+        # Воркер сам в MetaForge не ходит: состояние источника сообщает супервизор через общий буфер
+        return shared_data_as_of
+    updated_at = events_cache.updated_at
+    if updated_at is None:
+        return None
+    age = (datetime.now(timezone.utc) - updated_at).total_seconds()
+    if upstream_breaker.state != CircuitBreaker.CLOSED or age > EVENTS_CACHE_TTL + EVENTS_CACHE_STALE_TTL:
+        return updated_at
+    return None
+
+# --- Кэш ответа MetaForge ---
+class TTLCache:
+    """Кэш одного значения с TTL, stale-while-revalidate и объединением одновременных промахов (single-flight).
+
+    Если загрузка не удалась, а значение уже было, отдаётся последнее удачное значение (stale-if-error).
+    """
+
+    def __init__(self, loader, ttl, stale_ttl):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.value = None
+        self.fetched_at = None  # time.monotonic() момента последней успешной загрузки; None — значение устарело
+        self.updated_at = None  # Тот же момент по часам (UTC) — для пометки "данные на ..."
+        self._inflight = None  # Задача текущей загрузки, общая для всех ожидающих
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fallback_hits = 0
+        self.refreshes = 0
+        self.errors = 0
+
+    async def get(self):
+        """Возвращает значение: свежее — сразу, устаревшее — сразу с фоновым обновлением, иначе ждёт загрузку."""
+        if self.value is not None and self.fetched_at is not None:
+            age = time.monotonic() - self.fetched_at
+            if age < self.ttl:
+                self.hits += 1
+                return self.value
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._start_refresh()
+                return self.value
+        self.misses += 1
+        try:
+            # shield: отмена одного ожидающего не должна отменять загрузку для остальных
+            return await asyncio.shield(self._start_refresh())
+        except Exception:
+            if self.value is None:
+                raise
+            # Источник недоступен: отдаём последнее удачное значение, как бы давно оно ни было получено
+            self.fallback_hits += 1
+            return self.value
+
+    def _start_refresh(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+            # Забираем исключение, чтобы фоновое обновление не засоряло лог "Task exception was never retrieved"
+            self._inflight.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._inflight
+
+    async def _refresh(self):
+        self.refreshes += 1
+        try:
+            value = await self.loader()
+            self.value = value
+            self.fetched_at = time.monotonic()
+            self.updated_at = datetime.now(timezone.utc)
+            return value
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._inflight = None
+
+    def prime(self, value, updated_at):
+        """Заполняет кэш ранее сохранённым значением, полученным в момент updated_at (aware datetime).
+
+        Старое значение считается устаревшим, но не просроченным: его сразу отдают и обновляют в фоне.
+        """
+        age = max(0.0, (datetime.now(timezone.utc) - updated_at).total_seconds())
+        self.value = value
+        self.updated_at = updated_at
+        self.fetched_at = time.monotonic() - min(age, self.ttl)
+
+    def invalidate(self):
+        """Помечает значение устаревшим: следующий запрос пойдёт в API (старое значение остаётся запасным)."""
+        self.fetched_at = None
+
+    def stats(self):
+        """Счётчики кэша для админской команды."""
+        age = None if self.updated_at is None else (datetime.now(timezone.utc) - self.updated_at).total_seconds()
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "fallback_hits": self.fallback_hits,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "age": age,
+        }
+
+events_cache = TTLCache(load_event_timers, EVENTS_CACHE_TTL, EVENTS_CACHE_STALE_TTL)
+
+# --- Индекс расписания ---
+# Расписание MetaForge — суточный цикл, поэтому окна разбираются один раз на каждый полученный payload
+# и хранятся как отсортированные интервалы в секундах от начала суток для каждой пары (событие, карта).
+# Окно через полночь (23:00 - 01:00) хранится с концом больше суток: (82800, 90000).
+SECONDS_PER_DAY = 24 * 60 * 60
+
+def parse_time_of_day(value, allow_end_of_day=False):
+    """Переводит 'ЧЧ:ММ' в секунды от начала суток; '24:00' допустимо только для конца окна."""
+    hours_str, minutes_str = value.split(':')
+    hours, minutes = int(hours_str), int(minutes_str)
+    if allow_end_of_day and hours == 24 and minutes == 0:
+        return SECONDS_PER_DAY
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"время вне диапазона: {value}")
+    return hours * 3600 + minutes * 60
+
+def format_time_left(total_seconds, units=("ч", "м", "с")):
+    """Форматирует интервал в вид '1ч 5м 3с' (нулевые части опускаются)."""
+    hours_unit, minutes_unit, seconds_unit = units
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    time_parts = []
+    if hours > 0: time_parts.append(f"{hours}{hours_unit}")
+    if minutes > 0: time_parts.append(f"{minutes}{minutes_unit}")
+    if seconds > 0 or not time_parts: time_parts.append(f"{seconds}{seconds_unit}")
+    return " ".join(time_parts)
+
+class ScheduleIndex:
+    """Скомпилированное суточное расписание: поиск активных и ближайших окон бинарным поиском."""
+
+    def __init__(self):
+        # (name, location) -> (starts, ends, prefix_max_ends, overnight_positions)
+        self.windows = {}
+
+    @classmethod
+    def from_payload(cls, data):
+        """Разбирает ответ MetaForge в индекс. Некорректные окна пропускаются с записью в лог."""
+        intervals = {}
+        for event_obj in data.get('data', []):
             name = event_obj.get('name', 'Unknown Event')
             location = event_obj.get('map', 'Unknown Location')
-            times_list = event_obj.get('times', [])
-
-            # Проходим по каждому временному окну события на этой карте
-            for time_window in times_list:
+            key_intervals = intervals.setdefault((name, location), [])
+            for time_window in event_obj.get('times', []):
                 start_str = time_window.get('start') # Например, "01:00"
                 end_str = time_window.get('end')     # Например, "02:00" или "24:00"
-
                 if not start_str or not end_str:
-                    logger.warning(f"Missing start or end time for event {name} at {location}")
+                    logger.warning("Missing start or end time for event %s at %s", name, location)
                     continue
-
                 try:
-                    # Парсим время начала
-                    start_time = datetime.strptime(start_str, '%H:%M').time() # <-- offset-naive time object
-
-                    # --- ИСПРАВЛЕНИЕ ДЛЯ 24:00 ---
-                    if end_str == "24:00":
-                        # Интерпретируем 24:00 как конец текущего дня (23:59:59.999...)
-                        # Для логики сравнения времени в пределах дня, используем 23:59:59
-                        # или обрабатываем особым образом при вычислении end_datetime.
-                        # Лучше сразу перейти к вычислению end_datetime.
-                        is_end_midnight_next_day = True
-                        # Для сравнения времени в пределах дня (current_time_only)
-                        # end_time_for_comparison = time(23, 59, 59)
-                        # Но для случая 23:00 - 24:00, current_time_only < 24:00 всегда True
-                        # Поэтому логика активности для start <= current < end (где end=24:00)
-                        # становится: start <= current_time_only (до конца дня)
-                    else:
-                        end_time_for_comparison = datetime.strptime(end_str, '%H:%M').time()
-                        is_end_midnight_next_day = False
-                    # --- КОНЕЦ ИСПРАВЛЕНИЯ ---
-
-                    # --- Вычисление активности ---
-                    # Случай 1: start и end в один день (например, 01:00 - 02:00) или start и 24:00 (например, 23:00 - 24:00)
-                    if start_time <= end_time_for_comparison or is_end_midnight_next_day:
-                        # Для 24:00: start_time <= current_time_only (до конца дня)
-                        # Для обычного: start_time <= current_time_only < end_time_for_comparison
-                        if is_end_midnight_next_day:
-                            # Событие активно, если start <= current_time_only и окно до конца дня
-                            is_active = start_time <= current_time_only
-                        else:
-                            # Событие активно, если start <= current_time_only < end
-                            is_active = start_time <= current_time_only < end_time_for_comparison
-
-                        if is_active:
-                            # Событие активно сегодня
-                            # Вычисляем время окончания как datetime объект (на сегодня, в UTC)
-                            # datetime.combine создает offset-naive datetime, нужно сделать его aware
-                            # Для 24:00 - это конец текущего дня, т.е. 00:00 следующего дня
-                            if is_end_midnight_next_day:
-                                # Окончание в 24:00 означает 00:00 следующего дня
-                                end_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), datetime.min.time()) # time(0, 0)
-                            else:
-                                end_datetime_naive = datetime.combine(current_date_utc, end_time_for_comparison)
-                            end_datetime = end_datetime_naive.replace(tzinfo=timezone.utc) # <-- offset-aware
-
-                            # Проверяем, что end_datetime > current_time_utc, иначе добавляем день (маловероятно для 24:00, но на всякий)
-                            if end_datetime <= current_time_utc:
-                                logger.warning(f"End time {end_datetime} is <= current time {current_time_utc}, adding 1 day.")
-                                if is_end_midnight_next_day:
-                                     end_datetime_naive = datetime.combine(current_date_utc + timedelta(days=2), datetime.min.time())
-                                else:
-                                     end_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), end_time_for_comparison)
-                                end_datetime = end_datetime_naive.replace(tzinfo=timezone.utc)
-
-                            time_left = end_datetime - current_time_utc # <-- Теперь оба aware
-                            total_seconds = int(time_left.total_seconds())
-                            hours, remainder = divmod(total_seconds, 3600)
-                            minutes, seconds = divmod(remainder, 60)
-                            time_parts = []
-                            if hours > 0: time_parts.append(f"{hours}ч")
-                            if minutes > 0: time_parts.append(f"{minutes}м")
-                            if seconds > 0 or not time_parts: time_parts.append(f"{seconds}с")
-                            time_left_str = " ".join(time_parts)
-
-                            active_events.append({
-                                'name': name,
-                                'location': location,
-                                'time_left': time_left_str,
-                                'end_time': end_datetime
-                            })
-                            logger.info(f"Добавлено активное событие (сегодня): {name} на {location}, осталось {time_left_str}")
-                            # Переходим к следующему окну, т.к. активное уже найдено для этого (name, location)
-                            continue
-
-                    # Случай 2: start > end (например, 23:00 - 01:00 -> событие пересекает полночь)
-                    else: # start_time > end_time_for_comparison (и не 24:00)
-                        if (current_time_only >= start_time) or (current_time_only < end_time_for_comparison):
-                            # Событие активно сегодня или перешло на завтра
-                            # Вычисляем время окончания
-                            # Если текущее время >= start_time, значит событие началось сегодня и закончится завтра
-                            if current_time_only >= start_time:
-                                end_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), end_time_for_comparison)
-                            else: # current_time_only < end_time_for_comparison -> событие началось вчера и заканчивается сегодня
-                                end_datetime_naive = datetime.combine(current_date_utc, end_time_for_comparison)
-
-                            end_datetime = end_datetime_naive.replace(tzinfo=timezone.utc) # <-- offset-aware
-                            time_left = end_datetime - current_time_utc # <-- Теперь оба aware
-                            total_seconds = int(time_left.total_seconds())
-                            hours, remainder = divmod(total_seconds, 3600)
-                            minutes, seconds = divmod(remainder, 60)
-                            time_parts = []
-                            if hours > 0: time_parts.append(f"{hours}ч")
-                            if minutes > 0: time_parts.append(f"{minutes}м")
-                            if seconds > 0 or not time_parts: time_parts.append(f"{seconds}с")
-                            time_left_str = " ".join(time_parts)
-
-                            active_events.append({
-                                'name': name,
-                                'location': location,
-                                'time_left': time_left_str,
-                                'end_time': end_datetime
-                            })
-                            logger.info(f"Добавлено активное событие (переходящее): {name} на {location}, осталось {time_left_str}")
-                            continue # Переходим к следующему окну
-
-
-                    # --- Вычисление предстоящего ---
-                    # Если не активно, ищем ближайшее время начала
-                    # Случай 1: start и end в один день (например, 01:00 - 02:00) или start и 24:00 (например, 23:00 - 24:00)
-                    if start_time <= end_time_for_comparison or is_end_midnight_next_day:
-                        if is_end_midnight_next_day:
-                            # Если событие заканчивается в 24:00, оно начинается сегодня и заканчивается завтра.
-                            # Если оно уже началось (start <= current), то оно активно (обработано выше).
-                            # Если оно еще не началось (current < start), то начнётся сегодня.
-                            if current_time_only < start_time: # Начнётся сегодня
-                                start_datetime_naive = datetime.combine(current_date_utc, start_time)
-                            else: # Уже началось, но активность не прошла (была бы выше), значит что-то не так с логикой или время на секунду изменилось.
-                                 # На всякий случай, если current_time == start_time и оно не активно, ищем следующий день
-                                 # Но это маловероятно, т.к. start <= current < 24:00 означает активность.
-                                 # Если всё же не активно, ищем следующий день.
-                                 start_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), start_time)
-                        else:
-                            if start_time > current_time_only: # Начнётся сегодня
-                                start_datetime_naive = datetime.combine(current_date_utc, start_time)
-                            else: # Началось сегодня, но уже прошло, ищем на завтра
-                                start_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), start_time)
-
-                    # Случай 2: start > end (например, 23:00 - 01:00)
-                    else: # start_time > end_time_for_comparison
-                        if current_time_only < start_time and current_time_only >= end_time_for_comparison: # Событие еще не началось сегодня (например, 22:00, а старт в 23:00)
-                            start_datetime_naive = datetime.combine(current_date_utc, start_time)
-                        else: # Событие уже прошло сегодня, ищем на завтра или позже
-                            start_datetime_naive = datetime.combine(current_date_utc + timedelta(days=1), start_time)
-
-                    # Сделать start_datetime aware
-                    start_datetime = start_datetime_naive.replace(tzinfo=timezone.utc) # <-- offset-aware
-
-                    time_to_start = start_datetime - current_time_utc # <-- Теперь оба aware
-                    total_seconds = int(time_to_start.total_seconds())
-                    hours, remainder = divmod(total_seconds, 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    time_parts = []
-                    if hours > 0: time_parts.append(f"{hours}ч")
-                    if minutes > 0: time_parts.append(f"{minutes}м")
-                    if seconds > 0 or not time_parts: time_parts.append(f"{seconds}с")
-                    time_to_start_str = " ".join(time_parts)
-
-                    # Проверяем, является ли это окно ближайшим для данной пары (name, location)
-                    key = (name, location)
-                    if key not in next_upcoming_for_location or start_datetime < next_upcoming_for_location[key]['start_time']:
-                        next_upcoming_for_location[key] = {
-                            'time_left': time_to_start_str,
-                            'start_time': start_datetime # <-- Убедиться, что это aware
-                        }
-                        logger.info(f"Найдено предстоящее событие для {name} на {location}, начнётся через {time_to_start_str} ({start_datetime.strftime('%Y-%m-%d %H:%M:%S UTC')})")
-
+                    start = parse_time_of_day(start_str)
+                    end = parse_time_of_day(end_str, allow_end_of_day=True)
                 except ValueError as e:
-                    logger.error(f"Error parsing time for event {name} at {location}: {start_str}, {end_str}. Error: {e}")
-                    # Пропускаем это окно, если ошибка парсинга (например, из-за 24:00 без обработки)
-                    continue # Переходим к следующему окну
-                except Exception as e:
-                    logger.error(f"Unexpected error processing time for event {name} at {location}: {start_str}, {end_str}. Error: {e}")
-                    continue # Переходим к следующему окну
-
-        # После обработки всех событий, добавляем ближайшие предстоящие из словаря
-        for (name, location), event_info in next_upcoming_for_location.items():
-             upcoming_events.append({
-                 'name': name,
-                 'location': location,
-                 'time_left': event_info['time_left'],
-                 'start_time': event_info['start_time'] # <-- Должно быть aware
-             })
+                    logger.error("Error parsing time for event %s at %s: %s, %s. Error: %s", name, location, start_str, end_str, e)
+                    continue
+                if end < start:
+                    # Окно пересекает полночь и заканчивается на следующий день
+                    end += SECONDS_PER_DAY
+                key_intervals.append((start, end))
+
+        index = cls()
+        for key, key_intervals in intervals.items():
+            if not key_intervals:
+                continue
+            key_intervals.sort()
+            starts = [start for start, _ in key_intervals]
+            ends = [end for _, end in key_intervals]
+            prefix_max_ends = []
+            running_max = 0
+            for end in ends:
+                running_max = max(running_max, end)
+                prefix_max_ends.append(running_max)
+            overnight = [position for position, end in enumerate(ends) if end > SECONDS_PER_DAY]
+            index.windows[key] = (starts, ends, prefix_max_ends, overnight)
+        return index
+
+    def lookup(self, now):
+        """Возвращает (активные, предстоящие) события на момент now (aware datetime в UTC)."""
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds_now = now.hour * 3600 + now.minute * 60 + now.second
+        active_events = []
+        upcoming_events = []
+
+        for (name, location), (starts, ends, prefix_max_ends, overnight) in self.windows.items():
+            # Окна с началом <= текущего времени: starts[:split]
+            split = bisect_right(starts, seconds_now)
+
+            # Активные окна, начавшиеся сегодня. prefix_max_ends позволяет остановиться,
+            # как только ни одно более раннее окно не может длиться до текущего момента.
+            active_positions = []
+            position = split - 1
+            while position >= 0 and prefix_max_ends[position] > seconds_now:
+                if ends[position] > seconds_now:
+                    active_positions.append((position, ends[position]))
+                position -= 1
+            # Активные окна, начавшиеся вчера и переходящие через полночь
+            for position in overnight:
+                if ends[position] - SECONDS_PER_DAY > seconds_now:
+                    active_positions.append((position, ends[position] - SECONDS_PER_DAY))
+
+            active_set = set()
+            for position, end in active_positions:
+                active_set.add(position)
+                end_datetime = midnight + timedelta(seconds=end)
+                seconds_left = int((end_datetime - now).total_seconds())
+                active_events.append({
+                    'name': name,
+                    'location': location,
+                    'time_left': format_time_left(seconds_left),
+                    'seconds_left': seconds_left,
+                    'end_time': end_datetime
+                })
+
+            # Ближайшее неактивное окно: сначала сегодня после текущего времени, затем завтра с начала суток
+            count = len(starts)
+            for offset in range(count):
+                position = (split + offset) % count
+                if position in active_set:
+                    continue
+                start = starts[position] if position >= split else starts[position] + SECONDS_PER_DAY
+                start_datetime = midnight + timedelta(seconds=start)
+                seconds_left = int((start_datetime - now).total_seconds())
+                upcoming_events.append({
+                    'name': name,
+                    'location': location,
+                    'time_left': format_time_left(seconds_left),
+                    'seconds_left': seconds_left,
+                    'start_time': start_datetime
+                })
+                break
 
         # Сортируем предстоящие события по времени начала
-        # Сортировка будет корректной, так как start_time теперь aware
         upcoming_events.sort(key=lambda x: x['start_time'])
+        return active_events, upcoming_events
 
-        logger.info(f"Вычисление по API завершено: {len(active_events)} активных, {len(upcoming_events)} предстоящих.")
+    def next_start(self, key, after):
+        """Начало первого окна пары key строго после момента after (aware datetime) или None."""
+        windows = self.windows.get(key)
+        if windows is None:
+            return None
+        starts = windows[0]
+        midnight = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        seconds_after = after.hour * 3600 + after.minute * 60 + after.second
+        position = bisect_right(starts, seconds_after)
+        if position < len(starts):
+            return midnight + timedelta(seconds=starts[position])
+        return midnight + timedelta(seconds=starts[0] + SECONDS_PER_DAY)
+
+# Индекс пересобирается только при смене объекта payload (то есть после новой загрузки из API)
+_compiled_schedule = None
+
+def get_schedule_index(data):
+    """Возвращает индекс для payload, компилируя его только при первом обращении."""
+    global _compiled_schedule
+    if _compiled_schedule is None or _compiled_schedule[0] is not data:
+        with SCHEDULE_SECONDS.time("compile"):
+            _compiled_schedule = (data, ScheduleIndex.from_payload(data))
+    return _compiled_schedule[1]
+
+def diff_schedules(old_index, new_index):
+    """Структурная разница двух расписаний по парам (событие, карта).
+
+    Возвращает (added, removed, moved): окна (name, location, start, end) и переносы
+    (name, location, (old_start, old_end), (new_start, new_end)). Перенос — исчезнувшее окно пары,
+    сопоставленное по порядку с появившимся окном той же пары.
+    """
+    added, removed, moved = [], [], []
+    for key in sorted(old_index.windows.keys() | new_index.windows.keys()):
+        old_windows = set(zip(*old_index.windows[key][:2])) if key in old_index.windows else set()
+        new_windows = set(zip(*new_index.windows[key][:2])) if key in new_index.windows else set()
+        gone = sorted(old_windows - new_windows)
+        came = sorted(new_windows - old_windows)
+        pairs = min(len(gone), len(came))
+        moved.extend((*key, old, new) for old, new in zip(gone[:pairs], came[:pairs]))
+        removed.extend((*key, *window) for window in gone[pairs:])
+        added.extend((*key, *window) for window in came[pairs:])
+    return added, removed, moved
+
+def format_window(start, end):
+    """'ЧЧ:ММ-ЧЧ:ММ' для окна в секундах от начала суток."""
+    return "-".join(f"{value // 3600 % 24:02d}:{value // 60 % 60:02d}" for value in (start, end))
+
+# Сколько изменённых окон перечислять в логе поимённо
+SCHEDULE_DIFF_LOG_LIMIT = 20
+
+def log_schedule_diff(previous, data):
+    """Пишет в лог, какие окна расписания добавлены, удалены или перенесены новым ответом MetaForge."""
+    old_index = None
+    if previous is not None:
+        # Индекс прежнего payload обычно уже скомпилирован для снимка событий
+        if _compiled_schedule is not None and _compiled_schedule[0] is previous:
+            old_index = _compiled_schedule[1]
+        else:
+            old_index = ScheduleIndex.from_payload(previous)
+    new_index = get_schedule_index(data)
+    if old_index is None:
+        logger.info("Получено расписание MetaForge: %d пар (событие, карта), %d окон",
+                    len(new_index.windows), sum(len(windows[0]) for windows in new_index.windows.values()))
+        return
+    added, removed, moved = diff_schedules(old_index, new_index)
+    SCHEDULE_CHANGES.inc("added", len(added))
+    SCHEDULE_CHANGES.inc("removed", len(removed))
+    SCHEDULE_CHANGES.inc("moved", len(moved))
+    if not (added or removed or moved):
+        logger.info("Ответ MetaForge изменился, но окна расписания те же.")
+        return
+    logger.info("Расписание MetaForge изменилось: добавлено %d, удалено %d, перенесено %d окон",
+                len(added), len(removed), len(moved))
+    changes = [f"+ {name} / {location} {format_window(start, end)}" for name, location, start, end in added]
+    changes += [f"- {name} / {location} {format_window(start, end)}" for name, location, start, end in removed]
+    changes += [f"~ {name} / {location} {format_window(*old)} -> {format_window(*new)}"
+                for name, location, old, new in moved]
+    for change in changes[:SCHEDULE_DIFF_LOG_LIMIT]:
+        logger.info("  %s", change)
+    if len(changes) > SCHEDULE_DIFF_LOG_LIMIT:
+        logger.info("  ... и ещё %d", len(changes) - SCHEDULE_DIFF_LOG_LIMIT)
+
+def calculate_events(data, now=None):
+    """Вычисляет активные/предстоящие события по payload MetaForge на момент now (по умолчанию — сейчас)."""
+    if now is None:
+        now = datetime.now(timezone.utc)
+    index = get_schedule_index(data)
+    with SCHEDULE_SECONDS.time("lookup"):
+        return index.lookup(now)
+
+# --- Функции для получения и обработки данных из API ---
+
+async def get_arc_raiders_events_from_api_calculated():
+    """Получает события из API MetaForge и вычисляет активные/предстоящие на основе расписания."""
+    try:
+        data = await events_cache.get()
+        active_events, upcoming_events = calculate_events(data)
+        logger.debug("Вычисление по API завершено: %d активных, %d предстоящих.", len(active_events), len(upcoming_events))
         return active_events, upcoming_events
 
-    except requests.RequestException as e:
-        logger.error(f"Ошибка при получении данных из API: {e}")
+    except CircuitOpenError as e:
+        # Смена состояния выключателя уже записана в лог; здесь не шумим каждые несколько секунд
+        logger.debug("%s", e)
+        return [], []
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Ошибка при получении данных из API: {e!r}")
         return [], []
     except Exception as e:
         logger.error(f"Неожиданная ошибка при обработке данных из API: {e}")
         return [], []
 
+# --- Отпечатки отправленных сообщений ---
+# Для каждого сообщения бота храним хэш последнего текста и клавиатуры. Если новый вариант совпадает,
+# edit_text не вызывается: Telegram всё равно ответил бы "message is not modified".
+class MessageFingerprints:
+    """Ограниченный LRU: (chat_id, message_id) -> хэш текста и клавиатуры."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self.skipped_edits = 0   # Правки, не отправленные из-за совпадения отпечатка
+        self.not_modified = 0    # Ответы "message is not modified", после которых не отправлено новое сообщение
+
+    @staticmethod
+    def fingerprint(text, reply_markup=None, parse_mode=None):
+        # Готовые клавиатуры живут всё время работы бота, поэтому их достаточно различать по имени;
+        # динамические сериализуются
+        markup_key = STATIC_MARKUP_KEYS.get(id(reply_markup))
+        if markup_key is None and reply_markup is not None:
+            markup_key = reply_markup.model_dump_json(exclude_none=True)
+        return hash((text, markup_key, parse_mode))
+
+    def get(self, chat_id, message_id):
+        key = (chat_id, message_id)
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, chat_id, message_id, value):
+        key = (chat_id, message_id)
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+message_fingerprints = MessageFingerprints(MESSAGE_FINGERPRINT_CACHE_SIZE)
+
+async def edit_or_send(message, text, reply_markup=None, parse_mode=None, keep_live=False):
+    """Редактирует сообщение бота; при совпадении отпечатка ничего не отправляет, при ошибке правки — отправляет новое.
+
+    Если в сообщении показывается другое меню, автообновление списка событий в нём выключается
+    (keep_live=True передаёт только сам список событий). Возвращает True, если запрос к Telegram был выполнен.
+    """
+    if not keep_live:
+        live_messages.unregister(message.chat.id, message.message_id)
+    fingerprint = MessageFingerprints.fingerprint(text, reply_markup, parse_mode)
+    if message_fingerprints.get(message.chat.id, message.message_id) == fingerprint:
+        message_fingerprints.skipped_edits += 1
+        return False
+    try:
+        await message.edit_text(text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except Exception as e:
+        if isinstance(e, TelegramBadRequest) and "message is not modified" in str(e):
+            # Содержимое уже такое же: запоминаем отпечаток и не отправляем дубликат
+            message_fingerprints.not_modified += 1
+            message_fingerprints.put(message.chat.id, message.message_id, fingerprint)
+            return True
+        # Если не получилось отредактировать (например, сообщение слишком старое), отправим новое
+        logger.warning(f"Не удалось отредактировать сообщение: {e}. Отправляем новое.")
+        sent = await message.answer(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        message_fingerprints.put(sent.chat.id, sent.message_id, fingerprint)
+        return True
+    message_fingerprints.put(message.chat.id, message.message_id, fingerprint)
+    return True
+
 # --- Обработчики команд и кнопок ---
 
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Отправляет приветственное сообщение с основными кнопками."""
-    # Клавиатура с кнопками в нужном порядке и с новыми названиями
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        # 1. События ARC Raiders
-        [types.InlineKeyboardButton(text="События ARC Raiders", callback_data="events")],
-        # 2. Обновление игры
-        [types.InlineKeyboardButton(text="Обновление игры", callback_data="game_update_text")],
-        # 3. Twitch
-        [types.InlineKeyboardButton(text="Twitch", url=LINKS["streams"])], # Использует URL из словаря LINKS
-        # 4. Телеграмм канал
-        [types.InlineKeyboardButton(text="Телеграмм канал", url=LINKS["telegram"])], # Использует URL из словаря LINKS
-        # 5. Обратная связь (ссылка)
-        # ЗАМЕНИТЕ "https://t.me/your_telegram_username" НА РЕАЛЬНУЮ ССЫЛКУ
-        [types.InlineKeyboardButton(text="Обратная связь", url="https://t.me/Silovik_ttv")],
-        # 6. Поддержка бота
-        [types.InlineKeyboardButton(text="Поддержка бота", url=LINKS["support"])], # Использует URL из словаря LINKS
-    ])
+    # Чат попадает в список получателей рассылок
+    user_registry.add(message.chat.id)
     # Отправляем НОВОЕ сообщение с главным меню
     await message.answer(
-        f"Привет, {message.from_user.first_name}! Выбери действие:",
-        reply_markup=keyboard
+        MAIN_MENU_TEXT.format(first_name=message.from_user.first_name),
+        reply_markup=MAIN_MENU_KEYBOARD
     )
 
 # Обработчик для обновления игры (ИЗМЕНЁН)
 @dp.callback_query(lambda c: c.data == 'game_update_text')
 async def process_callback_game_update(callback_query: types.CallbackQuery):
-    # Создаём клавиатуру с кнопками "Назад" и "События"
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        # <-- ПРОВЕРКА: callback_data="start_menu" (для возврата в главное меню)
-        [types.InlineKeyboardButton(text="🔙 Назад", callback_data="start_menu")],
-        # <-- ПРОВЕРКА: callback_data="events"
-        [types.InlineKeyboardButton(text="События ARC Raiders", callback_data="events")]
-    ])
-    # Редактируем текущее сообщение (главное меню), заменяя его на текст обновления с новой клавиатурой
-    try:
-        await callback_query.message.edit_text(
-            text=GAME_UPDATE_TEXT,
-            reply_markup=keyboard,
-            parse_mode='HTML'
-        )
+    # Редактируем текущее сообщение (главное меню), заменяя его на текст обновления с готовой клавиатурой
+    if await edit_or_send(callback_query.message, **GAME_UPDATE_MESSAGE):
         logger.info("Сообщение обновления игры отредактировано.")
-    except Exception as e:
-        logger.warning(f"Не удалось отредактировать сообщение об обновлении: {e}. Отправляем новое.")
-        # Если редактирование не удалось, отправим новое сообщение
-        await callback_query.message.answer(
-            text=GAME_UPDATE_TEXT,
-            reply_markup=keyboard,
-            parse_mode='HTML'
-        )
     await callback_query.answer()
 
+# --- Очередь обратной связи ---
+# Раньше каждое сообщение сразу уходило администратору: после патча поток отзывов упирался в лимит
+# на один чат, а неэкранированный текст ломал HTML. Теперь сообщение сначала записывается в SQLite,
+# а фоновая задача отправляет сводки и помечает записи отправленными только после успешной отправки.
+FEEDBACK_QUEUED = "queued"
+FEEDBACK_RATE_LIMITED = "rate_limited"
+FEEDBACK_DUPLICATE = "duplicate"
+
+def feedback_text_hash(text):
+    """Хэш текста без учёта регистра и пробелов — для поиска дубликатов."""
+    normalized = " ".join(text.casefold().split())
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+class FeedbackQueue:
+    """Надёжная очередь сообщений обратной связи в SQLite-файле бота."""
+
+    def __init__(self, path, user_limit, user_window, duplicate_window):
+        self.user_limit = user_limit
+        self.user_window = user_window
+        self.duplicate_window = duplicate_window
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS feedback ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, first_name TEXT, last_name TEXT, "
+            "username TEXT, text TEXT NOT NULL, text_hash TEXT NOT NULL, created_at REAL NOT NULL, sent_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS feedback_user ON feedback (user_id, created_at)")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS feedback_pending ON feedback (sent_at, id)")
+        self.accepted = 0
+        self.rate_limited = 0
+        self.duplicates = 0
+
+    def submit(self, user, text):
+        """Ставит сообщение в очередь. Возвращает FEEDBACK_QUEUED, FEEDBACK_RATE_LIMITED или FEEDBACK_DUPLICATE."""
+        now = time.time()
+        text_hash = feedback_text_hash(text)
+        duplicate = self._connection.execute(
+            "SELECT 1 FROM feedback WHERE user_id = ? AND text_hash = ? AND created_at > ? LIMIT 1",
+            (user.id, text_hash, now - self.duplicate_window),
+        ).fetchone()
+        if duplicate is not None:
+            self.duplicates += 1
+            return FEEDBACK_DUPLICATE
+        (recent,) = self._connection.execute(
+            "SELECT COUNT(*) FROM feedback WHERE user_id = ? AND created_at > ?", (user.id, now - self.user_window)
+        ).fetchone()
+        if recent >= self.user_limit:
+            self.rate_limited += 1
+            return FEEDBACK_RATE_LIMITED
+        # Запись подтверждается до ответа пользователю: после "спасибо" сообщение уже не потеряется
+        self._connection.execute(
+            "INSERT INTO feedback (user_id, first_name, last_name, username, text, text_hash, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user.id, user.first_name, user.last_name, user.username, text, text_hash, now),
+        )
+        self.accepted += 1
+        return FEEDBACK_QUEUED
+
+    def pending(self, limit):
+        """Неотправленные сообщения в порядке поступления."""
+        return self._connection.execute(
+            "SELECT id, user_id, first_name, last_name, username, text, created_at FROM feedback "
+            "WHERE sent_at IS NULL ORDER BY id LIMIT ?", (limit,)
+        ).fetchall()
+
+    def pending_count(self):
+        return self._connection.execute("SELECT COUNT(*) FROM feedback WHERE sent_at IS NULL").fetchone()[0]
+
+    def mark_sent(self, ids):
+        if ids:
+            self._connection.executemany(
+                "UPDATE feedback SET sent_at = ? WHERE id = ?", [(time.time(), feedback_id) for feedback_id in ids]
+            )
+
+    def purge(self):
+        """Удаляет отправленные записи, которые уже не нужны для лимита и поиска дубликатов."""
+        before = time.time() - max(self.user_window, self.duplicate_window)
+        self._connection.execute("DELETE FROM feedback WHERE sent_at IS NOT NULL AND created_at < ?", (before,))
+
+    def close(self):
+        self._connection.close()
+
+feedback_queue = FeedbackQueue(FSM_DB_PATH, FEEDBACK_USER_LIMIT, FEEDBACK_USER_WINDOW, FEEDBACK_DUPLICATE_WINDOW)
+
+def _escaped_prefix(text, room):
+    """Самый длинный префикс text, который после HTML-экранирования занимает не больше room символов.
+
+    Разрез по возможности переносится на перевод строки или пробел. Возвращает (экранированный префикс, остаток).
+    """
+    cut = min(len(text), room)
+    escaped = html.escape(text[:cut], quote=False)
+    while len(escaped) > room:
+        cut -= max(1, (len(escaped) - room) // 5)
+        escaped = html.escape(text[:cut], quote=False)
+    if cut < len(text):
+        boundary = max(text.rfind("\n", 0, cut), text.rfind(" ", 0, cut))
+        if boundary > cut // 2:
+            cut = boundary + 1
+            escaped = html.escape(text[:cut], quote=False)
+    return escaped, text[cut:]
+
+def build_feedback_digest(rows, limit):
+    """Сообщения сводки для администратора: [(HTML-текст, id записей, полностью вошедших в это сообщение)].
+
+    Весь пользовательский текст экранируется; длинное сообщение делится на части с пометкой "продолжение".
+    """
+    pages = []
+    current = f"📬 <strong>Обратная связь: {len(rows)} нов.</strong>\n"
+    completed = []
+    for feedback_id, user_id, first_name, last_name, username, text, created_at in rows:
+        name = html.escape(" ".join(part for part in (first_name, last_name) if part) or "без имени", quote=False)
+        sent_at = datetime.fromtimestamp(created_at, timezone.utc).strftime("%d.%m %H:%M")
+        header = (f"\n<strong>#{feedback_id}</strong> {sent_at} UTC, <a href=\"tg://user?id={user_id}\">{name}</a>"
+                  f" @{html.escape(username or 'не указано', quote=False)} (ID: {user_id})\n")
+        continued = f"\n<strong>#{feedback_id} (продолжение)</strong>\n"
+        rest = text
+        first_part = True
+        while True:
+            head = header if first_part else continued
+            room = limit - len(current) - len(head) - 1
+            # Не начинаем запись в почти заполненном сообщении: лучше перенести её в следующее
+            if current and room < min(len(html.escape(rest, quote=False)), 200):
+                pages.append((current, completed))
+                current, completed = "", []
+                continue
+            escaped, rest = _escaped_prefix(rest, room)
+            current += head + escaped + "\n"
+            first_part = False
+            if not rest:
+                completed.append(feedback_id)
+                break
+            pages.append((current, completed))
+            current, completed = "", []
+    if completed or current.strip():
+        pages.append((current, completed))
+    return pages
+
+async def feedback_digest_loop():
+    """Раз в FEEDBACK_DIGEST_INTERVAL секунд отправляет администратору накопившиеся сообщения обратной связи.
+
+    Записи помечаются отправленными после каждой успешной части сводки; при ошибке остаток ждёт следующего раза.
+    """
+    outbound_priority.set(PRIORITY_BULK)
+    while True:
+        await asyncio.sleep(FEEDBACK_DIGEST_INTERVAL)
+        try:
+            while True:
+                rows = feedback_queue.pending(FEEDBACK_DIGEST_BATCH)
+                if not rows:
+                    break
+                for text, completed in build_feedback_digest(rows, FEEDBACK_DIGEST_CHAR_LIMIT):
+                    await bot.send_message(chat_id=YOUR_TELEGRAM_ID, text=text, parse_mode='HTML',
+                                           disable_web_page_preview=True)
+                    feedback_queue.mark_sent(completed)
+                if len(rows) < FEEDBACK_DIGEST_BATCH:
+                    break
+            feedback_queue.purge()
+        except Exception as e:
+            logger.error("Не удалось отправить сводку обратной связи (%d в очереди): %r",
+                         feedback_queue.pending_count(), e)
+
 # --- НОВОЕ: Обработчики для обратной связи ---
 
 @dp.callback_query(lambda c: c.data == 'feedback_start')
 async def process_callback_feedback_start(callback_query: types.CallbackQuery, state: FSMContext):
     """Запрашивает сообщение пользователя для обратной связи."""
     await state.set_state(Feedback.waiting_for_message)
-    await callback_query.message.answer("Пожалуйста, введите ваше сообщение для обратной связи:")
+    await callback_query.message.answer(FEEDBACK_PROMPT_TEXT)
     await callback_query.answer()
 
 @dp.message(Feedback.waiting_for_message)
 async def process_feedback_message(message: types.Message, state: FSMContext):
-    """Получает сообщение пользователя и отправляет его администратору."""
-    user_message = message.text
-    user = message.from_user
-
-    # Формируем сообщение для отправки администратору
-    admin_message = f"""
-Новое сообщение в обратной связи от пользователя:
-
-ID: {user.id}
-Имя: {user.first_name} {user.last_name or ''}
-Имя пользователя: @{user.username or 'не указано'}
-
-Сообщение:
-{user_message}
-"""
+    """Получает сообщение пользователя и ставит его в очередь для администратора."""
+    user_message = message.text or message.caption
+    if not user_message:
+        # Стикер, фото без подписи и т.п.: ждём текст
+        await message.answer("Пожалуйста, отправьте сообщение текстом.")
+        return
 
     try:
-        # Отправляем сообщение администратору (ваш ID)
-        await bot.send_message(chat_id=YOUR_TELEGRAM_ID, text=admin_message, parse_mode='HTML')
-        # Отправляем подтверждение пользователю
-        await message.answer("Спасибо за ваше сообщение! Оно было отправлено.")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке сообщения администратору: {e}")
+        # Сообщение попадёт к администратору в ближайшей сводке
+        result = feedback_queue.submit(message.from_user, user_message)
+    except sqlite3.Error as e:
+        logger.error(f"Ошибка при сохранении сообщения обратной связи: {e}")
         await message.answer("Произошла ошибка при отправке сообщения. Пожалуйста, попробуйте позже.")
+        await state.clear()
+        return
+
+    if result == FEEDBACK_QUEUED:
+        await message.answer("Спасибо за ваше сообщение! Оно было отправлено.")
+    elif result == FEEDBACK_DUPLICATE:
+        await message.answer("Это сообщение уже получено, спасибо!")
+    else:
+        await message.answer(
+            f"Вы уже отправили {FEEDBACK_USER_LIMIT} сообщений за последние {int(FEEDBACK_USER_WINDOW // 60)} мин. "
+            f"Пожалуйста, попробуйте позже."
+        )
 
     # Сбрасываем состояние
     await state.clear()
 
 
+# --- Админские команды ---
+
+def is_admin(user):
+    """Проверяет, что команду отправил администратор (YOUR_TELEGRAM_ID)."""
+    return user is not None and str(user.id) == YOUR_TELEGRAM_ID
+
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Показывает счётчики кэша MetaForge и исходящей очереди."""
+    if not is_admin(message.from_user):
+        return
+    cache = events_cache.stats()
+    age = "нет данных" if cache["age"] is None else f"{cache['age']:.0f}с"
+    await message.answer(
+        f"Кэш MetaForge: попаданий {cache['hits']}, устаревших {cache['stale_hits']}, "
+        f"промахов {cache['misses']}, из запаса {cache['fallback_hits']}, загрузок {cache['refreshes']}, "
+        f"ошибок {cache['errors']}, возраст {age}\n"
+        f"Ответы MetaForge: 304 {UPSTREAM_RESPONSES.value('not_modified')}, "
+        f"без изменений {UPSTREAM_RESPONSES.value('unchanged')}, новых {UPSTREAM_RESPONSES.value('changed')}, "
+        f"получено {UPSTREAM_BYTES.value() / 1024:.0f} КБ\n"
+        f"Выключатель MetaForge: {upstream_breaker.state}, ошибок подряд {upstream_breaker.failures}, "
+        f"срабатываний {upstream_breaker.trips}\n"
+        f"Исходящая очередь: в очереди {outbound_queue.depth}, отправлено {outbound_queue.sent}, "
+        f"429 {outbound_queue.retry_after}, ошибок {outbound_queue.failed}\n"
+        f"Сэкономлено запросов к Bot API: {message_fingerprints.skipped_edits} правок без изменений, "
+        f"{message_fingerprints.not_modified} повторных отправок после \"not modified\"\n"
+        f"Живых сообщений: {len(live_messages)}, правок {live_messages.edits}, без изменений {live_messages.skipped}\n"
+        f"Обратная связь: в очереди {feedback_queue.pending_count()}, принято {feedback_queue.accepted}, "
+        f"отклонено по лимиту {feedback_queue.rate_limited}, дубликатов {feedback_queue.duplicates}\n"
+        f"Получателей рассылок: {len(user_registry)}\n"
+        f"Пользователей с настройками: {len(user_preferences)}"
+    )
+
+@dp.message(Command("invalidate_cache"))
+async def cmd_invalidate_cache(message: types.Message):
+    """Сбрасывает кэш MetaForge, чтобы следующий запрос получил свежие данные."""
+    if not is_admin(message.from_user):
+        return
+    if IS_WORKER:
+        # С MetaForge работает только супервизор: увидев эту команду, он сам сбросил свой кэш
+        # (WorkerPool.dispatch), а свежие данные придут воркеру через общий буфер
+        await message.answer("Кэш событий сброшен, свежие данные появятся в течение нескольких секунд.")
+        return
+    events_cache.invalidate()
+    logger.info("Кэш MetaForge сброшен администратором.")
+    await message.answer("Кэш событий сброшен.")
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, command: CommandObject):
+    """Рассылает всем, кто нажимал /start, текст обновления игры или текст после команды (HTML)."""
+    if not is_admin(message.from_user):
+        return
+    if broadcaster.active() is not None:
+        await message.answer("Рассылка уже идёт. /broadcast_status — прогресс, /broadcast_cancel — остановить.")
+        return
+    text = command.args or GAME_UPDATE_TEXT
+    try:
+        # Предпросмотр администратору заодно проверяет HTML до того, как текст уйдёт всем
+        await message.answer(text, reply_markup=GAME_UPDATE_KEYBOARD, parse_mode='HTML', disable_web_page_preview=True)
+    except TelegramBadRequest as e:
+        await message.answer(f"Текст не отправлен: {html.escape(str(e), quote=False)}")
+        return
+    progress = await message.answer(f"📣 Рассылка на {user_registry.active_count()} получателей начинается...")
+    broadcast_id = broadcaster.create(text, progress.message_id)
+    logger.info("Администратор запустил рассылку #%d", broadcast_id)
+
+@dp.message(Command("broadcast_status"))
+async def cmd_broadcast_status(message: types.Message):
+    """Показывает прогресс текущей (или последней) рассылки."""
+    if not is_admin(message.from_user):
+        return
+    broadcast = broadcaster.current()
+    await message.answer(broadcaster.describe(broadcast) if broadcast is not None else "Рассылок ещё не было.")
+
+@dp.message(Command("broadcast_cancel"))
+async def cmd_broadcast_cancel(message: types.Message):
+    """Останавливает текущую рассылку; уже отправленные сообщения остаются."""
+    if not is_admin(message.from_user):
+        return
+    broadcast = broadcaster.active()
+    if broadcast is None:
+        await message.answer("Активной рассылки нет.")
+        return
+    broadcaster.cancel(broadcast.id)
+    await message.answer(f"Рассылка #{broadcast.id} будет остановлена.")
+
+# --- Реестр пользователей и рассылки ---
+# Все чаты, где нажимали /start, хранятся в таблице bot_users. Рассылка идёт по возрастанию chat_id,
+# поэтому её прогресс — это один курсор (последний chat_id, до которого всё отправлено), и прерванная
+# рассылка продолжается с него после перезапуска. Скорость ограничивает исходящая очередь: сообщения
+# рассылки идут с низким приоритетом, поэтому ответы пользователям их обгоняют.
+class UserRegistry:
+    """Получатели рассылок: чаты, где нажимали /start. Заблокировавшие бота помечаются и пропускаются.
+
+    shared: файл делят воркеры. Блокировку отмечает воркер, выполняющий рассылку, а /start того же чата
+    приходит в его собственный воркер, поэтому набор известных чатов в памяти не ведётся и /start всегда пишет в базу.
+    """
+
+    def __init__(self, path, shared=False):
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bot_users (chat_id INTEGER PRIMARY KEY, started_at REAL NOT NULL, blocked_at REAL)"
+        )
+        self.shared = shared
+        # Известные активные чаты в памяти: повторный /start не обращается к базе
+        self._known = set() if shared else {
+            chat_id for (chat_id,) in self._connection.execute("SELECT chat_id FROM bot_users WHERE blocked_at IS NULL")
+        }
+
+    def add(self, chat_id):
+        if chat_id in self._known:
+            return
+        # Новый чат или вернувшийся после блокировки
+        self._connection.execute(
+            "INSERT INTO bot_users (chat_id, started_at) VALUES (?, ?) "
+            "ON CONFLICT (chat_id) DO UPDATE SET blocked_at = NULL WHERE blocked_at IS NOT NULL", (chat_id, time.time())
+        )
+        if not self.shared:
+            self._known.add(chat_id)
+
+    def mark_blocked(self, chat_id):
+        self._connection.execute("UPDATE bot_users SET blocked_at = ? WHERE chat_id = ?", (time.time(), chat_id))
+        self._known.discard(chat_id)
+
+    def recipients(self, after, limit):
+        """Следующие limit активных чатов с chat_id больше after."""
+        return [chat_id for (chat_id,) in self._connection.execute(
+            "SELECT chat_id FROM bot_users WHERE chat_id > ? AND blocked_at IS NULL ORDER BY chat_id LIMIT ?",
+            (after, limit),
+        )]
+
+    def active_count(self):
+        return self._connection.execute("SELECT COUNT(*) FROM bot_users WHERE blocked_at IS NULL").fetchone()[0]
+
+    def __len__(self):
+        if self.shared:
+            return self.active_count()
+        return len(self._known)
+
+    def close(self):
+        self._connection.close()
+
+user_registry = UserRegistry(FSM_DB_PATH, shared=IS_WORKER)
+
+class Broadcast:
+    __slots__ = ("id", "text", "status", "cursor", "total", "sent", "failed", "blocked", "progress_message_id")
+
+    def __init__(self, row):
+        (self.id, self.text, self.status, self.cursor, self.total,
+         self.sent, self.failed, self.blocked, self.progress_message_id) = row
+
+    @property
+    def processed(self):
+        return self.sent + self.failed + self.blocked
+
+class Broadcaster:
+    """Рассылки: таблица broadcasts с курсором и счётчиками и фоновая задача, которая их выполняет."""
+
+    ACTIVE = "active"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    # Курсор до начала рассылки: меньше любого chat_id (у групп он отрицательный)
+    START_CURSOR = -(2 ** 63)
+
+    def __init__(self, path, rate, concurrency, page_size):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.page_size = page_size
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, status TEXT NOT NULL, cursor INTEGER NOT NULL, "
+            "total INTEGER NOT NULL, sent INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+            "blocked INTEGER NOT NULL DEFAULT 0, progress_message_id INTEGER, created_at REAL NOT NULL, finished_at REAL)"
+        )
+        self._wakeup = asyncio.Event()
+        self._running = None  # Рассылка, которую сейчас выполняет этот процесс (счётчики свежее, чем в базе)
+        self._running_started = 0.0
+        self._running_done = 0  # Сколько получателей обработано с момента запуска в этом процессе
+        self.sent = 0  # Сообщений рассылок, отправленных этим процессом (для метрик)
+
+    def _select(self, where, args=()):
+        row = self._connection.execute(
+            "SELECT id, text, status, cursor, total, sent, failed, blocked, progress_message_id FROM broadcasts "
+            f"WHERE {where} ORDER BY id DESC LIMIT 1", args
+        ).fetchone()
+        return Broadcast(row) if row is not None else None
+
+    def active(self):
+        return self._select("status = ?", (self.ACTIVE,))
+
+    def last(self):
+        return self._select("1")
+
+    def current(self):
+        """Текущая рассылка (из памяти, если её выполняет этот процесс) или последняя завершённая."""
+        return self._running or self.active() or self.last()
+
+    def create(self, text, progress_message_id):
+        cursor = self._connection.execute(
+            "INSERT INTO broadcasts (text, status, cursor, total, progress_message_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (text, self.ACTIVE, self.START_CURSOR, user_registry.active_count(), progress_message_id, time.time()),
+        )
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    def cancel(self, broadcast_id):
+        self._connection.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (self.CANCELLED, time.time(), broadcast_id, self.ACTIVE),
+        )
+
+    def _status(self, broadcast_id):
+        return self._connection.execute("SELECT status FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()[0]
+
+    def _save(self, broadcast):
+        self._connection.execute(
+            "UPDATE broadcasts SET cursor = ?, sent = ?, failed = ?, blocked = ? WHERE id = ?",
+            (broadcast.cursor, broadcast.sent, broadcast.failed, broadcast.blocked, broadcast.id),
+        )
+
+    def _finish(self, broadcast):
+        # Только активную: остановленная администратором так и остаётся остановленной
+        self._connection.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (self.DONE, time.time(), broadcast.id, self.ACTIVE),
+        )
+        broadcast.status = self._status(broadcast.id)
+
+    def describe(self, broadcast):
+        """Строка прогресса для администратора."""
+        status = {self.ACTIVE: "идёт", self.DONE: "завершена", self.CANCELLED: "остановлена"}[broadcast.status]
+        line = (f"📣 Рассылка #{broadcast.id} {status}: обработано {broadcast.processed} из ~{broadcast.total} "
+                f"(доставлено {broadcast.sent}, заблокировали бота {broadcast.blocked}, ошибок {broadcast.failed})")
+        elapsed = time.monotonic() - self._running_started
+        if broadcast is self._running and broadcast.status == self.ACTIVE and elapsed > 0 and self._running_done:
+            rate = self._running_done / elapsed
+            remaining = max(0, broadcast.total - broadcast.processed)
+            line += f", {rate:.1f} сообщ./с, осталось ~{remaining / rate / 60:.0f} мин"
+        return line
+
+    async def run(self):
+        """Ждёт активную рассылку (новую или прерванную перезапуском) и выполняет её."""
+        outbound_priority.set(PRIORITY_BULK)
+        while True:
+            broadcast = self.active()
+            if broadcast is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), BROADCAST_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run_broadcast(broadcast)
+            except Exception as e:
+                logger.error("Рассылка #%d прервана ошибкой: %r", broadcast.id, e)
+                await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+    async def _run_broadcast(self, broadcast):
+        if IS_WORKER:
+            # Остальные воркеры замечают рассылку при очередном опросе и уменьшают свою долю лимита
+            # (outbound_share_loop); до этого не начинаем, чтобы вместе не превысить общий лимит
+            await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+        if broadcast.cursor != self.START_CURSOR:
+            logger.info("Рассылка #%d продолжается после chat_id %d", broadcast.id, broadcast.cursor)
+        self._running, self._running_started, self._running_done = broadcast, time.monotonic(), 0
+        queue = asyncio.Queue(maxsize=self.concurrency)
+        # Темп задаёт этот цикл, а не исходящая очередь: так рассылка не выбирает её лимит до конца
+        pacer = TokenBucket(self.rate, 1)
+        # Порции получателей в порядке chat_id:
+        # [сколько ещё не обработано, последний chat_id порции, доставлено, ошибок, заблокировали бота].
+        # Счётчики порции попадают в рассылку вместе со сдвигом курсора, поэтому после перезапуска
+        # повторно отправленная порция не учитывается дважды
+        pages = deque()
+        workers = [asyncio.create_task(self._worker(broadcast, queue)) for _ in range(self.concurrency)]
+        loop = asyncio.get_running_loop()
+        next_report = loop.time() + BROADCAST_PROGRESS_INTERVAL
+        fetch_after = broadcast.cursor
+        try:
+            while True:
+                chat_ids = user_registry.recipients(fetch_after, self.page_size)
+                if not chat_ids:
+                    break
+                page = [len(chat_ids), chat_ids[-1], 0, 0, 0]
+                pages.append(page)
+                fetch_after = chat_ids[-1]
+                for chat_id in chat_ids:
+                    delay = pacer.delay(time.monotonic())
+                    while delay > 0:
+                        await asyncio.sleep(delay)
+                        delay = pacer.delay(time.monotonic())
+                    pacer.consume()
+                    # Очередь ограничена: чтение из базы идёт со скоростью отправки
+                    await queue.put((chat_id, page))
+                self._advance(broadcast, pages)
+                if self._status(broadcast.id) != self.ACTIVE:
+                    logger.info("Рассылка #%d остановлена администратором", broadcast.id)
+                    return
+                if loop.time() >= next_report:
+                    next_report = loop.time() + BROADCAST_PROGRESS_INTERVAL
+                    await self._report(broadcast)
+            await queue.join()
+            self._advance(broadcast, pages)
+            self._finish(broadcast)
+            logger.info("Рассылка #%d завершена: %d доставлено, %d заблокировали бота, %d ошибок",
+                        broadcast.id, broadcast.sent, broadcast.blocked, broadcast.failed)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if broadcast.status == self.ACTIVE:
+                # Остановка или перезапуск: сохраняем то, что точно отправлено
+                self._advance(broadcast, pages)
+                broadcast.status = self._status(broadcast.id)
+            self._running = None
+            await self._report(broadcast)
+
+    def _advance(self, broadcast, pages):
+        """Сдвигает курсор за все порции, полностью обработанные по порядку, и сохраняет счётчики."""
+        while pages and pages[0][0] == 0:
+            _, broadcast.cursor, sent, failed, blocked = pages.popleft()
+            broadcast.sent += sent
+            broadcast.failed += failed
+            broadcast.blocked += blocked
+        self._save(broadcast)
+
+    async def _worker(self, broadcast, queue):
+        while True:
+            chat_id, page = await queue.get()
+            try:
+                page[self._send_outcome(await self._send(broadcast, chat_id))] += 1
+            finally:
+                page[0] -= 1
+                self._running_done += 1
+                queue.task_done()
+
+    @staticmethod
+    def _send_outcome(outcome):
+        # Позиция счётчика в порции (см. _run_broadcast)
+        return {"sent": 2, "failed": 3, "blocked": 4}[outcome]
+
+    async def _send(self, broadcast, chat_id):
+        """Отправляет рассылку в один чат; возвращает "sent", "blocked" или "failed"."""
+        try:
+            await bot.send_message(chat_id=chat_id, text=broadcast.text, reply_markup=GAME_UPDATE_KEYBOARD,
+                                   parse_mode='HTML', disable_web_page_preview=True)
+            self.sent += 1
+            return "sent"
+        except TelegramForbiddenError:
+            # Бот заблокирован или пользователь удалён: больше не пишем в этот чат
+            user_registry.mark_blocked(chat_id)
+            return "blocked"
+        except TelegramBadRequest as e:
+            if "chat not found" in str(e):
+                user_registry.mark_blocked(chat_id)
+                return "blocked"
+            logger.warning("Рассылка #%d: не удалось отправить в чат %s: %s", broadcast.id, chat_id, e)
+        except Exception as e:
+            logger.warning("Рассылка #%d: не удалось отправить в чат %s: %r", broadcast.id, chat_id, e)
+        return "failed"
+
+    async def _report(self, broadcast):
+        """Обновляет сообщение с прогрессом у администратора."""
+        if broadcast.progress_message_id is None:
+            return
+        try:
+            await bot.edit_message_text(text=self.describe(broadcast), chat_id=YOUR_TELEGRAM_ID,
+                                        message_id=broadcast.progress_message_id)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.debug("Прогресс рассылки #%d не обновлён: %s", broadcast.id, e)
+        except Exception as e:
+            logger.debug("Прогресс рассылки #%d не обновлён: %r", broadcast.id, e)
+
+    def close(self):
+        self._connection.close()
+
+# Рассылку выполняет один процесс (в режиме воркеров — воркер 0), поэтому темп у него полный
+broadcaster = Broadcaster(FSM_DB_PATH, BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_PAGE_SIZE)
+
+def worker_global_rate(broadcast_active):
+    """Доля общего лимита Telegram для этого воркера.
+
+    Без рассылки лимит делится поровну. Во время рассылки воркер 0 получает BROADCAST_RATE,
+    а остаток лимита для ответов пользователям делится поровну между всеми воркерами.
+    """
+    if not broadcast_active:
+        return OUTBOUND_GLOBAL_RATE / BOT_WORKERS
+    interactive = max(0.0, OUTBOUND_GLOBAL_RATE - BROADCAST_RATE) / BOT_WORKERS
+    return interactive + (BROADCAST_RATE if BOT_WORKER_INDEX == 0 else 0.0)
+
+async def outbound_share_loop():
+    """Воркер: раз в BROADCAST_POLL_INTERVAL подстраивает свою долю общего лимита под то, идёт ли рассылка."""
+    while True:
+        try:
+            outbound_queue.global_bucket.set_rate(worker_global_rate(broadcaster.active() is not None))
+        except Exception as e:
+            logger.error("Не удалось обновить долю лимита воркера: %r", e)
+        await asyncio.sleep(BROADCAST_POLL_INTERVAL)
+
+
 # Обработчик для событий (ИЗМЕНЁН)
 @dp.callback_query(lambda c: c.data == 'events')
 async def process_callback_events(callback_query: types.CallbackQuery):
     # Теперь вызываем send_events_message с edit=True
     # Это означает, что бот попытается ОТРЕДАКТИРОВАТЬ сообщение, в котором была нажата кнопка 'events'
     # (обычно это главное меню или меню обновления)
-    await send_events_message(callback_query.message, edit=True)
+    await send_events_message(callback_query.message, edit=True, user_id=callback_query.from_user.id)
     await callback_query.answer() # Отвечаем на callback_query
 
 # Функция отправки или редактирования сообщения с событиями
-async def send_events_message(message: types.Message, edit: bool = False):
+async def send_events_message(message: types.Message, edit: bool = False, page: int = 0, user_id: Optional[int] = None):
     # <-- ДОБАВЛЕНО ЛОГИРОВАНИЕ -->
-    logger.info("Вызов send_events_message")
-    active, upcoming = get_arc_raiders_events_from_api_calculated()
-    logger.info(f"Получено из API: {len(active)} активных, {len(upcoming)} предстоящих.")
-
-    # Форматируем активные события
-    active_message = format_event_message(active, "active")
-    # Форматируем ВСЕ предстоящие события (без ограничения)
-    upcoming_message = format_event_message(upcoming, "upcoming")
-
-    # Объединяем сообщения
-    response_text = active_message
-    if upcoming: # Добавляем предстоящие, только если они есть
-        response_text += "\n" + upcoming_message
-
-    # Клавиатура с кнопками "Обновить" и "Назад" (в главное меню)
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        # <-- ИСПРАВЛЕНО: callback_data="refresh_events"
-        [types.InlineKeyboardButton(text="🔄 Обновить", callback_data="refresh_events")], # <-- Изменено с "events" на "refresh_events"
-        # <-- ПРОВЕРКА: callback_data="start_menu"
-        [types.InlineKeyboardButton(text="🔙 Назад", callback_data="start_menu")]
-    ])
+    logger.debug("Вызов send_events_message")
+    # Текст уже собран и переведён фоновой задачей; здесь только фильтр по настройкам пользователя (с запоминанием)
+    snapshot = await get_events_snapshot()
+    preferences = user_preferences.get(user_id)
+    # Сообщение с включённым автообновлением показывает время с точностью до минуты (его обновляет live_messages)
+    live = edit and live_messages.is_live(message.chat.id, message.message_id)
+    pages = snapshot.live_pages_for(preferences) if live else snapshot.pages_for(preferences)
+    total = len(pages)
+    page = max(0, min(page, total - 1))
+    response_text = pages[page]
+    keyboard = events_page_keyboard(page, total, preferences_language(preferences), live)
 
     if edit:
-        # Пытаемся отредактировать существующее сообщение
-        try:
-            # parse_mode изменён на HTML
-            await message.edit_text(text=response_text, reply_markup=keyboard, parse_mode='HTML')
+        # Пытаемся отредактировать существующее сообщение; если текст не изменился, запрос не отправляется
+        if await edit_or_send(message, response_text, reply_markup=keyboard, parse_mode='HTML', keep_live=True):
             logger.info("Сообщение с событиями отредактировано.")
-        except Exception as e:
-            # Если не получилось отредактировать (например, сообщение слишком старое), отправим новое
-            logger.warning(f"Не удалось отредактировать сообщение: {e}. Отправляем новое.")
-            # parse_mode изменён на HTML
-            await message.answer(response_text, reply_markup=keyboard, parse_mode='HTML')
+        if live:
+            live_messages.touch(message.chat.id, message.message_id, page,
+                                MessageFingerprints.fingerprint(response_text, keyboard, 'HTML'))
     else:
         # Отправляем новое сообщение
-        # parse_mode изменён на HTML
-        await message.answer(response_text, reply_markup=keyboard, parse_mode='HTML')
+        sent = await message.answer(response_text, reply_markup=keyboard, parse_mode='HTML')
+        message_fingerprints.put(
+            sent.chat.id, sent.message_id,
+            MessageFingerprints.fingerprint(response_text, keyboard, 'HTML')
+        )
 
 
 # Новый обработчик для обновления (редактирования) сообщения с событиями
 @dp.callback_query(lambda c: c.data == 'refresh_events')
 async def process_callback_refresh_events(callback_query: types.CallbackQuery):
     # Вызываем send_events_message с edit=True
-    logger.info("Обработка callback 'refresh_events'") # <-- ДОБАВЛЕНО ЛОГИРОВАНИЕ
-    await send_events_message(callback_query.message, edit=True)
+    logger.debug("Обработка callback 'refresh_events'") # <-- ДОБАВЛЕНО ЛОГИРОВАНИЕ
+    await send_events_message(callback_query.message, edit=True, user_id=callback_query.from_user.id)
     # ВАЖНО: НЕ вызываем callback_query.answer() сразу, потому что edit_text может занять время
     # aiogram сам вызовет answer, если edit_text прошёл успешно.
     # Если edit_text не удался и было отправлено новое сообщение, answer нужно вызвать вручную.
@@ -474,71 +2306,1574 @@ async def process_callback_refresh_events(callback_query: types.CallbackQuery):
     except Exception:
         pass # Игнорируем ошибку, если answer не нужен/невозможен
 
+# Переход между страницами списка событий (и "Обновить" на конкретной странице)
+@dp.callback_query(lambda c: c.data and c.data.startswith('events_page:'))
+async def process_callback_events_page(callback_query: types.CallbackQuery):
+    page_str = callback_query.data.split(':', 1)[1]
+    page = int(page_str) if page_str.isdigit() else 0
+    await send_events_message(callback_query.message, edit=True, page=page, user_id=callback_query.from_user.id)
+    await callback_query.answer()
+
 # Обработчик для кнопки "Назад" из меню событий
 @dp.callback_query(lambda c: c.data == 'start_menu')
 async def process_callback_back_to_start(callback_query: types.CallbackQuery):
-    # Редактируем сообщение с событиями, заменяя его на главное меню
-    # Для этого нужно получить клавиатуру главного меню
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        # <-- ПРОВЕРКА: callback_data="events"
-        [types.InlineKeyboardButton(text="События ARC Raiders", callback_data="events")],
-        [types.InlineKeyboardButton(text="📺 Стримы", url=LINKS["streams"])],
-        [types.InlineKeyboardButton(text="💬 Телеграмм", url=LINKS["telegram"])],
-        [types.InlineKeyboardButton(text="💸 Поддержка", url=LINKS["support"])],
-        [types.InlineKeyboardButton(text="✉️ Обратная связь", callback_data="feedback_start")],
-        [types.InlineKeyboardButton(text="🆕 Обновление игры", callback_data="game_update_text")]
-    ])
-    try:
-        # Пытаемся отредактировать сообщение (список событий или обновление) и заменить его на главное меню
-        await callback_query.message.edit_text(
-            text=f"Привет, {callback_query.from_user.first_name}! Выбери действие:",
-            reply_markup=keyboard
-        )
+    # Редактируем сообщение с событиями, заменяя его на главное меню (та же клавиатура, что и в /start)
+    text = MAIN_MENU_TEXT.format(first_name=callback_query.from_user.first_name)
+    # Пытаемся отредактировать сообщение (список событий или обновление) и заменить его на главное меню
+    if await edit_or_send(callback_query.message, text, reply_markup=MAIN_MENU_KEYBOARD):
         logger.info("Сообщение отредактировано: возврат в главное меню.")
-    except Exception as e:
-        logger.warning(f"Не удалось отредактировать сообщение для возврата в главное меню: {e}.")
-        # Если редактировать не получилось, отправим новое сообщение с главным меню
-        await callback_query.message.answer(
-            f"Привет, {callback_query.from_user.first_name}! Выбери действие:",
-            reply_markup=keyboard
-        )
     await callback_query.answer() # Отвечаем на callback_query
 
+# Включение и выключение автообновления сообщения с событиями
+@dp.callback_query(lambda c: c.data and c.data.startswith('live:'))
+async def process_callback_live(callback_query: types.CallbackQuery):
+    _, action, page_str = callback_query.data.split(':', 2)
+    page = int(page_str) if page_str.isdigit() else 0
+    message = callback_query.message
+    texts = UI_TEXTS[preferences_language(user_preferences.get(callback_query.from_user.id))]
+    notice = None
+    if action == "on":
+        if live_messages.register(message.chat.id, message.message_id, callback_query.from_user.id, page):
+            notice = texts["live_started"].format(minutes=int(LIVE_MESSAGE_TTL // 60))
+        else:
+            await callback_query.answer(texts["live_full"], show_alert=True)
+            return
+    else:
+        live_messages.unregister(message.chat.id, message.message_id)
+    await send_events_message(message, edit=True, page=page, user_id=callback_query.from_user.id)
+    await callback_query.answer(notice)
+
 # --- Форматирование сообщения с переводом, без ограничения и с эмодзи (HTML) ---
-def format_event_message(events, event_type="active"):
-    """Форматирует список событий в текстовое сообщение с переводом и эмодзи (HTML)."""
+def format_event_row(event, event_type="active", lang="ru", minutes_only=False):
+    """Одна строка события на нужном языке — законченный HTML-фрагмент.
+
+    minutes_only: время с точностью до минуты (округление вверх) — для сообщений с автообновлением.
+    """
+    texts = UI_TEXTS[lang]
+    # Получаем перевод или оставляем оригинальное имя, если перевод не найден
+    translated_name = EVENT_NAMES[lang].get(event['name'], event['name'])
+    translated_location = MAP_NAMES[lang].get(event['location'], event['location'])
+    if 'seconds_left' in event:
+        seconds_left = event['seconds_left']
+        if minutes_only:
+            seconds_left = -(-seconds_left // 60) * 60
+        time_left = format_time_left(seconds_left, texts["units"])
+    else:
+        time_left = event['time_left']
+    # Активные: название курсивом, карта жирным; предстоящие: оба жирным
+    template = texts["active_line"] if event_type == "active" else texts["upcoming_line"]
+    return template.format(name=translated_name, location=translated_location, time_left=time_left)
+
+def format_event_lines(events, event_type="active", lang="ru"):
+    """Строки раздела событий с переводом и эмодзи (HTML). Каждая строка — законченный HTML-фрагмент."""
+    texts = UI_TEXTS[lang]
     if not events:
-        # Если список пуст, возвращаем пустую строку или сообщение, только если это активные
+        # Если список пуст, возвращаем сообщение, только если это активные
         if event_type == "active":
-             # parse_mode='HTML', так что используем теги
-             return f"Нет активных событий.\n"
+             return [texts["no_active"]]
         else: # Для предстоящих, если список пуст, просто не выводим заголовок
-             return "" # или f"Нет предстоящих событий в ближайшее время.\n" если нужно сообщение
-
+             return []
     # Выбираем заголовок с эмодзи
-    # parse_mode='HTML', так что используем теги
-    header = "<strong>🟢 Активные события:</strong>\n" if event_type == "active" else "<strong>🔴 Предстоящие события:</strong>\n"
-    message = header
-    for event in events:
-        # Получаем перевод или оставляем оригинальное имя, если перевод не найден
-        translated_name = EVENT_TRANSLATIONS.get(event['name'], event['name'])
-        translated_location = MAP_TRANSLATIONS.get(event['location'], event['location'])
+    header = texts["active_header"] if event_type == "active" else texts["upcoming_header"]
+    return [header] + [format_event_row(event, event_type, lang) for event in events]
 
-        if event_type == "active":
-            # parse_mode='HTML', используем теги <strong> и <em>
-            # <em> для курсива, <strong> для жирного
-            # translated_name будет курсивом, location - жирным
-            message += f"- <em>{translated_name}</em> на карте <strong>{translated_location}</strong> (осталось: {event['time_left']})\n"
+def format_event_message(events, event_type="active", lang="ru"):
+    """Форматирует список событий в текстовое сообщение с переводом и эмодзи (HTML)."""
+    return "".join(format_event_lines(events, event_type, lang))
+
+def assemble_event_lines(active_lines, upcoming_lines, lang="ru"):
+    """Все строки сообщения: заголовок и активные (или "нет активных"), затем предстоящие, если они есть."""
+    texts = UI_TEXTS[lang]
+    lines = [texts["active_header"], *active_lines] if active_lines else [texts["no_active"]]
+    if upcoming_lines: # Добавляем предстоящие, только если они есть
+        lines.append("\n")
+        lines.append(texts["upcoming_header"])
+        lines.extend(upcoming_lines)
+    return lines
+
+def paginate_lines(lines, limit):
+    """Разбивает строки на страницы не длиннее limit символов. Строки не разрываются, поэтому HTML-теги остаются целыми."""
+    pages = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) > limit:
+            pages.append("".join(current))
+            current = []
+            size = 0
+        if not current and line == "\n":
+            continue  # Пустая строка-разделитель в начале страницы не нужна
+        current.append(line)
+        size += len(line)
+    if current:
+        pages.append("".join(current))
+    return pages or [UI_TEXTS["ru"]["no_active"]]
+
+# Клавиатуры страниц создаются один раз на (страница, всего страниц, язык) и переиспользуются
+_events_page_keyboards = {}
+
+def events_page_keyboard(page, total, lang="ru", live=False):
+    """Клавиатура сообщения с событиями: навигация по страницам, "Обновить", автообновление, "Подписки", "Настройки", "Назад"."""
+    if total <= 1:
+        return (LIVE_EVENTS_KEYBOARDS if live else EVENTS_KEYBOARDS)[lang]
+    keyboard = _events_page_keyboards.get((page, total, lang, live))
+    if keyboard is None:
+        navigation = []
+        if page > 0:
+            navigation.append(types.InlineKeyboardButton(text="◀️", callback_data=f"events_page:{page - 1}"))
+        navigation.append(types.InlineKeyboardButton(text=f"{page + 1}/{total}", callback_data=f"events_page:{page}"))
+        if page < total - 1:
+            navigation.append(types.InlineKeyboardButton(text="▶️", callback_data=f"events_page:{page + 1}"))
+        # "Обновить" остаётся на текущей странице
+        keyboard = build_events_keyboard(lang, navigation, refresh_data=f"events_page:{page}", page=page, live=live)
+        _events_page_keyboards[(page, total, lang, live)] = keyboard
+        STATIC_MARKUP_KEYS[id(keyboard)] = f"events_page:{page}/{total}:{lang}" + (":live" if live else "")
+    return keyboard
+
+# --- Настройки пользователей ---
+# Настройки упакованы в одно целое число: биты 0-3 — индекс языка в LANGUAGES,
+# биты 4-19 — маска избранных карт (по MAP_INDEX), с бита 20 — маска скрытых событий (по EVENT_INDEX).
+# Пользователи с настройками по умолчанию (0) не хранятся вовсе.
+DEFAULT_PREFERENCES = 0
+_PREFERENCES_MAPS_SHIFT = 4
+_PREFERENCES_EVENTS_SHIFT = 20
+
+def make_preferences(lang_idx, favourite_maps, hidden_events):
+    return lang_idx | (favourite_maps << _PREFERENCES_MAPS_SHIFT) | (hidden_events << _PREFERENCES_EVENTS_SHIFT)
+
+def split_preferences(preferences):
+    """Распаковывает настройки в (индекс языка, маска избранных карт, маска скрытых событий)."""
+    lang_idx = preferences & 0xF
+    favourite_maps = (preferences >> _PREFERENCES_MAPS_SHIFT) & 0xFFFF
+    hidden_events = preferences >> _PREFERENCES_EVENTS_SHIFT
+    return lang_idx, favourite_maps, hidden_events
+
+def preferences_language(preferences):
+    lang_idx = preferences & 0xF
+    return LANGUAGES[lang_idx] if lang_idx < len(LANGUAGES) else LANGUAGES[0]
+
+class PreferencesStore:
+    """Настройки пользователей: словарь user_id -> упакованное число в памяти и таблица в SQLite-файле бота.
+
+    shared: файл делят несколько процессов-воркеров. Пользователь может писать боту из разных чатов
+    (личка, группы), а они попадают в разные воркеры, поэтому словарь в памяти не ведётся
+    и каждое чтение идёт в базу (поиск по первичному ключу — микросекунды).
+    """
+
+    def __init__(self, path, shared=False):
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS user_preferences (user_id INTEGER PRIMARY KEY, preferences INTEGER NOT NULL)"
+        )
+        self.shared = shared
+        self._preferences = {} if shared else dict(
+            self._connection.execute("SELECT user_id, preferences FROM user_preferences")
+        )
+
+    def get(self, user_id):
+        if self.shared:
+            row = self._connection.execute(
+                "SELECT preferences FROM user_preferences WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return row[0] if row is not None else DEFAULT_PREFERENCES
+        return self._preferences.get(user_id, DEFAULT_PREFERENCES)
+
+    def set(self, user_id, preferences):
+        # Настройки меняются редко (нажатия в меню), поэтому пишем сразу, одной короткой транзакцией
+        if preferences == DEFAULT_PREFERENCES:
+            self._preferences.pop(user_id, None)
+            self._connection.execute("DELETE FROM user_preferences WHERE user_id = ?", (user_id,))
+        else:
+            if not self.shared:
+                self._preferences[user_id] = preferences
+            self._connection.execute(
+                "INSERT OR REPLACE INTO user_preferences (user_id, preferences) VALUES (?, ?)", (user_id, preferences)
+            )
+
+    def __len__(self):
+        if self.shared:
+            return self._connection.execute("SELECT COUNT(*) FROM user_preferences").fetchone()[0]
+        return len(self._preferences)
+
+    def close(self):
+        self._connection.close()
+
+user_preferences = PreferencesStore(FSM_DB_PATH, shared=IS_WORKER)
+
+def build_view_lines(sections, preferences):
+    """Строки сообщения для настроек пользователя: фильтр по уже переведённым строкам снимка."""
+    lang_idx, favourite_maps, hidden_events = split_preferences(preferences)
+    lang = preferences_language(preferences)
+    active_rows, upcoming_rows = sections[lang]
+
+    def visible(event_idx, map_idx):
+        if event_idx >= 0 and (hidden_events >> event_idx) & 1:
+            return False
+        # Если избранные карты заданы, показываем только их (неизвестные карты скрываются)
+        return not favourite_maps or (map_idx >= 0 and (favourite_maps >> map_idx) & 1)
+
+    active_lines = [line for event_idx, map_idx, line in active_rows if visible(event_idx, map_idx)]
+    upcoming_lines = [line for event_idx, map_idx, line in upcoming_rows if visible(event_idx, map_idx)]
+    return assemble_event_lines(active_lines, upcoming_lines, lang)
+
+# --- Фоновый снимок событий ---
+# Списки и HTML-текст пересобираются одной задачей раз в EVENTS_REFRESH_INTERVAL секунд,
+# а обработчики только читают готовый снимок — задержка ответа не зависит от API и числа пользователей.
+class EventsSnapshot:
+    """Готовое к отправке представление событий на момент built_at."""
+
+    # Сколько разных вариантов настроек запоминать на один снимок
+    MAX_VIEWS = 4096
+
+    def __init__(self, version, built_at, active, upcoming, data_as_of=None):
+        self.version = version
+        self.built_at = built_at
+        self.active = active
+        self.upcoming = upcoming
+        # Если задано — MetaForge недоступен и события рассчитаны по ответу, полученному в этот момент
+        self.data_as_of = data_as_of
+        # Строки, переведённые один раз на каждый язык: lang -> (активные, предстоящие),
+        # где каждая строка — (индекс события, индекс карты, HTML)
+        self.sections = self._build_sections()
+        # Те же строки с точностью до минуты для живых сообщений; собираются при первом обращении
+        self._live_sections = None
+        # Страницы по настройкам пользователя; живут вместе со снимком, поэтому ключ (настройки, версия) не нужен
+        self._views = {}
+        self._live_views = {}
+        # Результаты inline-запросов по нормализованному запросу — тоже вместе со снимком
+        self._inline_results = {}
+        # Страницы HTML-текста для настроек по умолчанию, разбитые один раз при сборке снимка
+        self.pages = self.pages_for(DEFAULT_PREFERENCES)
+
+    def _build_sections(self, minutes_only=False):
+        sections = {}
+        for lang in LANGUAGES:
+            sections[lang] = (
+                [(EVENT_INDEX.get(event['name'], -1), MAP_INDEX.get(event['location'], -1), format_event_row(event, "active", lang, minutes_only)) for event in self.active],
+                [(EVENT_INDEX.get(event['name'], -1), MAP_INDEX.get(event['location'], -1), format_event_row(event, "upcoming", lang, minutes_only)) for event in self.upcoming],
+            )
+        return sections
+
+    def pages_for(self, preferences):
+        """Страницы для настроек пользователя (с запоминанием)."""
+        return self._view(self._views, self.sections, preferences)
+
+    def live_sections(self):
+        """Строки с точностью до минуты (собираются при первом обращении)."""
+        if self._live_sections is None:
+            with RENDER_SECONDS.time("live"):
+                self._live_sections = self._build_sections(minutes_only=True)
+        return self._live_sections
+
+    def live_pages_for(self, preferences):
+        """Страницы живого сообщения: время с точностью до минуты и пометка об автообновлении (с запоминанием)."""
+        return self._view(self._live_views, self.live_sections(), preferences, "live_footer")
+
+    def inline_results(self, query):
+        """Все результаты inline-запроса (с запоминанием). query — нормализованный текст, см. normalize_inline_query."""
+        results = self._inline_results.get(query)
+        if results is None:
+            with RENDER_SECONDS.time("inline"):
+                results = build_inline_results(self, query)
+            if len(self._inline_results) < self.MAX_VIEWS:
+                self._inline_results[query] = results
+        return results
+
+    def _view(self, views, sections, preferences, footer=None):
+        pages = views.get(preferences)
+        if pages is None:
+            with RENDER_SECONDS.time("view"):
+                pages = paginate_lines(build_view_lines(sections, preferences), EVENTS_PAGE_CHAR_LIMIT)
+                texts = UI_TEXTS[preferences_language(preferences)]
+                marker = ""
+                if self.data_as_of is not None:
+                    marker = texts["data_as_of"].format(time=self.data_as_of.strftime("%d.%m %H:%M"))
+                if footer is not None:
+                    marker += texts[footer]
+                if marker:
+                    pages = [page + marker for page in pages]
+            if len(views) < self.MAX_VIEWS:
+                views[preferences] = pages
+        return pages
+
+current_snapshot = None
+_snapshot_version = 0
+_snapshot_build = None  # Задача первой сборки, если снимка ещё нет
+
+async def build_events_snapshot():
+    """Получает данные (через кэш), вычисляет события и сохраняет новый снимок."""
+    global current_snapshot, _snapshot_version
+    active, upcoming = await get_arc_raiders_events_from_api_calculated()
+    # Снимок переводит ВСЕ события на все языки и делит текст на страницы, чтобы не превысить лимит длины сообщения Telegram
+    _snapshot_version += 1
+    with RENDER_SECONDS.time("snapshot"):
+        current_snapshot = EventsSnapshot(
+            _snapshot_version, datetime.now(timezone.utc), active, upcoming, upstream_data_as_of()
+        )
+    return current_snapshot
+
+async def get_events_snapshot():
+    """Возвращает последний снимок; если его ещё нет, все ожидающие получают результат одной сборки."""
+    global _snapshot_build
+    if current_snapshot is not None:
+        return current_snapshot
+    if _snapshot_build is None:
+        _snapshot_build = asyncio.ensure_future(build_events_snapshot())
+        _snapshot_build.add_done_callback(_reset_snapshot_build)
+    return await asyncio.shield(_snapshot_build)
+
+def _reset_snapshot_build(task):
+    global _snapshot_build
+    _snapshot_build = None
+    if not task.cancelled():
+        task.exception()
+
+async def events_snapshot_loop():
+    """Пересобирает снимок событий с фиксированным шагом, пока бот работает."""
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        try:
+            await build_events_snapshot()
+        except Exception as e:
+            logger.error(f"Не удалось обновить снимок событий: {e}")
+        # Считаем следующий тик от расписания, а не от окончания сборки, чтобы шаг не "уплывал"
+        next_tick += EVENTS_REFRESH_INTERVAL
+        now = loop.time()
+        if next_tick < now:
+            next_tick = now
+        await asyncio.sleep(next_tick - now)
+
+# --- Подписки на уведомления о начале событий ---
+# Подписчики хранятся по ключу (событие, карта). Планировщик держит одну кучу таймеров
+# с одной записью на ключ (а не на пользователя) и при срабатывании рассылает уведомление всем подписчикам ключа.
+# Сами подписки хранятся в SQLite-файле бота и переживают перезапуск.
+
+class SubscriptionStore:
+    """Подписки (chat_id, событие, карта) в SQLite-файле бота; в памяти их держит планировщик."""
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "chat_id INTEGER NOT NULL, event TEXT NOT NULL, location TEXT NOT NULL, "
+            "PRIMARY KEY (chat_id, event, location))"
+        )
+
+    def load(self):
+        """Все подписки: список (chat_id, (событие, карта))."""
+        return [(chat_id, (event, location)) for chat_id, event, location in
+                self._connection.execute("SELECT chat_id, event, location FROM subscriptions")]
+
+    def add(self, chat_id, key):
+        self._connection.execute(
+            "INSERT OR IGNORE INTO subscriptions (chat_id, event, location) VALUES (?, ?, ?)", (chat_id, *key)
+        )
+
+    def remove(self, chat_id, key):
+        self._connection.execute(
+            "DELETE FROM subscriptions WHERE chat_id = ? AND event = ? AND location = ?", (chat_id, *key)
+        )
+
+    def close(self):
+        self._connection.close()
+
+class NotificationScheduler:
+    """Куча таймеров "за N минут до начала" для всех подписанных пар (событие, карта)."""
+
+    def __init__(self, lead_seconds, store):
+        self.lead_seconds = lead_seconds
+        self.store = store
+        self.subscribers = {}  # (name, location) -> set(chat_id)
+        self._heap = []  # (notify_at, start_at, key) в секундах epoch
+        self._scheduled = {}  # key -> start_at актуальной записи в куче; прочие записи устарели
+        # key -> start_at последнего разосланного уведомления: после перестройки кучи
+        # (новое расписание) то же начало не объявляется повторно
+        self._announced = {}
+        self._loaded = False
+        self._index = None  # Индекс расписания, по которому построена куча
+        self._wakeup = asyncio.Event()
+        self._send_tasks = set()
+        self.sent = 0
+
+    def is_subscribed(self, chat_id, key):
+        return chat_id in self.subscribers.get(key, ())
+
+    def toggle(self, chat_id, key):
+        """Подписывает или отписывает чат; возвращает True, если подписка теперь включена."""
+        chats = self.subscribers.setdefault(key, set())
+        if chat_id in chats:
+            chats.discard(chat_id)
+            self.store.remove(chat_id, key)
+            if not chats:
+                del self.subscribers[key]
+                self._scheduled.pop(key, None)
+            return False
+        chats.add(chat_id)
+        self.store.add(chat_id, key)
+        if len(chats) == 1:
+            self._schedule(key, datetime.now(timezone.utc))
+            self._wakeup.set()
+        return True
+
+    def unsubscribe_chat(self, chat_id):
+        """Удаляет все подписки чата (например, если пользователь заблокировал бота)."""
+        for key in list(self.subscribers):
+            if chat_id in self.subscribers[key]:
+                self.toggle(chat_id, key)
+
+    def load(self):
+        """Поднимает сохранённые подписки. Воркер берёт только свои чаты (тот же chat_id % BOT_WORKERS, что у супервизора)."""
+        for chat_id, key in self.store.load():
+            if IS_WORKER and chat_id % BOT_WORKERS != BOT_WORKER_INDEX:
+                continue
+            self.subscribers.setdefault(key, set()).add(chat_id)
+        self._loaded = True
+        logger.info("Загружено подписок на уведомления: %d", sum(len(chats) for chats in self.subscribers.values()))
+
+    def _schedule(self, key, after):
+        if self._index is None:
+            return
+        announced = self._announced.get(key)
+        if announced is not None and announced >= after.timestamp():
+            # Это начало уже объявлено — ищем следующее
+            after = datetime.fromtimestamp(announced, timezone.utc)
+        start = self._index.next_start(key, after)
+        if start is None:
+            self._scheduled.pop(key, None)
+            return
+        start_at = start.timestamp()
+        self._scheduled[key] = start_at
+        heapq.heappush(self._heap, (start_at - self.lead_seconds, start_at, key))
+
+    def _rebuild(self, index):
+        """Перестраивает кучу по новому расписанию."""
+        self._index = index
+        self._heap = []
+        self._scheduled = {}
+        now = datetime.now(timezone.utc)
+        for key in self.subscribers:
+            self._schedule(key, now)
+
+    async def run(self):
+        """Основной цикл: спит до ближайшего таймера, изменения подписок или смены расписания."""
+        if not self._loaded:
+            # Подписки загружаются здесь, а не при импорте: супервизору они не нужны
+            self.load()
+        while True:
+            if _compiled_schedule is not None and _compiled_schedule[1] is not self._index:
+                self._rebuild(_compiled_schedule[1])
+
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                notify_at, start_at, key = heapq.heappop(self._heap)
+                if self._scheduled.get(key) != start_at:
+                    continue  # Устаревшая запись: ключ перепланирован или отписан
+                due.append((start_at, key))
+                self._announced[key] = start_at
+                # Следующее окно этого ключа — строго после только что объявленного начала
+                self._schedule(key, datetime.fromtimestamp(start_at, timezone.utc))
+            if due:
+                task = asyncio.create_task(self._notify(due))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+
+            # Просыпаемся не реже, чем обновляется снимок, чтобы заметить новое расписание
+            timeout = EVENTS_REFRESH_INTERVAL
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _notify(self, due):
+        """Собирает одно сообщение на чат по всем сработавшим таймерам и рассылает через исходящую очередь."""
+        per_chat = {}
+        for start_at, key in due:
+            for chat_id in self.subscribers.get(key, ()):
+                per_chat.setdefault(chat_id, []).append((start_at, key))
+
+        # Лимиты соблюдает исходящая очередь; низкий приоритет пропускает вперёд ответы пользователям
+        outbound_priority.set(PRIORITY_BULK)
+        chat_ids = list(per_chat)
+        for batch_start in range(0, len(chat_ids), NOTIFY_BATCH_SIZE):
+            batch = chat_ids[batch_start:batch_start + NOTIFY_BATCH_SIZE]
+            await asyncio.gather(*(self._send(chat_id, per_chat[chat_id]) for chat_id in batch))
+
+    async def _send(self, chat_id, items):
+        lines = ["🔔 <strong>Скоро начнётся:</strong>"]
+        for start_at, (name, location) in sorted(items):
+            translated_name = EVENT_TRANSLATIONS.get(name, name)
+            translated_location = MAP_TRANSLATIONS.get(location, location)
+            time_left = format_time_left(max(0, int(start_at - time.time())))
+            lines.append(f"- <strong>{translated_name}</strong> на карте <strong>{translated_location}</strong> (через: {time_left})")
+        try:
+            await bot.send_message(chat_id=chat_id, text="\n".join(lines), parse_mode='HTML')
+            self.sent += 1
+        except TelegramForbiddenError:
+            logger.info(f"Чат {chat_id} заблокировал бота, подписки удалены.")
+            self.unsubscribe_chat(chat_id)
+        except Exception as e:
+            logger.warning(f"Не удалось отправить уведомление в чат {chat_id}: {e}")
+
+notification_scheduler = NotificationScheduler(NOTIFY_LEAD_MINUTES * 60, SubscriptionStore(FSM_DB_PATH))
+
+def build_subscriptions_keyboard(chat_id):
+    """Список событий с количеством подписанных карт."""
+    rows = []
+    for event_idx, name in enumerate(EVENT_KEYS):
+        count = sum(notification_scheduler.is_subscribed(chat_id, (name, location)) for location in MAP_KEYS)
+        label = EVENT_TRANSLATIONS[name] + (f" 🔔{count}" if count else "")
+        rows.append([types.InlineKeyboardButton(text=label, callback_data=f"sub_event:{event_idx}")])
+    rows.append([BACK_TO_EVENTS_BUTTON])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+def build_subscription_maps_keyboard(chat_id, event_idx):
+    """Карты выбранного события с отметкой подписки. Показываются только карты из текущего расписания."""
+    name = EVENT_KEYS[event_idx]
+    index = _compiled_schedule[1] if _compiled_schedule is not None else None
+    rows = []
+    for map_idx, location in enumerate(MAP_KEYS):
+        key = (name, location)
+        if index is not None and key not in index.windows:
+            continue
+        mark = "✅ " if notification_scheduler.is_subscribed(chat_id, key) else ""
+        rows.append([types.InlineKeyboardButton(text=mark + MAP_TRANSLATIONS[location], callback_data=f"sub_toggle:{event_idx}:{map_idx}")])
+    rows.append([BACK_TO_SUBSCRIPTIONS_BUTTON])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+SUBSCRIPTIONS_TEXT = f"Выберите событие. Бот напомнит за {NOTIFY_LEAD_MINUTES} мин. до начала на выбранных картах."
+
+def subscription_maps_text(event_idx):
+    return f"<strong>{EVENT_TRANSLATIONS[EVENT_KEYS[event_idx]]}</strong>: выберите карты для уведомлений."
+
+# Все правки сообщений бота идут через edit_or_send: иначе отпечаток остался бы от прежнего меню,
+# и возврат к нему (например, "Назад" к тому же списку событий) был бы пропущен как правка без изменений
+@dp.callback_query(lambda c: c.data == 'subscriptions')
+async def process_callback_subscriptions(callback_query: types.CallbackQuery):
+    """Показывает меню подписок на уведомления."""
+    chat_id = callback_query.message.chat.id
+    await edit_or_send(callback_query.message, SUBSCRIPTIONS_TEXT, build_subscriptions_keyboard(chat_id))
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data and c.data.startswith('sub_event:'))
+async def process_callback_subscription_event(callback_query: types.CallbackQuery):
+    """Показывает карты выбранного события."""
+    event_idx = int(callback_query.data.split(':')[1])
+    if not 0 <= event_idx < len(EVENT_KEYS):
+        await callback_query.answer()
+        return
+    await edit_or_send(
+        callback_query.message, subscription_maps_text(event_idx),
+        build_subscription_maps_keyboard(callback_query.message.chat.id, event_idx), parse_mode='HTML'
+    )
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data and c.data.startswith('sub_toggle:'))
+async def process_callback_subscription_toggle(callback_query: types.CallbackQuery):
+    """Включает или выключает подписку на пару (событие, карта)."""
+    _, event_str, map_str = callback_query.data.split(':')
+    event_idx, map_idx = int(event_str), int(map_str)
+    if not (0 <= event_idx < len(EVENT_KEYS) and 0 <= map_idx < len(MAP_KEYS)):
+        await callback_query.answer()
+        return
+    chat_id = callback_query.message.chat.id
+    key = (EVENT_KEYS[event_idx], MAP_KEYS[map_idx])
+    enabled = notification_scheduler.toggle(chat_id, key)
+    await edit_or_send(
+        callback_query.message, subscription_maps_text(event_idx),
+        build_subscription_maps_keyboard(chat_id, event_idx), parse_mode='HTML'
+    )
+    await callback_query.answer("Подписка включена" if enabled else "Подписка отключена")
+
+# --- Живые сообщения со списком событий ---
+# Пользователь может включить автообновление сообщения со списком событий. Все такие сообщения обновляет
+# одна задача: раз в LIVE_TICK_INTERVAL секунд она проходит по списку и равномерно распределяет правки
+# по интервалу, чтобы не упираться в лимиты Telegram. Время показывается с точностью до минуты,
+# поэтому правка отправляется, только когда минутный текст действительно изменился.
+class LiveMessage:
+    __slots__ = ("chat_id", "message_id", "user_id", "page", "fingerprint", "expires_at", "task")
+
+    def __init__(self, chat_id, message_id, user_id, page, expires_at):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.page = page
+        self.fingerprint = None  # Отпечаток того, что бот сейчас показывает в сообщении
+        self.expires_at = expires_at
+        self.task = None  # Текущая правка тикером (ждёт в исходящей очереди или уже отправляется)
+
+class LiveMessages:
+    """Реестр живых сообщений (не больше одного на чат) и общий тикер, который их редактирует."""
+
+    def __init__(self, interval, ttl, edit_rate, capacity):
+        self.interval = interval
+        self.ttl = ttl
+        self.edit_rate = edit_rate
+        self.capacity = capacity
+        self.messages = {}  # chat_id -> LiveMessage
+        self._edit_tasks = set()
+        self.edits = 0
+        self.skipped = 0   # Минутный текст не изменился
+        self.expired = 0
+        self.dropped = 0   # Сообщение удалено, слишком старое или уже показывает другое меню
+
+    def __len__(self):
+        return len(self.messages)
+
+    def is_live(self, chat_id, message_id):
+        entry = self.messages.get(chat_id)
+        return entry is not None and entry.message_id == message_id
+
+    def register(self, chat_id, message_id, user_id, page):
+        """Включает автообновление сообщения; прежнее живое сообщение чата перестаёт обновляться.
+
+        Возвращает False, если реестр заполнен.
+        """
+        if chat_id not in self.messages and len(self.messages) >= self.capacity:
+            return False
+        self.messages[chat_id] = LiveMessage(chat_id, message_id, user_id, page, time.monotonic() + self.ttl)
+        return True
+
+    def touch(self, chat_id, message_id, page, fingerprint):
+        """Запоминает, что показано в живом сообщении после правки пользователем, и продлевает его срок."""
+        entry = self.messages.get(chat_id)
+        if entry is not None and entry.message_id == message_id:
+            entry.page = page
+            entry.fingerprint = fingerprint
+            entry.expires_at = time.monotonic() + self.ttl
+
+    def unregister(self, chat_id, message_id=None):
+        entry = self.messages.get(chat_id)
+        if entry is not None and (message_id is None or entry.message_id == message_id):
+            del self.messages[chat_id]
+            if entry.task is not None and entry.task is not asyncio.current_task():
+                # Правка тикера ещё ждёт в очереди с низким приоритетом: иначе она ушла бы после
+                # правки пользователя и перетёрла бы открытое им меню
+                entry.task.cancel()
+
+    async def run(self):
+        """Тикер: проход по всем живым сообщениям с правками, равномерно распределёнными по интервалу."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            entries = list(self.messages.values())
+            # Проход не короче interval; если сообщений больше, чем edit_rate * interval, он растягивается
+            cycle = max(self.interval, len(entries) / self.edit_rate) if self.edit_rate > 0 else self.interval
+            step = cycle / len(entries) if entries else 0.0
+            for position, entry in enumerate(entries):
+                delay = started + position * step - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if self.messages.get(entry.chat_id) is not entry:
+                    continue  # Автообновление выключено или перенесено на другое сообщение
+                task = asyncio.create_task(self._refresh(entry))
+                self._edit_tasks.add(task)
+                task.add_done_callback(self._edit_tasks.discard)
+            await asyncio.sleep(max(0.0, started + cycle - loop.time()))
+
+    async def _refresh(self, entry):
+        """Перерисовывает одно живое сообщение по текущему снимку; по истечении срока — обычным списком."""
+        entry.task = asyncio.current_task()
+        if message_fingerprints.get(entry.chat_id, entry.message_id) != entry.fingerprint:
+            # Пользователь перешёл в другое меню этого сообщения (или отпечаток вытеснен из кэша) — не перетираем
+            self.unregister(entry.chat_id, entry.message_id)
+            self.dropped += 1
+            return
+        snapshot = current_snapshot
+        if snapshot is None:
+            return
+        expired = time.monotonic() >= entry.expires_at
+        if expired:
+            self.unregister(entry.chat_id, entry.message_id)
+            self.expired += 1
+        preferences = user_preferences.get(entry.user_id)
+        pages = snapshot.pages_for(preferences) if expired else snapshot.live_pages_for(preferences)
+        page = max(0, min(entry.page, len(pages) - 1))
+        keyboard = events_page_keyboard(page, len(pages), preferences_language(preferences), live=not expired)
+        fingerprint = MessageFingerprints.fingerprint(pages[page], keyboard, 'HTML')
+        if fingerprint == entry.fingerprint:
+            self.skipped += 1
+            return
+        # Правки идут через исходящую очередь с низким приоритетом: ответы пользователям обгоняют их
+        outbound_priority.set(PRIORITY_BULK)
+        try:
+            await bot.edit_message_text(
+                text=pages[page], chat_id=entry.chat_id, message_id=entry.message_id,
+                reply_markup=keyboard, parse_mode='HTML'
+            )
+        except TelegramForbiddenError:
+            self.unregister(entry.chat_id)
+            self.dropped += 1
+            return
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                # Сообщение удалено или слишком старое для правки
+                logger.debug("Живое сообщение %s/%s больше не обновляется: %s", entry.chat_id, entry.message_id, e)
+                self.unregister(entry.chat_id, entry.message_id)
+                self.dropped += 1
+                return
+        except Exception as e:
+            logger.warning("Не удалось обновить живое сообщение в чате %s: %r", entry.chat_id, e)
+            return
+        self.edits += 1
+        entry.fingerprint = fingerprint
+        message_fingerprints.put(entry.chat_id, entry.message_id, fingerprint)
+
+live_messages = LiveMessages(
+    LIVE_TICK_INTERVAL, LIVE_MESSAGE_TTL,
+    LIVE_EDIT_RATE / BOT_WORKERS if IS_WORKER else LIVE_EDIT_RATE, LIVE_MAX_MESSAGES,
+)
+
+# --- Меню настроек списка событий ---
+def build_settings_keyboard(lang):
+    texts = UI_TEXTS[lang]
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=texts["language"], callback_data="prefs_lang")],
+        [types.InlineKeyboardButton(text=texts["favourite_maps"], callback_data="prefs_maps")],
+        [types.InlineKeyboardButton(text=texts["hidden_events"], callback_data="prefs_events")],
+        [types.InlineKeyboardButton(text=texts["back"], callback_data="events")]
+    ])
+
+SETTINGS_KEYBOARDS = {lang: build_settings_keyboard(lang) for lang in LANGUAGES}
+
+def build_preferences_maps_keyboard(preferences):
+    """Карты с отметкой избранных."""
+    lang = preferences_language(preferences)
+    _, favourite_maps, _ = split_preferences(preferences)
+    rows = []
+    for map_idx, location in enumerate(MAP_KEYS):
+        mark = "⭐ " if (favourite_maps >> map_idx) & 1 else ""
+        label = MAP_NAMES[lang].get(location, location)
+        rows.append([types.InlineKeyboardButton(text=mark + label, callback_data=f"prefs_map:{map_idx}")])
+    rows.append([types.InlineKeyboardButton(text=UI_TEXTS[lang]["back"], callback_data="settings")])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+def build_preferences_events_keyboard(preferences):
+    """События с отметкой скрытых."""
+    lang = preferences_language(preferences)
+    _, _, hidden_events = split_preferences(preferences)
+    rows = []
+    for event_idx, name in enumerate(EVENT_KEYS):
+        mark = "🙈 " if (hidden_events >> event_idx) & 1 else ""
+        label = EVENT_NAMES[lang].get(name, name)
+        rows.append([types.InlineKeyboardButton(text=mark + label, callback_data=f"prefs_event:{event_idx}")])
+    rows.append([types.InlineKeyboardButton(text=UI_TEXTS[lang]["back"], callback_data="settings")])
+    return types.InlineKeyboardMarkup(inline_keyboard=rows)
+
+@dp.callback_query(lambda c: c.data == 'settings')
+async def process_callback_settings(callback_query: types.CallbackQuery):
+    """Показывает меню настроек списка событий."""
+    lang = preferences_language(user_preferences.get(callback_query.from_user.id))
+    await edit_or_send(callback_query.message, UI_TEXTS[lang]["settings_title"], SETTINGS_KEYBOARDS[lang])
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data == 'prefs_lang')
+async def process_callback_preferences_language(callback_query: types.CallbackQuery):
+    """Переключает язык списка событий на следующий по кругу."""
+    user_id = callback_query.from_user.id
+    lang_idx, favourite_maps, hidden_events = split_preferences(user_preferences.get(user_id))
+    lang_idx = (lang_idx + 1) % len(LANGUAGES)
+    user_preferences.set(user_id, make_preferences(lang_idx, favourite_maps, hidden_events))
+    lang = LANGUAGES[lang_idx]
+    await edit_or_send(callback_query.message, UI_TEXTS[lang]["settings_title"], SETTINGS_KEYBOARDS[lang])
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data == 'prefs_maps')
+async def process_callback_preferences_maps(callback_query: types.CallbackQuery):
+    """Показывает выбор избранных карт."""
+    preferences = user_preferences.get(callback_query.from_user.id)
+    lang = preferences_language(preferences)
+    await edit_or_send(callback_query.message, UI_TEXTS[lang]["maps_title"], build_preferences_maps_keyboard(preferences))
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data and c.data.startswith('prefs_map:'))
+async def process_callback_preferences_map_toggle(callback_query: types.CallbackQuery):
+    """Добавляет карту в избранные или убирает её оттуда."""
+    map_idx = int(callback_query.data.split(':')[1])
+    if not 0 <= map_idx < len(MAP_KEYS):
+        await callback_query.answer()
+        return
+    user_id = callback_query.from_user.id
+    lang_idx, favourite_maps, hidden_events = split_preferences(user_preferences.get(user_id))
+    preferences = make_preferences(lang_idx, favourite_maps ^ (1 << map_idx), hidden_events)
+    user_preferences.set(user_id, preferences)
+    await edit_or_send(
+        callback_query.message, UI_TEXTS[preferences_language(preferences)]["maps_title"],
+        build_preferences_maps_keyboard(preferences)
+    )
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data == 'prefs_events')
+async def process_callback_preferences_events(callback_query: types.CallbackQuery):
+    """Показывает выбор скрытых событий."""
+    preferences = user_preferences.get(callback_query.from_user.id)
+    lang = preferences_language(preferences)
+    await edit_or_send(callback_query.message, UI_TEXTS[lang]["events_title"], build_preferences_events_keyboard(preferences))
+    await callback_query.answer()
+
+@dp.callback_query(lambda c: c.data and c.data.startswith('prefs_event:'))
+async def process_callback_preferences_event_toggle(callback_query: types.CallbackQuery):
+    """Скрывает событие из списка или возвращает его обратно."""
+    event_idx = int(callback_query.data.split(':')[1])
+    if not 0 <= event_idx < len(EVENT_KEYS):
+        await callback_query.answer()
+        return
+    user_id = callback_query.from_user.id
+    lang_idx, favourite_maps, hidden_events = split_preferences(user_preferences.get(user_id))
+    preferences = make_preferences(lang_idx, favourite_maps, hidden_events ^ (1 << event_idx))
+    user_preferences.set(user_id, preferences)
+    await edit_or_send(
+        callback_query.message, UI_TEXTS[preferences_language(preferences)]["events_title"],
+        build_preferences_events_keyboard(preferences)
+    )
+    await callback_query.answer()
+
+# --- Inline-режим: поиск событий по названию ---
+# "@bot матри", "@bot dam": каждое слово запроса — начало слова в названии события или карты
+# на любом языке. Индекс префиксов строится один раз при запуске, результаты запоминаются в снимке,
+# а одинаковые запросы в течение INLINE_CACHE_TIME Telegram вообще не присылает боту.
+def search_tokens(text):
+    """Слова текста в нижнем регистре ("ё" = "е"); всё, кроме букв и цифр, — разделители."""
+    text = text.lower().replace("ё", "е")
+    return "".join(char if char.isalnum() else " " for char in text).split()
+
+class PrefixIndex:
+    """Префикс слова -> битовая маска номеров названий, в которых есть слово с таким началом."""
+
+    def __init__(self, names):
+        self._masks = {}
+        for idx, variants in enumerate(names):
+            for word in {word for variant in variants for word in search_tokens(variant)}:
+                for end in range(1, len(word) + 1):
+                    self._masks[word[:end]] = self._masks.get(word[:end], 0) | (1 << idx)
+
+    def match(self, token):
+        return self._masks.get(token, 0)
+
+# Английские названия из API и их переводы; номера — те же, что в настройках пользователей
+EVENT_SEARCH_INDEX = PrefixIndex([(name, EVENT_TRANSLATIONS[name]) for name in EVENT_KEYS])
+MAP_SEARCH_INDEX = PrefixIndex([(location, MAP_TRANSLATIONS[location]) for location in MAP_KEYS])
+
+def normalize_inline_query(query):
+    """Ключ запроса для запоминания: "  Матри  Дамба" и "матри дамба" дают одни и те же результаты."""
+    return " ".join(search_tokens(query))[:64]
+
+def inline_query_language(query):
+    """Язык ответа по тексту запроса: кириллица — русский, латиница — английский, пустой запрос — русский.
+
+    Зависит только от запроса, а не от пользователя, поэтому ответ можно отдавать из общего кэша Telegram.
+    """
+    for char in query:
+        if "а" <= char <= "я":
+            return "ru"
+        if "a" <= char <= "z":
+            return "en"
+    return "ru"
+
+def inline_query_filter(query):
+    """Проверка (индекс события, индекс карты) для запроса или None, если какое-то слово ничему не соответствует."""
+    masks = []
+    for token in query.split():
+        event_mask, map_mask = EVENT_SEARCH_INDEX.match(token), MAP_SEARCH_INDEX.match(token)
+        if not event_mask and not map_mask:
+            return None
+        masks.append((event_mask, map_mask))
+
+    def matches(event_idx, map_idx):
+        # Каждое слово должно найтись в названии события или карты (события и карты не из словарей — только в пустом запросе)
+        return all(
+            (event_idx >= 0 and (event_mask >> event_idx) & 1) or (map_idx >= 0 and (map_mask >> map_idx) & 1)
+            for event_mask, map_mask in masks
+        )
+    return matches
+
+def build_inline_results(snapshot, query):
+    """Статьи inline-ответа: сначала общий список (если найдено больше одного события), затем по статье на событие."""
+    matches = inline_query_filter(query)
+    if matches is None:
+        return []
+    lang = inline_query_language(query)
+    texts = UI_TEXTS[lang]
+    marker = ""
+    if snapshot.data_as_of is not None:
+        marker = texts["data_as_of"].format(time=snapshot.data_as_of.strftime("%d.%m %H:%M"))
+    active_rows, upcoming_rows = snapshot.live_sections()[lang]
+    found = {"active": [], "upcoming": []}
+    for event_type, events, rows in (("active", snapshot.active, active_rows), ("upcoming", snapshot.upcoming, upcoming_rows)):
+        for event, (event_idx, map_idx, line) in zip(events, rows):
+            if matches(event_idx, map_idx):
+                found[event_type].append((event, line))
+
+    results = []
+    count = len(found["active"]) + len(found["upcoming"])
+    if count > 1:
+        lines = assemble_event_lines([line for _, line in found["active"]], [line for _, line in found["upcoming"]], lang)
+        results.append(types.InlineQueryResultArticle(
+            id="all",
+            title=texts["inline_all"].format(count=count),
+            description=texts["inline_all_description"],
+            input_message_content=types.InputTextMessageContent(
+                message_text=paginate_lines(lines, EVENTS_PAGE_CHAR_LIMIT)[0] + marker, parse_mode="HTML",
+            ),
+        ))
+    for event_type in ("active", "upcoming"):
+        header = texts[f"{event_type}_header"]
+        for position, (event, line) in enumerate(found[event_type]):
+            seconds_left = -(-event['seconds_left'] // 60) * 60
+            results.append(types.InlineQueryResultArticle(
+                id=f"{event_type}:{position}",
+                title=texts[f"inline_{event_type}"].format(
+                    name=EVENT_NAMES[lang].get(event['name'], event['name']),
+                    location=MAP_NAMES[lang].get(event['location'], event['location']),
+                ),
+                description=texts[f"inline_{event_type}_description"].format(
+                    time_left=format_time_left(seconds_left, texts["units"]),
+                ),
+                input_message_content=types.InputTextMessageContent(
+                    message_text=header + line + marker, parse_mode="HTML",
+                ),
+            ))
+    return results
+
+@dp.inline_query()
+async def process_inline_query(inline_query: types.InlineQuery):
+    """Отвечает на inline-запрос из готового снимка; результаты постранично по INLINE_PAGE_SIZE."""
+    snapshot = await get_events_snapshot()
+    results = snapshot.inline_results(normalize_inline_query(inline_query.query))
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    next_offset = offset + INLINE_PAGE_SIZE
+    await inline_query.answer(
+        results[offset:next_offset],
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=str(next_offset) if next_offset < len(results) else "",
+    )
+
+# --- Метрики обработчиков и сервер /metrics ---
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Замеряет время каждого обработчика (после фильтров) и считает исключения."""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+handler_metrics = HandlerMetricsMiddleware()
+dp.message.middleware(handler_metrics)
+dp.callback_query.middleware(handler_metrics)
+dp.inline_query.middleware(handler_metrics)
+
+# Последняя измеренная задержка цикла событий (секунды)
+event_loop_lag = 0.0
+
+async def event_loop_lag_monitor():
+    """Засыпает на EVENT_LOOP_LAG_INTERVAL и измеряет, насколько позже цикл событий её разбудил."""
+    global event_loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag = max(0.0, loop.time() - started - EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(event_loop_lag)
+
+def _cache_age():
+    stats = events_cache.stats()
+    return stats["age"]
+
+def _snapshot_age():
+    if current_snapshot is None:
+        return None
+    return (datetime.now(timezone.utc) - current_snapshot.built_at).total_seconds()
+
+metrics.gauge("bot_event_loop_lag_last_seconds", "Last measured event loop lag", lambda: event_loop_lag)
+metrics.gauge("bot_events_cache_requests_total", "MetaForge cache lookups by result",
+              lambda: {"hit": events_cache.hits, "stale": events_cache.stale_hits, "miss": events_cache.misses,
+                       "fallback": events_cache.fallback_hits},
+              label="result", kind="counter")
+metrics.gauge("bot_events_cache_refreshes_total", "MetaForge cache loads", lambda: events_cache.refreshes, kind="counter")
+metrics.gauge("bot_events_cache_errors_total", "Failed MetaForge cache loads", lambda: events_cache.errors, kind="counter")
+metrics.gauge("bot_events_cache_age_seconds", "Age of the cached MetaForge payload", _cache_age)
+metrics.gauge("bot_upstream_circuit_state", "MetaForge circuit breaker state (1 for the current state)",
+              lambda: {state: int(upstream_breaker.state == state)
+                       for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)},
+              label="state")
+metrics.gauge("bot_upstream_circuit_trips_total", "Times the MetaForge circuit breaker opened",
+              lambda: upstream_breaker.trips, kind="counter")
+metrics.gauge("bot_events_snapshot_version", "Version of the current events snapshot",
+              lambda: current_snapshot.version if current_snapshot is not None else None)
+metrics.gauge("bot_events_snapshot_age_seconds", "Age of the current events snapshot", _snapshot_age)
+metrics.gauge("bot_outbound_queue_depth", "Bot API calls waiting in the outbound queue", lambda: outbound_queue.depth)
+metrics.gauge("bot_outbound_requests_total", "Outbound Bot API calls by outcome",
+              lambda: {"sent": outbound_queue.sent, "retry_after": outbound_queue.retry_after, "failed": outbound_queue.failed},
+              label="outcome", kind="counter")
+metrics.gauge("bot_outbound_chat_buckets", "Per-chat rate limit buckets in memory", lambda: len(outbound_queue.chat_buckets))
+metrics.gauge("bot_skipped_edits_total", "Bot API calls saved by message fingerprints",
+              lambda: {"unchanged": message_fingerprints.skipped_edits, "not_modified": message_fingerprints.not_modified},
+              label="reason", kind="counter")
+metrics.gauge("bot_notifications_sent_total", "Subscription notifications sent", lambda: notification_scheduler.sent, kind="counter")
+metrics.gauge("bot_live_messages", "Events messages with live updates enabled", lambda: len(live_messages))
+metrics.gauge("bot_live_message_updates_total", "Live message ticks by outcome",
+              lambda: {"edited": live_messages.edits, "unchanged": live_messages.skipped,
+                       "expired": live_messages.expired, "dropped": live_messages.dropped},
+              label="outcome", kind="counter")
+metrics.gauge("bot_feedback_pending", "Feedback messages waiting for the next admin digest", lambda: feedback_queue.pending_count())
+metrics.gauge("bot_feedback_submissions_total", "Feedback submissions by outcome",
+              lambda: {FEEDBACK_QUEUED: feedback_queue.accepted, FEEDBACK_RATE_LIMITED: feedback_queue.rate_limited,
+                       FEEDBACK_DUPLICATE: feedback_queue.duplicates},
+              label="outcome", kind="counter")
+metrics.gauge("bot_registered_chats", "Chats that pressed /start and have not blocked the bot", lambda: len(user_registry))
+metrics.gauge("bot_broadcast_messages_sent_total", "Broadcast messages delivered by this process",
+              lambda: broadcaster.sent, kind="counter")
+metrics.gauge("bot_users_with_preferences", "Users with non-default event list settings", lambda: len(user_preferences))
+
+async def handle_metrics(request):
+    """Отдаёт метрики в текстовом формате Prometheus."""
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+metrics_runner = None
+
+async def start_metrics_server():
+    """Поднимает отдельный локальный aiohttp-сервер с /metrics (в обоих режимах работы бота)."""
+    global metrics_runner
+    if METRICS_PORT <= 0 or metrics_runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    metrics_runner = web.AppRunner(app, access_log=None)
+    await metrics_runner.setup()
+    try:
+        await web.TCPSite(metrics_runner, host=METRICS_HOST, port=METRICS_PORT).start()
+    except OSError as e:
+        logger.warning("Сервер метрик не запущен (%s:%s): %s", METRICS_HOST, METRICS_PORT, e)
+        await metrics_runner.cleanup()
+        metrics_runner = None
+        return
+    logger.info("Метрики доступны на http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+async def stop_metrics_server():
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+# --- Запуск и остановка ---
+background_tasks = []
+
+@dp.startup()
+async def on_startup():
+    """Создаёт общую HTTP-сессию, подхватывает сохранённый снимок MetaForge, запускает фоновые задачи (исходящая очередь, снимок событий, уведомления, живые сообщения, сводки обратной связи, рассылки, замер цикла событий) и сервер метрик."""
+    get_http_session()
+    if IS_WORKER:
+        use_shared_snapshot()
+        background_tasks.append(asyncio.create_task(shared_snapshot_reader_loop()))
+        background_tasks.append(asyncio.create_task(outbound_share_loop()))
+    else:
+        load_last_known_good()
+    outbound_queue.start()
+    background_tasks.append(asyncio.create_task(events_snapshot_loop()))
+    background_tasks.append(asyncio.create_task(notification_scheduler.run()))
+    background_tasks.append(asyncio.create_task(live_messages.run()))
+    if not IS_WORKER or BOT_WORKER_INDEX == 0:
+        # Очередь обратной связи общая (один SQLite-файл), сводки отправляет только один процесс
+        background_tasks.append(asyncio.create_task(feedback_digest_loop()))
+        # Рассылки тоже выполняет один процесс; прерванная перезапуском продолжается отсюда же
+        background_tasks.append(asyncio.create_task(broadcaster.run()))
+    background_tasks.append(asyncio.create_task(event_loop_lag_monitor()))
+    await start_metrics_server()
+
+@dp.shutdown()
+async def on_shutdown():
+    """Останавливает фоновые задачи и закрывает HTTP-сессию при остановке бота."""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await outbound_queue.stop()
+    await close_http_session()
+    await stop_metrics_server()
+    user_preferences.close()
+    notification_scheduler.store.close()
+    feedback_queue.close()
+    user_registry.close()
+    broadcaster.close()
+
+# --- Режим webhook ---
+async def set_bot_webhook():
+    """Регистрирует webhook в Telegram при старте (только в режиме webhook)."""
+    await bot.set_webhook(
+        url=WEBHOOK_BASE_URL + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook установлен: {WEBHOOK_BASE_URL + WEBHOOK_PATH}")
+
+async def handle_health(request):
+    """Ответ для проверок доступности (health check)."""
+    return web.json_response({
+        "status": "ok",
+        "snapshot_version": current_snapshot.version if current_snapshot is not None else None,
+        "outbound_queue": outbound_queue.depth,
+        "upstream": upstream_breaker.state,
+    })
+
+def create_webhook_app():
+    """Собирает aiohttp-приложение: приём обновлений с проверкой секрета и health check."""
+    app = web.Application()
+    app.router.add_get("/healthz", handle_health)
+    # Сначала хуки диспетчера, затем обработчик: при остановке фоновые задачи завершатся до закрытия сессии бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    return app
+
+async def wait_for_stop_signal():
+    """Ждёт SIGTERM/SIGINT."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+    await stop_event.wait()
+
+async def run_webhook():
+    """Запускает aiohttp-сервер и работает до SIGTERM/SIGINT, затем корректно останавливается."""
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("Для режима webhook нужна переменная окружения WEBHOOK_BASE_URL!")
+    dp.startup.register(set_bot_webhook)
+    runner = web.AppRunner(create_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEB_SERVER_HOST}:{WEB_SERVER_PORT}")
+    try:
+        await wait_for_stop_signal()
+    finally:
+        logger.info("Остановка webhook-сервера...")
+        # cleanup перестаёт принимать запросы и вызывает хуки остановки диспетчера
+        await runner.cleanup()
+
+# --- Несколько процессов: общий снимок MetaForge ---
+# Супервизор кладёт ответ MetaForge в mmap-файл, воркеры читают его оттуда и в сеть за расписанием не ходят.
+# Заголовок — (номер записи, длина): нечётный номер означает, что запись идёт прямо сейчас (seqlock).
+class SharedSnapshotBuffer:
+    """Буфер в mmap-файле: один пишущий процесс, любое число читающих."""
+
+    HEADER = struct.Struct("<QQ")
+
+    def __init__(self, path, size=0, writable=False):
+        if writable:
+            with open(path, "wb") as buffer_file:
+                buffer_file.truncate(size)
+        self._file = open(path, "r+b" if writable else "rb")
+        access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+        self._map = mmap.mmap(self._file.fileno(), 0, access=access)
+        self.sequence = 0  # Номер последней записанной (или прочитанной) версии
+
+    def publish(self, blob):
+        if self.HEADER.size + len(blob) > len(self._map):
+            raise ValueError(f"Снимок ({len(blob)} байт) не помещается в общий буфер, увеличьте SHARED_SNAPSHOT_SIZE")
+        self.HEADER.pack_into(self._map, 0, self.sequence + 1, 0)
+        self._map[self.HEADER.size:self.HEADER.size + len(blob)] = blob
+        self.sequence += 2
+        self.HEADER.pack_into(self._map, 0, self.sequence, len(blob))
+
+    def read_new(self):
+        """Новое содержимое буфера или None, если с прошлого чтения ничего не изменилось."""
+        for _ in range(100):
+            sequence, length = self.HEADER.unpack_from(self._map, 0)
+            if sequence == self.sequence or sequence == 0:
+                return None
+            if sequence % 2:
+                time.sleep(0.001)  # Запись в процессе — подождём миллисекунду
+                continue
+            blob = self._map[self.HEADER.size:self.HEADER.size + length]
+            if self.HEADER.unpack_from(self._map, 0)[0] == sequence:
+                self.sequence = sequence
+                return blob
+        return None
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+def default_shared_snapshot_path():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"arc-raiders-bot-{os.getpid()}.snapshot")
+
+# Состояние источника, полученное воркером от супервизора (см. upstream_data_as_of)
+shared_data_as_of = None
+
+def use_shared_snapshot():
+    """Переключает кэш воркера на данные супервизора: значение обновляет только чтение общего буфера."""
+    async def no_upstream_in_worker():
+        raise CircuitOpenError("Данные MetaForge от супервизора ещё не получены")
+
+    events_cache.loader = no_upstream_in_worker
+    events_cache.ttl = float("inf")
+
+async def shared_snapshot_reader_loop():
+    """Воркер: раз в секунду проверяет номер версии в общем буфере и подхватывает новый ответ MetaForge."""
+    global shared_data_as_of
+    shared_buffer = None
+    try:
+        while True:
+            if shared_buffer is None:
+                try:
+                    shared_buffer = SharedSnapshotBuffer(SHARED_SNAPSHOT_PATH)
+                except (OSError, ValueError) as e:
+                    logger.warning("Общий буфер %s недоступен: %s", SHARED_SNAPSHOT_PATH, e)
+            blob = shared_buffer.read_new() if shared_buffer is not None else None
+            if blob is not None:
+                shared = json.loads(blob)
+                shared_data_as_of = datetime.fromisoformat(shared["data_as_of"]) if shared["data_as_of"] else None
+                events_cache.prime(shared["payload"], datetime.fromisoformat(shared["fetched_at"]))
+            await asyncio.sleep(min(1.0, EVENTS_REFRESH_INTERVAL))
+    finally:
+        if shared_buffer is not None:
+            shared_buffer.close()
+
+# Супервизор: внеочередная загрузка и публикация после /invalidate_cache
+shared_snapshot_refresh = asyncio.Event()
+
+def invalidate_shared_snapshot():
+    """Сбрасывает кэш MetaForge супервизора и будит публикацию, не дожидаясь очередного интервала."""
+    events_cache.invalidate()
+    shared_snapshot_refresh.set()
+    logger.info("Кэш MetaForge сброшен администратором.")
+
+async def shared_snapshot_publisher_loop(shared_buffer):
+    """Супервизор: загружает ответ MetaForge (кэш, выключатель, запасной снимок) и публикует его при изменении."""
+    published = (None, None)
+    loop = asyncio.get_running_loop()
+    next_tick = loop.time()
+    while True:
+        shared_snapshot_refresh.clear()
+        try:
+            data = await events_cache.get()
+            data_as_of = upstream_data_as_of()
+            if (data, data_as_of) != published:
+                shared_buffer.publish(json.dumps({
+                    "fetched_at": events_cache.updated_at.isoformat(),
+                    "data_as_of": data_as_of.isoformat() if data_as_of is not None else None,
+                    "payload": data,
+                }, ensure_ascii=False).encode("utf-8"))
+                published = (data, data_as_of)
+        except CircuitOpenError as e:
+            logger.debug("%s", e)
+        except Exception as e:
+            logger.error("Не удалось опубликовать снимок MetaForge для воркеров: %r", e)
+        next_tick += EVENTS_REFRESH_INTERVAL
+        now = loop.time()
+        if next_tick < now:
+            next_tick = now
+        try:
+            await asyncio.wait_for(shared_snapshot_refresh.wait(), next_tick - now)
+        except asyncio.TimeoutError:
+            pass
+
+# --- Несколько процессов: супервизор и воркеры ---
+def update_shard_key(update):
+    """Ключ шардирования обновления (словарь из Bot API): id чата, иначе id пользователя, иначе update_id."""
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post", "business_message"):
+        if field in update:
+            return update[field]["chat"]["id"]
+    callback_query = update.get("callback_query")
+    if callback_query is not None:
+        message = callback_query.get("message")
+        return message["chat"]["id"] if message else callback_query["from"]["id"]
+    for item in update.values():
+        if isinstance(item, dict):
+            user = item.get("from") or item.get("user")
+            if isinstance(user, dict) and "id" in user:
+                return user["id"]
+            chat = item.get("chat")
+            if isinstance(chat, dict) and "id" in chat:
+                return chat["id"]
+    return update.get("update_id", 0)
+
+def is_invalidate_cache_command(update):
+    """Сырое обновление — команда /invalidate_cache от администратора."""
+    message = update.get("message")
+    if not message or str((message.get("from") or {}).get("id")) != YOUR_TELEGRAM_ID:
+        return False
+    words = (message.get("text") or "").split(maxsplit=1)
+    return bool(words) and words[0].split("@", 1)[0] == "/invalidate_cache"
+
+class WorkerProcess:
+    """Процесс-воркер: тот же bot.py с BOT_WORKER_INDEX; обновления получает в stdin по одному JSON на строку."""
+
+    def __init__(self, index, count, shared_snapshot_path):
+        self.index = index
+        self.count = count
+        self.shared_snapshot_path = shared_snapshot_path
+        self.process = None
+        self.restarts = 0
+        self.sent = 0
+        self.dropped = 0
+        # Обновления, пришедшие, пока воркер упал или ждёт перезапуска: offset getUpdates уже сдвинут,
+        # поэтому Telegram их не повторит — отдаём новому процессу после старта
+        self.backlog = deque()
+
+    async def start(self):
+        env = dict(os.environ, BOT_WORKER_INDEX=str(self.index), BOT_WORKERS=str(self.count),
+                   SHARED_SNAPSHOT_PATH=self.shared_snapshot_path)
+        if METRICS_PORT > 0:
+            # У каждого воркера свой порт метрик: METRICS_PORT + 1 + номер
+            env["METRICS_PORT"] = str(METRICS_PORT + 1 + self.index)
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), stdin=asyncio.subprocess.PIPE, env=env,
+        )
+        logger.info("Воркер %d запущен (pid %d)", self.index, self.process.pid)
+        if self.backlog:
+            logger.info("Воркер %d: передаём %d отложенных обновлений", self.index, len(self.backlog))
+            while self.backlog:
+                self.process.stdin.write(self.backlog.popleft())
+                self.sent += 1
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None and not self.process.stdin.is_closing()
+
+    def send(self, line):
+        if not self.alive:
+            if len(self.backlog) >= WORKER_BACKLOG_LIMIT:
+                self.backlog.popleft()
+                self.dropped += 1
+            self.backlog.append(line)
+            return
+        self.process.stdin.write(line)
+        self.sent += 1
+
+class WorkerPool:
+    """Воркеры с раздачей обновлений по chat_id: один чат всегда попадает в один процесс (порядок и FSM сохраняются)."""
+
+    def __init__(self, count, shared_snapshot_path):
+        self.workers = [WorkerProcess(index, count, shared_snapshot_path) for index in range(count)]
+        self._monitors = []
+        self._stopping = False
+
+    async def start(self):
+        for worker in self.workers:
+            await worker.start()
+            self._monitors.append(asyncio.create_task(self._monitor(worker)))
+
+    async def _monitor(self, worker):
+        """Перезапускает воркер, если он завершился не по команде супервизора."""
+        while True:
+            code = await worker.process.wait()
+            if self._stopping:
+                return
+            worker.restarts += 1
+            logger.error("Воркер %d завершился с кодом %s, перезапуск", worker.index, code)
+            await asyncio.sleep(min(30, 2 ** min(worker.restarts, 5)))
+            if self._stopping:
+                return
+            await worker.start()
+
+    def dispatch(self, update):
+        if is_invalidate_cache_command(update):
+            # Кэш MetaForge есть только у супервизора; ответ администратору всё равно отправит воркер
+            invalidate_shared_snapshot()
+        worker = self.workers[update_shard_key(update) % len(self.workers)]
+        worker.send(json.dumps(update, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    async def drain(self):
+        """Ждёт, пока воркеры заберут отправленное (обратное давление при всплеске обновлений)."""
+        for worker in self.workers:
+            if worker.alive:
+                try:
+                    await worker.process.stdin.drain()
+                except (ConnectionError, BrokenPipeError):
+                    pass
+
+    async def stop(self, timeout=25):
+        """Закрывает stdin воркеров: каждый доделывает начатые обновления и завершается сам."""
+        self._stopping = True
+        for worker in self.workers:
+            if worker.alive:
+                worker.process.stdin.close()
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            try:
+                await asyncio.wait_for(worker.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Воркер %d не завершился за %dс, принудительная остановка", worker.index, timeout)
+                worker.process.kill()
+                await worker.process.wait()
+        for monitor in self._monitors:
+            monitor.cancel()
+        await asyncio.gather(*self._monitors, return_exceptions=True)
+
+async def supervisor_polling(pool):
+    """Long polling в супервизоре: сырые обновления без разбора в модели aiogram сразу уходят воркерам."""
+    url = bot.session.api.api_url(token=BOT_TOKEN, method="getUpdates")
+    allowed_updates = json.dumps(dp.resolve_used_update_types())
+    polling_timeout = 30
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=HTTP_CONNECT_TIMEOUT, sock_read=polling_timeout + 10)
+    offset = None
+    failures = 0
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            params = {"timeout": str(polling_timeout), "allowed_updates": allowed_updates}
+            if offset is not None:
+                params["offset"] = str(offset)
+            try:
+                async with session.post(url, data=params) as response:
+                    body = await response.json(content_type=None)
+                if not body.get("ok"):
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, (), status=body.get("error_code", response.status),
+                        message=body.get("description", ""),
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                failures += 1
+                delay = random.uniform(0, min(30, HTTP_BACKOFF_BASE * 2 ** min(failures, 6)))
+                logger.warning("Ошибка getUpdates (%r), повтор через %.1fс", e, delay)
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            for update in body["result"]:
+                offset = update["update_id"] + 1
+                pool.dispatch(update)
+            await pool.drain()
+
+def create_supervisor_webhook_app(pool):
+    """Webhook в супервизоре: проверка секрета и раздача обновлений воркерам."""
+    async def handle_update(request):
+        secret = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not secrets.compare_digest(secret, WEBHOOK_SECRET):
+            return web.Response(status=401, text="Unauthorized")
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Bad Request")
+        pool.dispatch(update)
+        await pool.drain()
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    return app
+
+async def run_supervisor():
+    """Супервизор: N воркеров, общий снимок MetaForge и приём обновлений (polling или webhook)."""
+    if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+        raise ValueError("Для режима webhook нужна переменная окружения WEBHOOK_BASE_URL!")
+    shared_snapshot_path = SHARED_SNAPSHOT_PATH or default_shared_snapshot_path()
+    shared_buffer = SharedSnapshotBuffer(shared_snapshot_path, SHARED_SNAPSHOT_SIZE, writable=True)
+    get_http_session()
+    load_last_known_good()
+    tasks = [asyncio.create_task(shared_snapshot_publisher_loop(shared_buffer))]
+    await start_metrics_server()
+    pool = WorkerPool(BOT_WORKERS, shared_snapshot_path)
+    await pool.start()
+    logger.info("Супервизор: %d воркеров, режим %s", BOT_WORKERS, BOT_MODE)
+    runner = None
+    try:
+        if BOT_MODE == "webhook":
+            runner = web.AppRunner(create_supervisor_webhook_app(pool))
+            await runner.setup()
+            await web.TCPSite(runner, WEB_SERVER_HOST, WEB_SERVER_PORT).start()
+            await set_bot_webhook()
         else:
-            # parse_mode='HTML', используем теги <strong>
-            # translated_name и location будут жирными
-            message += f"- <strong>{translated_name}</strong> на карте <strong>{translated_location}</strong> (начнётся через: {event['time_left']})\n"
-    return message
+            tasks.append(asyncio.create_task(supervisor_polling(pool)))
+        await wait_for_stop_signal()
+    finally:
+        logger.info("Остановка супервизора...")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if runner is not None:
+            await runner.cleanup()
+        await pool.stop()
+        await close_http_session()
+        await stop_metrics_server()
+        await bot.session.close()
+        shared_buffer.close()
+        if not SHARED_SNAPSHOT_PATH:
+            os.remove(shared_snapshot_path)
+
+class ChatSerializer:
+    """Обновления одного чата обрабатываются строго по очереди, разных чатов — параллельно."""
+
+    def __init__(self):
+        self._tails = {}  # ключ чата -> задача последнего обновления этого чата
+
+    def submit(self, key, handle):
+        previous = self._tails.get(key)
+        task = asyncio.create_task(self._run(key, previous, handle))
+        self._tails[key] = task
+
+    async def _run(self, key, previous, handle):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await handle()
+        except Exception as e:
+            logger.error("Ошибка обработки обновления (чат %s): %r", key, e)
+        finally:
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def join(self):
+        while self._tails:
+            await asyncio.gather(*list(self._tails.values()), return_exceptions=True)
+
+async def run_worker():
+    """Воркер: читает обновления из stdin (JSON по строке) до закрытия stdin супервизором."""
+    # Сигналы остановки получает супервизор и закрывает stdin; воркер доделывает начатое и выходит сам
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    serializer = ChatSerializer()
+    await dp.emit_startup(bot=bot)
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                raw_update = json.loads(line)
+                update = types.Update.model_validate(raw_update, context={"bot": bot})
+            except ValueError as e:
+                logger.warning("Воркер %d: некорректное обновление: %s", BOT_WORKER_INDEX, e)
+                continue
+            serializer.submit(update_shard_key(raw_update), lambda update=update: dp.feed_update(bot, update))
+        await serializer.join()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
 
 # --- Основная функция запуска ---
 async def main():
+    if IS_WORKER:
+        await run_worker()
+        return
     logger.info("Запуск бота с использованием вычисленного таймера из API (все предстоящие), кнопками ссылок, текстом об обновлении, редактированием сообщений и формой обратной связи...")
-    await dp.start_polling(bot)
+    if BOT_WORKERS > 1:
+        await run_supervisor()
+    elif BOT_MODE == "webhook":
+        await run_webhook()
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     try:
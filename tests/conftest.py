@@ -0,0 +1,137 @@
+"""Общие заготовки тестов: окружение бота и локальные фейковые Bot API и MetaForge.
+
+bot.py настраивается переменными окружения при импорте, поэтому они выставляются здесь, до первого импорта.
+Тесты асинхронные, но pytest-asyncio не нужен: каждый тест запускает свой цикл через asyncio.run.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import itertools
+import contextlib
+
+import pytest
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_state_dir = tempfile.TemporaryDirectory(prefix="bot-tests-")
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ["FSM_DB_PATH"] = os.path.join(_state_dir.name, "state.sqlite3")
+os.environ["UPSTREAM_SNAPSHOT_PATH"] = ""
+os.environ["METRICS_PORT"] = "0"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from bench import BOT_USER, fake_result, make_payload  # noqa: E402
+
+EVENT_TIMERS_PATH = "/api/arc-raiders/event-timers"
+
+
+class FakeTelegram:
+    """Bot API и MetaForge на локальном aiohttp-сервере. Запоминает каждый вызов Bot API с моментом прихода."""
+
+    def __init__(self):
+        self.calls = []  # (time.monotonic(), метод, параметры)
+        # Заготовленные ответы: метод -> список (HTTP-статус, тело), расходуются по одному
+        self.scripted = {}
+        self.payload = make_payload(1)
+        # Пока событие не установлено, MetaForge "висит" и не отвечает
+        self.upstream_released = asyncio.Event()
+        self.upstream_released.set()
+        self.upstream_calls = 0
+        self._message_ids = itertools.count(1_000_000)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_bot_api)
+        app.router.add_get(EVENT_TIMERS_PATH, self.handle_event_timers)
+        return app
+
+    async def handle_bot_api(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls.append((time.monotonic(), method, params))
+        scripted = self.scripted.get(method)
+        if scripted:
+            status, body = scripted.pop(0)
+            return web.json_response(body, status=status)
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": BOT_USER})
+        return web.json_response({"ok": True, "result": fake_result(method, params, self._message_ids)})
+
+    async def handle_event_timers(self, request):
+        self.upstream_calls += 1
+        await self.upstream_released.wait()
+        return web.Response(body=json.dumps(self.payload).encode(), content_type="application/json")
+
+    def calls_of(self, method):
+        return [(at, params) for at, name, params in self.calls if name == method]
+
+
+@contextlib.asynccontextmanager
+async def fake_telegram(app):
+    """Поднимает FakeTelegram и направляет на него бота; после теста закрывает всё, что привязано к циклу событий."""
+    from aiogram.client.telegram import TelegramAPIServer
+    server = FakeTelegram()
+    runner = web.AppRunner(server.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    saved_api, saved_url = app.bot.session.api, app.EVENT_TIMERS_API_URL
+    app.bot.session.api = TelegramAPIServer.from_base(base_url)
+    app.EVENT_TIMERS_API_URL = base_url + EVENT_TIMERS_PATH
+    try:
+        yield server
+    finally:
+        server.upstream_released.set()
+        await app.outbound_queue.stop()
+        await app.close_http_session()
+        await app.bot.session.close()
+        app.bot.session.api, app.EVENT_TIMERS_API_URL = saved_api, saved_url
+        await runner.cleanup()
+
+
+async def feed(app, update):
+    from aiogram.types import Update
+    await app.dp.feed_update(app.bot, Update.model_validate(update, context={"bot": app.bot}))
+
+
+_update_ids = itertools.count(1)
+
+def user_object(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+
+def message_update(user_id, text):
+    message = {"message_id": 1, "date": int(time.time()), "chat": {"id": user_id, "type": "private"},
+               "from": user_object(user_id), "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+def callback_update(user_id, data, message_id=1):
+    return {"update_id": next(_update_ids), "callback_query": {
+        "id": str(next(_update_ids)),
+        "from": user_object(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": {"message_id": message_id, "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"}, "from": BOT_USER, "text": "…"},
+    }}
+
+
+@pytest.fixture(scope="session")
+def app():
+    import bot
+    return bot
+
+
+@pytest.fixture
+def run():
+    """Запускает корутину в новом цикле событий (asyncio.run), с ограничением по времени."""
+    def runner(coro, timeout=30):
+        return asyncio.run(asyncio.wait_for(coro, timeout))
+    return runner
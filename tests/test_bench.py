@@ -0,0 +1,47 @@
+"""Стенд из bench.py запускается и даёт результаты: короткие прогоны в отдельных процессах, как из командной строки."""
+import os
+import sys
+import json
+import subprocess
+
+from bench import USER_FLOW
+from conftest import ROOT
+
+
+def run_bench(tmp_path, *args):
+    output = tmp_path / "results.json"
+    env = dict(os.environ)
+    # Каждый прогон стенда сам создаёт временную базу; общая база тестов ему не нужна
+    env.pop("FSM_DB_PATH", None)
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "bench.py"), *args, "--json", str(output)],
+        cwd=str(tmp_path), env=env, check=True, timeout=120, stdout=subprocess.DEVNULL,
+    )
+    with open(output, encoding="utf-8") as results:
+        return json.load(results)
+
+
+def test_users_scenario_reports_latency_throughput_and_rss(tmp_path):
+    results = run_bench(tmp_path, "users", "--users", "5", "--rounds", "1", "--concurrency", "5",
+                        "--api-latency", "0", "--upstream-latency", "0")
+    assert results["updates"] == 30
+    assert not results["errors"]
+    assert results["throughput"] > 0
+    assert 0 < results["p50"] <= results["p99"]
+    assert results["rss_peak_mb"] > 0
+    assert {"message:/start", "callback:events", "callback:refresh_events", "callback:start_menu"} <= set(results["steps"])
+
+
+def test_micro_scenario_measures_every_stage(tmp_path):
+    results = run_bench(tmp_path, "micro", "--scales", "1", "2", "--min-time", "0.01")
+    assert set(results) == {"1", "2"}
+    assert results["2"]["windows"] > results["1"]["windows"]
+    for stage in ("compile", "lookup", "calculated", "format", "snapshot"):
+        assert results["1"][stage] > 0
+
+
+def test_alloc_scenario_compares_prebuilt_and_per_call_keyboards(tmp_path):
+    results = run_bench(tmp_path, "alloc", "--iterations", "5", "--api-latency", "0", "--upstream-latency", "0")
+    assert set(results) == {f"{kind}:{payload}"[:24] for kind, payload in USER_FLOW}
+    for step in results.values():
+        assert step["peak_bytes"] > 0 and step["rebuilt_peak_bytes"] > 0
@@ -0,0 +1,43 @@
+def test_start_in_another_worker_clears_the_block(app, tmp_path):
+    """Блокировку отмечает воркер рассылки, а /start того же чата приходит в его собственный воркер."""
+    path = str(tmp_path / "state.sqlite3")
+    own, broadcasting = app.UserRegistry(path, shared=True), app.UserRegistry(path, shared=True)
+    try:
+        own.add(7)
+        assert broadcasting.recipients(0, 10) == [7]
+        broadcasting.mark_blocked(7)
+        assert broadcasting.recipients(0, 10) == [] and len(own) == 0
+        own.add(7)
+        assert broadcasting.recipients(0, 10) == [7]
+        assert len(own) == len(broadcasting) == 1
+    finally:
+        own.close()
+        broadcasting.close()
+
+
+def test_broadcasting_worker_gets_the_broadcast_share(app, monkeypatch):
+    monkeypatch.setattr(app, "OUTBOUND_GLOBAL_RATE", 30)
+    monkeypatch.setattr(app, "BROADCAST_RATE", 26)
+    monkeypatch.setattr(app, "BOT_WORKERS", 4)
+
+    def rates(broadcast_active):
+        result = []
+        for index in range(4):
+            monkeypatch.setattr(app, "BOT_WORKER_INDEX", index)
+            result.append(app.worker_global_rate(broadcast_active))
+        return result
+
+    assert rates(False) == [7.5] * 4
+    during = rates(True)
+    # Рассылка идёт с полным темпом, а вместе воркеры не выходят за общий лимит
+    assert during == [27.0, 1.0, 1.0, 1.0]
+    assert sum(during) == 30
+
+
+def test_bucket_rate_change_keeps_tokens_within_the_new_capacity(app):
+    bucket = app.TokenBucket(30, 30)
+    bucket.set_rate(1)
+    assert bucket.rate == bucket.capacity == 1
+    assert bucket.tokens <= 1
+    bucket.set_rate(27)
+    assert bucket.capacity == 27 and bucket.tokens <= 1
@@ -0,0 +1,126 @@
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from bench import fake_result
+from conftest import fake_telegram
+
+UNLIMITED = 10 ** 6
+
+
+def user(user_id, first_name="Игрок", username=None):
+    return SimpleNamespace(id=user_id, first_name=first_name, last_name=None, username=username)
+
+
+def row(feedback_id, text, user_id=1, first_name="Игрок", username="player"):
+    return (feedback_id, user_id, first_name, None, username, text, time.time())
+
+
+@pytest.fixture
+def queue(app, tmp_path):
+    queue = app.FeedbackQueue(str(tmp_path / "feedback.sqlite3"), user_limit=2, user_window=3600, duplicate_window=3600)
+    yield queue
+    queue.close()
+
+
+def test_user_text_is_escaped(app):
+    [(text, completed)] = app.build_feedback_digest(
+        [row(1, "<b>жирный</b> & x > y", first_name="<Ann>", username="a&b")], 4000
+    )
+    assert "&lt;b&gt;жирный&lt;/b&gt; &amp; x &gt; y" in text
+    assert "&lt;Ann&gt;" in text and "@a&amp;b" in text
+    assert "<b>" not in text and "<Ann>" not in text
+    assert completed == [1]
+
+
+def test_long_message_is_split_into_continuation_pages(app):
+    limit = 500
+    # Экранирование удлиняет текст: каждый "<" превращается в "&lt;"
+    text = " ".join(f"слово<{number}>&" for number in range(300))
+    pages = app.build_feedback_digest([row(1, "коротко"), row(2, text), row(3, "ещё коротко")], limit)
+    assert len(pages) > 2
+    assert all(len(page) <= limit for page, _ in pages)
+    assert all("#2 (продолжение)" in page for page, _ in pages[1:])
+    # Запись попадает в completed только на той странице, где заканчивается
+    assert pages[0][1] == [1]
+    assert all(completed == [] for _, completed in pages[1:-1])
+    assert pages[-1][1] == [2, 3]
+    # Разрез приходится на пробел: ни одно слово не потеряно и не разорвано
+    assert sum(page.count("слово&lt;") for page, _ in pages) == 300
+
+
+def test_escaped_prefix_does_not_cut_an_entity(app):
+    escaped, rest = app._escaped_prefix("a&b&c&d", 10)
+    assert len(escaped) <= 10
+    assert escaped.count("&") == escaped.count("&amp;")
+    assert app.html.unescape(escaped) + rest == "a&b&c&d"
+
+
+def test_per_user_limit_and_duplicate_window(app, queue):
+    assert queue.submit(user(1), "Не работает  таймер") == app.FEEDBACK_QUEUED
+    # Тот же текст без учёта регистра и пробелов — дубликат, и в лимит он не засчитывается
+    assert queue.submit(user(1), "не работает таймер") == app.FEEDBACK_DUPLICATE
+    assert queue.submit(user(1), "Второе сообщение") == app.FEEDBACK_QUEUED
+    assert queue.submit(user(1), "Третье сообщение") == app.FEEDBACK_RATE_LIMITED
+    # У другого пользователя свой лимит, и повтор чужого текста — не дубликат
+    assert queue.submit(user(2), "Не работает таймер") == app.FEEDBACK_QUEUED
+    assert (queue.accepted, queue.duplicates, queue.rate_limited) == (3, 1, 1)
+    assert queue.pending_count() == 3
+
+
+def test_limit_and_duplicates_expire_after_their_windows(app, tmp_path):
+    queue = app.FeedbackQueue(str(tmp_path / "feedback.sqlite3"), user_limit=1, user_window=0.1, duplicate_window=0.1)
+    try:
+        assert queue.submit(user(1), "Привет") == app.FEEDBACK_QUEUED
+        assert queue.submit(user(1), "Привет") == app.FEEDBACK_DUPLICATE
+        assert queue.submit(user(1), "Другое") == app.FEEDBACK_RATE_LIMITED
+        time.sleep(0.15)
+        assert queue.submit(user(1), "Привет") == app.FEEDBACK_QUEUED
+    finally:
+        queue.close()
+
+
+def test_failed_page_is_resent_by_the_next_digest(app, queue, run, monkeypatch):
+    monkeypatch.setattr(app, "feedback_queue", queue)
+    monkeypatch.setattr(app, "FEEDBACK_DIGEST_INTERVAL", 0.3)
+    monkeypatch.setattr(app, "FEEDBACK_DIGEST_CHAR_LIMIT", 500)
+    monkeypatch.setattr(app.outbound_queue, "global_bucket", app.TokenBucket(UNLIMITED, UNLIMITED))
+    monkeypatch.setattr(app.outbound_queue, "chat_rate", UNLIMITED)
+    monkeypatch.setattr(app.outbound_queue, "chat_burst", UNLIMITED)
+    monkeypatch.setattr(app.outbound_queue, "chat_buckets", {})
+    queue.submit(user(1), "Первое")
+    queue.submit(user(2), "длинное " * 80)
+    queue.submit(user(3), "Третье")
+
+    def pending_ids():
+        return [feedback_id for (feedback_id, *_) in queue.pending(100)]
+
+    async def sends(server, count):
+        while len(server.calls_of("sendMessage")) < count:
+            await asyncio.sleep(0.01)
+        return [params["text"] for _, params in server.calls_of("sendMessage")]
+
+    async def scenario():
+        async with fake_telegram(app) as server:
+            sent = {"ok": True, "result": fake_result("sendMessage", {"chat_id": app.YOUR_TELEGRAM_ID}, iter([1]))}
+            failed = {"ok": False, "error_code": 400, "description": "Bad Request: test"}
+            server.scripted["sendMessage"] = [(200, sent), (400, failed)]
+            loop = asyncio.create_task(app.feedback_digest_loop())
+            try:
+                first_round = await sends(server, 2)
+                # Первая страница дошла: запись #1 отправлена; #2 и #3 заканчиваются на второй странице
+                assert "#1" in first_round[0] and "#2 (продолжение)" in first_round[1]
+                assert pending_ids() == [2, 3]
+                texts = await sends(server, 4)
+                while pending_ids():
+                    await asyncio.sleep(0.01)
+            finally:
+                loop.cancel()
+                await asyncio.gather(loop, return_exceptions=True)
+            second_round = texts[2:]
+            assert "#1" not in "".join(second_round)
+            assert "#2</strong>" in second_round[0] and "#3" in second_round[-1]
+
+    run(scenario())
@@ -0,0 +1,42 @@
+from conftest import callback_update, fake_telegram, feed
+
+
+def test_lru_evicts_the_least_recently_used_message(app):
+    fingerprints = app.MessageFingerprints(3)
+    for message_id in (1, 2, 3):
+        fingerprints.put(10, message_id, f"hash {message_id}")
+    # Обращение делает запись самой свежей, поэтому вытесняется сообщение 2, а не 1
+    assert fingerprints.get(10, 1) == "hash 1"
+    fingerprints.put(10, 4, "hash 4")
+    assert len(fingerprints) == 3
+    assert fingerprints.get(10, 2) is None
+    assert [fingerprints.get(10, message_id) for message_id in (1, 3, 4)] == ["hash 1", "hash 3", "hash 4"]
+
+
+def test_put_refreshes_an_existing_entry(app):
+    fingerprints = app.MessageFingerprints(2)
+    fingerprints.put(10, 1, "old")
+    fingerprints.put(10, 2, "hash 2")
+    fingerprints.put(10, 1, "new")
+    fingerprints.put(10, 3, "hash 3")
+    assert fingerprints.get(10, 1) == "new"
+    assert fingerprints.get(10, 2) is None
+
+
+def test_fingerprint_depends_on_text_and_markup(app):
+    fingerprint = app.MessageFingerprints.fingerprint
+    assert fingerprint("text", app.EVENTS_KEYBOARD, "HTML") == fingerprint("text", app.EVENTS_KEYBOARD, "HTML")
+    assert fingerprint("text", app.EVENTS_KEYBOARD, "HTML") != fingerprint("text", app.MAIN_MENU_KEYBOARD, "HTML")
+    assert fingerprint("text", None, "HTML") != fingerprint("other", None, "HTML")
+
+
+def test_returning_to_the_same_events_list_edits_the_message(app, run):
+    """События → Подписки → Назад: список не изменился, но сообщение показывает меню подписок и должно быть отредактировано."""
+    async def scenario():
+        async with fake_telegram(app) as server:
+            await app.build_events_snapshot()
+            for data in ("events", "subscriptions", "sub_event:0", "subscriptions", "events"):
+                await feed(app, callback_update(5, data, message_id=77))
+            assert len(server.calls_of("editMessageText")) == 5
+
+    run(scenario())
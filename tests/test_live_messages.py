@@ -0,0 +1,50 @@
+import asyncio
+
+from conftest import callback_update, fake_telegram, feed
+
+CHAT_ID = 9
+MESSAGE_ID = 88
+
+
+async def open_live_message(app):
+    await app.build_events_snapshot()
+    await feed(app, callback_update(CHAT_ID, "events", message_id=MESSAGE_ID))
+    await feed(app, callback_update(CHAT_ID, "live:on:0", message_id=MESSAGE_ID))
+    entry = app.live_messages.messages[CHAT_ID]
+    # Делаем вид, что с прошлого тика минутный текст изменился: иначе тикеру нечего править
+    entry.fingerprint = "previous minute"
+    app.message_fingerprints.put(CHAT_ID, MESSAGE_ID, "previous minute")
+    return entry
+
+
+def test_ticker_does_not_overwrite_another_menu(app, run):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            entry = await open_live_message(app)
+            await feed(app, callback_update(CHAT_ID, "subscriptions", message_id=MESSAGE_ID))
+            edits = len(server.calls_of("editMessageText"))
+            await app.live_messages._refresh(entry)
+            assert len(server.calls_of("editMessageText")) == edits
+            assert CHAT_ID not in app.live_messages.messages
+
+    run(scenario())
+
+
+def test_queued_ticker_edit_is_cancelled_when_the_user_opens_another_menu(app, run, monkeypatch):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            entry = await open_live_message(app)
+            # Глобальных токенов нет: правка тикера (низкий приоритет) ждёт в очереди
+            bucket = app.TokenBucket(2, 1)
+            bucket.tokens = 0
+            monkeypatch.setattr(app.outbound_queue, "global_bucket", bucket)
+            refresh = asyncio.create_task(app.live_messages._refresh(entry))
+            await asyncio.sleep(0.05)
+            await feed(app, callback_update(CHAT_ID, "subscriptions", message_id=MESSAGE_ID))
+            await asyncio.gather(refresh, return_exceptions=True)
+            await asyncio.sleep(0.6)
+            last_text = server.calls_of("editMessageText")[-1][1]["text"]
+            assert last_text == app.SUBSCRIPTIONS_TEXT
+            assert refresh.cancelled()
+
+    run(scenario())
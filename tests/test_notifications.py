@@ -0,0 +1,56 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+KEY = ("Matriarch", "Dam")
+
+
+def payload_starting_in(minutes):
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(minutes=minutes)
+    end = start + timedelta(minutes=30)
+    return {"data": [{"name": KEY[0], "map": KEY[1],
+                      "times": [{"start": start.strftime("%H:%M"), "end": end.strftime("%H:%M")}]}]}
+
+
+def test_rebuilt_schedule_does_not_repeat_an_announced_start(app, run, tmp_path, monkeypatch):
+    """Каждая смена расписания перестраивает кучу; уже объявленное начало не должно прийти снова."""
+    async def scenario():
+        scheduler = app.NotificationScheduler(10 * 60, app.SubscriptionStore(str(tmp_path / "subs.sqlite3")))
+        announced = []
+
+        async def record(due):
+            announced.extend(due)
+
+        scheduler._notify = record
+        payload = payload_starting_in(5)
+        monkeypatch.setattr(app, "_compiled_schedule", (payload, app.ScheduleIndex.from_payload(payload)))
+        scheduler.toggle(1, KEY)
+        task = asyncio.create_task(scheduler.run())
+        try:
+            for _ in range(3):
+                await asyncio.sleep(0.05)
+                # Тот же payload, но новый объект индекса — как после загрузки изменившегося ответа
+                monkeypatch.setattr(app, "_compiled_schedule", (payload, app.ScheduleIndex.from_payload(payload)))
+                scheduler._wakeup.set()
+            await asyncio.sleep(0.05)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            scheduler.store.close()
+        assert len(announced) == 1
+
+    run(scenario())
+
+
+def test_subscriptions_survive_a_restart(app, tmp_path):
+    path = str(tmp_path / "subs.sqlite3")
+    scheduler = app.NotificationScheduler(600, app.SubscriptionStore(path))
+    scheduler.toggle(1, KEY)
+    scheduler.toggle(2, KEY)
+    scheduler.toggle(2, ("Harvester", "Spaceport"))
+    scheduler.toggle(2, ("Harvester", "Spaceport"))
+    scheduler.store.close()
+
+    restarted = app.NotificationScheduler(600, app.SubscriptionStore(path))
+    restarted.load()
+    assert restarted.subscribers == {KEY: {1, 2}}
+    restarted.store.close()
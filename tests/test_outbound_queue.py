@@ -0,0 +1,135 @@
+import time
+import asyncio
+
+import pytest
+from aiogram.methods import SendMessage
+
+from conftest import fake_telegram
+
+UNLIMITED = 10 ** 6
+
+
+@pytest.fixture
+def queue(app, monkeypatch):
+    """Исходящая очередь бота с лимитами, которые тест задаёт сам; после теста прежние значения возвращаются."""
+    queue = app.outbound_queue
+    monkeypatch.setattr(queue, "global_bucket", app.TokenBucket(UNLIMITED, UNLIMITED))
+    monkeypatch.setattr(queue, "chat_rate", UNLIMITED)
+    monkeypatch.setattr(queue, "chat_burst", UNLIMITED)
+    monkeypatch.setattr(queue, "chat_buckets", {})
+    return queue
+
+
+def empty_global_bucket(app, queue, rate):
+    bucket = app.TokenBucket(rate, 1)
+    bucket.tokens = 0
+    queue.global_bucket = bucket
+
+
+def texts(server):
+    return [params["text"] for _, params in server.calls_of("sendMessage")]
+
+
+def test_interactive_replies_go_before_bulk_sends(app, queue, run):
+    async def bulk(number):
+        app.outbound_priority.set(app.PRIORITY_BULK)
+        await app.bot.send_message(chat_id=100 + number, text="bulk")
+
+    async def scenario():
+        async with fake_telegram(app) as server:
+            empty_global_bucket(app, queue, 20)
+            tasks = [asyncio.create_task(bulk(number)) for number in range(3)]
+            tasks += [asyncio.create_task(app.bot.send_message(chat_id=200 + number, text="interactive"))
+                      for number in range(3)]
+            await asyncio.gather(*tasks)
+            assert texts(server) == ["interactive"] * 3 + ["bulk"] * 3
+
+    run(scenario())
+
+
+def test_callback_answers_do_not_wait_for_a_global_token(app, queue, run):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            # Токен раз в полсекунды, а в очереди уже три сообщения
+            empty_global_bucket(app, queue, 2)
+            sends = [asyncio.create_task(app.bot.send_message(chat_id=100 + number, text="bulk")) for number in range(3)]
+            await asyncio.sleep(0)
+            started = time.monotonic()
+            await app.bot.answer_callback_query("1")
+            assert time.monotonic() - started < 0.3
+            assert len(server.calls_of("sendMessage")) <= 1
+            await asyncio.gather(*sends)
+
+    run(scenario())
+
+
+def test_per_chat_limit_does_not_hold_other_chats(app, queue, run):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            queue.chat_rate = 10
+            queue.chat_burst = 2
+            busy = [asyncio.create_task(app.bot.send_message(chat_id=1, text=f"busy {number}")) for number in range(6)]
+            other = asyncio.create_task(app.bot.send_message(chat_id=2, text="other"))
+            await asyncio.gather(*busy, other)
+            arrivals = {params["text"]: at for at, params in server.calls_of("sendMessage")}
+            busy_times = sorted(at for text, at in arrivals.items() if text.startswith("busy"))
+            # 2 сразу, остальные 4 — по 10 в секунду
+            assert busy_times[-1] - busy_times[0] >= 0.35
+            assert arrivals["other"] < busy_times[2]
+
+    run(scenario())
+
+
+def test_global_limit_spaces_sends_across_chats(app, queue, run):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            queue.global_bucket = app.TokenBucket(20, 5)
+            await asyncio.gather(*(app.bot.send_message(chat_id=100 + number, text="x") for number in range(25)))
+            arrivals = sorted(at for at, _ in server.calls_of("sendMessage"))
+            assert len(arrivals) == 25
+            # 5 подряд, остальные 20 — по 20 в секунду
+            assert arrivals[-1] - arrivals[0] >= 0.9
+
+    run(scenario())
+
+
+def test_retry_after_is_honored_for_the_chat_only(app, queue, run):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            server.scripted["sendMessage"] = [(429, {
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })]
+            retries_before = queue.retry_after
+            flooded = asyncio.create_task(app.bot.send_message(chat_id=1, text="flooded"))
+            while not server.calls_of("sendMessage"):
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(app.bot.send_message(chat_id=2, text="other"), 0.5)
+            assert not flooded.done()
+            message = await flooded
+            assert message.text == "flooded"
+            attempts = [at for at, params in server.calls_of("sendMessage") if params["text"] == "flooded"]
+            assert len(attempts) == 2
+            assert attempts[1] - attempts[0] >= 0.95
+            assert queue.retry_after == retries_before + 1
+
+    run(scenario())
+
+
+def test_stop_cancels_requests_in_flight(app, queue, run):
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hanging_request(bot, method):
+            started.set()
+            await asyncio.Event().wait()
+
+        call = asyncio.create_task(queue(hanging_request, app.bot, SendMessage(chat_id=1, text="x")))
+        await started.wait()
+        assert len(queue._inflight) == 1
+        await queue.stop()
+        assert not queue._inflight
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    run(scenario())
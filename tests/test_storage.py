@@ -0,0 +1,96 @@
+import time
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+
+def storage_key(user_id):
+    return StorageKey(bot_id=123456, chat_id=user_id, user_id=user_id)
+
+
+def open_storage(app, path, ttl=3600, cache_size=1000):
+    return app.SQLiteStorage(str(path), ttl, cache_size, flush_interval=0.05, flush_batch=500)
+
+
+def test_state_survives_a_restart(app, run, tmp_path):
+    path = tmp_path / "fsm.sqlite3"
+
+    async def scenario():
+        storage = open_storage(app, path)
+        await storage.set_state(storage_key(1), app.Feedback.waiting_for_message)
+        await storage.set_data(storage_key(1), {"draft": "привет"})
+        await storage.set_state(storage_key(2), app.Feedback.waiting_for_message)
+        await storage.set_state(storage_key(2), None)
+        await storage.close()
+
+        restarted = open_storage(app, path)
+        try:
+            assert await restarted.get_state(storage_key(1)) == app.Feedback.waiting_for_message.state
+            assert await restarted.get_data(storage_key(1)) == {"draft": "привет"}
+            assert await restarted.get_state(storage_key(2)) is None
+        finally:
+            await restarted.close()
+
+    run(scenario())
+
+
+def test_abandoned_state_expires(app, run, tmp_path):
+    async def scenario():
+        storage = open_storage(app, tmp_path / "fsm.sqlite3", ttl=0.1)
+        try:
+            await storage.set_state(storage_key(1), app.Feedback.waiting_for_message)
+            await asyncio.sleep(0.2)
+            assert await storage.get_state(storage_key(1)) is None
+        finally:
+            await storage.close()
+
+    run(scenario())
+
+
+def test_writers_wait_when_the_database_falls_behind(app, run, tmp_path):
+    async def scenario():
+        storage = app.SQLiteStorage(str(tmp_path / "fsm.sqlite3"), 3600, 1000, flush_interval=0.05, flush_batch=10)
+        write = storage._write
+
+        def slow_write(batch):
+            time.sleep(0.02)
+            write(batch)
+
+        storage._write = slow_write
+        try:
+            for user_id in range(300):
+                await storage.set_state(storage_key(user_id), app.Feedback.waiting_for_message)
+                assert len(storage._dirty) < 4 * storage.flush_batch
+        finally:
+            await storage.close()
+
+    run(scenario())
+
+
+def test_memory_stays_bounded_after_a_million_users(app, run, tmp_path):
+    """Миллион пользователей открывают обратную связь по одному разу: в памяти не больше cache_size записей."""
+    users = 1_000_000
+    cache_size = 1000
+
+    async def scenario():
+        storage = open_storage(app, tmp_path / "fsm.sqlite3", cache_size=cache_size)
+        peak_pending = 0
+        try:
+            for user_id in range(users):
+                await storage.set_state(storage_key(user_id), app.Feedback.waiting_for_message)
+                if user_id % 100 == 0:
+                    # Как между обновлениями: даём пакетной записи поработать
+                    await asyncio.sleep(0)
+                    peak_pending = max(peak_pending, len(storage._dirty) + len(storage._flushing))
+                    assert len(storage._cache) <= cache_size
+            await storage.flush()
+            assert len(storage._cache) <= cache_size
+            assert not storage._dirty
+            # Несохранённых записей — порядка нескольких пачек, а не всё множество пользователей
+            assert peak_pending < 20 * storage.flush_batch
+            count = storage._reader.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+            assert count == users
+        finally:
+            await storage.close()
+
+    run(scenario(), timeout=300)
@@ -0,0 +1,34 @@
+import time
+import asyncio
+
+from conftest import callback_update, fake_telegram, feed, message_update
+
+
+def test_start_is_answered_while_upstream_fetch_hangs(app, run):
+    """Медленный MetaForge держит загрузку событий, а 50 одновременных /start всё равно получают ответ."""
+    async def scenario():
+        async with fake_telegram(app) as server:
+            server.upstream_released.clear()
+            app.current_snapshot = None
+            app.events_cache.value = None
+            app.events_cache.fetched_at = None
+
+            events = asyncio.create_task(feed(app, callback_update(1, "events")))
+            while server.upstream_calls == 0:
+                await asyncio.sleep(0.01)
+
+            started = time.monotonic()
+            await asyncio.gather(*(feed(app, message_update(1000 + number, "/start")) for number in range(50)))
+            elapsed = time.monotonic() - started
+
+            assert len(server.calls_of("sendMessage")) == 50
+            assert not events.done(), "загрузка событий должна всё ещё ждать MetaForge"
+            # 50 сообщений при лимите 30/с — меньше двух секунд; цикл событий не блокировался
+            assert elapsed < 5
+
+            server.upstream_released.set()
+            await events
+            assert server.calls_of("editMessageText")
+            assert server.upstream_calls == 1
+
+    run(scenario())
@@ -0,0 +1,114 @@
+import sys
+import json
+import asyncio
+
+from conftest import fake_telegram, feed, message_update
+
+
+def test_updates_for_a_down_worker_are_kept_until_it_restarts(app, run, tmp_path, monkeypatch):
+    received = tmp_path / "stdin.bin"
+    spawn = asyncio.create_subprocess_exec
+
+    async def fake_worker(*args, **kwargs):
+        # Вместо bot.py — процесс, который просто сохраняет всё, что получил в stdin
+        kwargs.pop("env", None)
+        code = f"import sys; open({str(received)!r}, 'wb').write(sys.stdin.buffer.read())"
+        return await spawn(sys.executable, "-c", code, **kwargs)
+
+    async def scenario():
+        monkeypatch.setattr(app.asyncio, "create_subprocess_exec", fake_worker)
+        worker = app.WorkerProcess(0, 1, str(tmp_path / "snapshot"))
+        # Воркер ещё не запущен (или упал и ждёт перезапуска)
+        worker.send(b'{"update_id": 1}\n')
+        worker.send(b'{"update_id": 2}\n')
+        assert worker.dropped == 0 and len(worker.backlog) == 2
+        await worker.start()
+        worker.send(b'{"update_id": 3}\n')
+        worker.process.stdin.close()
+        await worker.process.wait()
+        assert received.read_bytes() == b'{"update_id": 1}\n{"update_id": 2}\n{"update_id": 3}\n'
+        assert worker.sent == 3 and not worker.backlog
+
+    run(scenario())
+
+
+def test_backlog_is_bounded(app, monkeypatch):
+    monkeypatch.setattr(app, "WORKER_BACKLOG_LIMIT", 2)
+    worker = app.WorkerProcess(0, 1, "")
+    for number in range(5):
+        worker.send(f"{number}\n".encode())
+    assert list(worker.backlog) == [b"3\n", b"4\n"]
+    assert worker.dropped == 3
+
+
+def test_shared_preferences_are_seen_by_every_worker(app, tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    first, second = app.PreferencesStore(path, shared=True), app.PreferencesStore(path, shared=True)
+    try:
+        assert second.get(7) == app.DEFAULT_PREFERENCES
+        preferences = app.make_preferences(1, 0b11, 0)
+        first.set(7, preferences)
+        assert second.get(7) == preferences
+        assert len(second) == 1
+        first.set(7, app.DEFAULT_PREFERENCES)
+        assert second.get(7) == app.DEFAULT_PREFERENCES
+    finally:
+        first.close()
+        second.close()
+
+
+def test_supervisor_resets_its_cache_on_invalidate_command(app, monkeypatch):
+    monkeypatch.setattr(app.events_cache, "fetched_at", 123.0)
+    pool = app.WorkerPool(2, "")
+    try:
+        pool.dispatch(message_update(1, "/invalidate_cache"))
+        assert app.events_cache.fetched_at == 123.0 and not app.shared_snapshot_refresh.is_set()
+        pool.dispatch(message_update(int(app.YOUR_TELEGRAM_ID), "/invalidate_cache"))
+        assert app.events_cache.fetched_at is None and app.shared_snapshot_refresh.is_set()
+        # Само обновление всё равно уходит воркеру: ответ администратору отправляет он
+        assert sum(len(worker.backlog) for worker in pool.workers) == 2
+    finally:
+        app.shared_snapshot_refresh.clear()
+
+
+def test_worker_answers_invalidate_without_touching_its_cache(app, run, monkeypatch):
+    async def scenario():
+        async with fake_telegram(app) as server:
+            monkeypatch.setattr(app, "IS_WORKER", True)
+            monkeypatch.setattr(app.events_cache, "fetched_at", 123.0)
+            await feed(app, message_update(int(app.YOUR_TELEGRAM_ID), "/invalidate_cache"))
+            assert app.events_cache.fetched_at == 123.0
+            [(_, params)] = server.calls_of("sendMessage")
+            assert params["text"].startswith("Кэш событий сброшен")
+
+    run(scenario())
+
+
+def test_invalidation_republishes_without_waiting_for_the_interval(app, run, monkeypatch):
+    class Buffer:
+        def __init__(self):
+            self.published = []
+
+        def publish(self, blob):
+            self.published.append(json.loads(blob))
+
+    async def scenario():
+        async with fake_telegram(app) as server:
+            monkeypatch.setattr(app, "EVENTS_REFRESH_INTERVAL", 3600)
+            for name in ("value", "fetched_at", "updated_at"):
+                monkeypatch.setattr(app.events_cache, name, getattr(app.events_cache, name))
+            buffer = Buffer()
+            publisher = asyncio.create_task(app.shared_snapshot_publisher_loop(buffer))
+            try:
+                while not buffer.published:
+                    await asyncio.sleep(0.01)
+                server.payload = {"data": []}
+                app.invalidate_shared_snapshot()
+                while len(buffer.published) < 2:
+                    await asyncio.sleep(0.01)
+                assert buffer.published[-1]["payload"] == {"data": []}
+            finally:
+                publisher.cancel()
+                await asyncio.gather(publisher, return_exceptions=True)
+
+    run(scenario(), timeout=10)